@@ -4,12 +4,40 @@ Minera Centinela - GSdSO
 Análisis en múltiples pasadas con Claude Sonnet 4
 """
 
-from datetime import datetime
+from datetime import timedelta
 from typing import Dict, List, Tuple
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import json
 import os
+import re
 import anthropic
 
+from tracing import span, current_span, get_run_id
+from budget import get_budget, estimate_tokens, PRIORITY_REQUIRED, PRIORITY_HIGH, PRIORITY_LOW
+from llm_gateway import create_claude_message, resolve_model, escalation_model
+from trend_engine import build_trends, insert_trends, TRENDS_UNAVAILABLE
+from report_tables import insert_tables
+from extraction_store import persist_extractions
+from hierarchical_summary import should_use_hierarchy, build_hierarchical_context
+from context_packing import pack_messages
+from incremental_refresh import merge_analyses
+from grupos_config import GRUPOS_EMPRESAS
+import replay
+
+# Tamaño de contexto y tokens de salida por defecto de las pasadas
+CONTEXT_MAX_CHARS = 50000
+ANALYSIS_MAX_TOKENS = 4000
+SYNTHESIS_MAX_TOKENS = 8000
+
+# "sections": síntesis por secciones en paralelo y resumen ejecutivo al final; "single": una llamada
+SYNTHESIS_MODE = os.environ.get("SYNTHESIS_MODE", "sections").lower()
+SYNTHESIS_MAX_WORKERS = int(os.environ.get("SYNTHESIS_MAX_WORKERS", "8"))
+# Datos de las pasadas en los prompts de síntesis: "compact" (tablas sin nulos ni textos repetidos) o "json"
+SYNTHESIS_ENCODING = os.environ.get("SYNTHESIS_ENCODING", "compact").lower()
+DEDUP_MIN_CHARS = 24  # Largo mínimo de un texto para reemplazar sus repeticiones por una referencia
+
 # Cliente de Anthropic (Claude)
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
 claude_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
@@ -20,45 +48,10 @@ def format_messages_for_context(messages: list, max_chars: int = 50000) -> str:
     """
     Formatea los mensajes en un contexto legible para la IA.
     Incluye información sobre archivos adjuntos.
+    Si los mensajes no caben en max_chars, se seleccionan por relevancia
+    (ver context_packing.py, CONTEXT_PACKING).
     """
-    context_parts = []
-    current_length = 0
-    
-    for msg in messages:
-        timestamp = msg.get('fecha_hora', 'N/A')
-        sender = msg.get('remitente', 'Desconocido')
-        content = msg.get('contenido_texto', '[Sin texto]')
-        is_image = msg.get('es_imagen', False)
-        url_storage = msg.get('url_storage', '')
-        
-        # Formato con remitente
-        msg_text = f"\n[{timestamp}] {sender}"
-        
-        # Identificar tipo de archivo adjunto
-        if url_storage:
-            if '.mp4' in url_storage.lower() or '.mov' in url_storage.lower():
-                msg_text += " [🎬 Video adjunto]"
-            elif is_image or any(ext in url_storage.lower() for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']):
-                msg_text += " [📷 Imagen adjunta]"
-            elif '.pdf' in url_storage.lower():
-                msg_text += " [📄 PDF adjunto]"
-            elif any(ext in url_storage.lower() for ext in ['.xlsx', '.xls']):
-                msg_text += " [📊 Excel adjunto]"
-            elif any(ext in url_storage.lower() for ext in ['.docx', '.doc']):
-                msg_text += " [📝 Word adjunto]"
-            else:
-                msg_text += " [📎 Archivo adjunto]"
-        
-        msg_text += f":\n{content}\n"
-        
-        if current_length + len(msg_text) > max_chars:
-            context_parts.append("\n... (mensajes adicionales omitidos por límite de longitud)")
-            break
-        
-        context_parts.append(msg_text)
-        current_length += len(msg_text)
-    
-    return "".join(context_parts)
+    return pack_messages(messages, max_chars)
 
 # ----------------------------------------------------
 # PROMPTS ESPECIALIZADOS POR CATEGORÍA
@@ -87,8 +80,9 @@ Analiza las siguientes conversaciones y extrae TODA la información sobre:
 **FORMATO DE SALIDA (JSON):**
 
 Debes responder con un objeto JSON con la siguiente estructura:
-- quiebres_plan: array de objetos con qp_numero, fecha, area, equipo, razon, demora_horas, impacto, evidencia
+- quiebres_plan: array de objetos con qp_numero, fecha, area, equipo, razon, demora_horas, impacto, responsable, reportado_por, estado, evidencia
 - demoras: array de objetos con actividad, fecha, demora_horas, causa, responsable, impacto
+  (actividad completa: nombre del trabajo + equipo/TAG + ubicación específica + contexto, ej: "Cambio motor doble eje 762-ER-001 en sala eléctrica SSEE sector norte", no solo "Cambio motor")
 - emergentes: array de objetos con actividad, prioridad, desplazo_a, ejecutor
 
 Conversaciones:
@@ -180,10 +174,12 @@ Analiza las conversaciones y extrae TODA información relacionada con seguridad:
 
 **FORMATO DE SALIDA:**
 Responde con un objeto JSON que contenga:
-- incidentes: array con fecha, hora, tipo, descripcion, afectado, empresa, lesion, derivacion, causa_inmediata, causa_raiz, dias_perdidos
-- hallazgos: array con fecha, tipo, descripcion, ubicacion, severidad, riesgo, detectado_por, accion_inmediata, estado
+- incidentes: array con fecha, hora, tipo, descripcion, afectado, empresa, reportado_por, lesion, derivacion, causa_inmediata, causa_raiz, accion_correctiva, dias_perdidos, estado
+- hallazgos: array con fecha, tipo, descripcion, ubicacion, empresa, severidad, riesgo, detectado_por, accion_inmediata, estado
 - permisos: array con tipo, actividad, ubicacion, estado, validez
-- compromisos: array con accion, responsable, plazo, estado
+- compromisos: array con accion, responsable, plazo, origen, estado
+
+En reportado_por / detectado_por indica el remitente del mensaje que informó el evento.
 
 Conversaciones:
 {conversaciones}
@@ -248,7 +244,7 @@ Estructura JSON:
   * target: (null si no se menciona)
   * desviacion: (null si no hay target)
   * desviacion_porcentaje: (null si no hay target)
-  * fecha, turno
+  * fecha, turno, observaciones
   
 - parametros_proceso: array con:
   * equipo, parametro, valor, unidad
@@ -263,6 +259,7 @@ Estructura JSON:
   * disponibilidad_porcentaje: (null si no se calcula)
   * target_porcentaje: (null si no se menciona)
   * causas_detencion: (lista de causas mencionadas)
+  * empresa, reportado_por
   
 - consumos: array con:
   * area, parametro, valor, unidad, periodo, fecha
@@ -272,6 +269,22 @@ Conversaciones:
 
 Responde SOLO con el JSON válido, sin explicaciones adicionales ni bloques de código markdown."""
 
+# Claves JSON que debe contener la salida de cada pasada (validación/escalamiento)
+PASS_EXPECTED_KEYS = {
+    "pass.demoras": ["quiebres_plan", "demoras", "emergentes"],
+    "pass.actividades": ["actividades"],
+    "pass.seguridad": ["incidentes", "hallazgos", "permisos", "compromisos"],
+    "pass.produccion": ["produccion", "parametros_proceso", "disponibilidad", "consumos"],
+}
+
+# Título de cada pasada en los datos de entrada de la síntesis
+PASS_TITLES = {
+    "pass.demoras": "Demoras y QP",
+    "pass.actividades": "Actividades",
+    "pass.seguridad": "Seguridad",
+    "pass.produccion": "Producción",
+}
+
 # ----------------------------------------------------
 # PROMPT FINAL DE SÍNTESIS
 # ----------------------------------------------------
@@ -287,6 +300,7 @@ Tu tarea: Sintetizar los análisis detallados en un **Reporte Ejecutivo Técnico
 3. **TRAZABILIDAD**: Identifica QUIÉN reportó cada evento (busca nombres de usuarios/remitentes en datos)
 4. **NO MATRICES INÚTILES**: ELIMINA la "Matriz de Actividades por Superintendencia" - no aporta valor
 5. **ARCHIVOS ADJUNTOS**: Lista TODOS los PDFs, imágenes, documentos mencionados con sus nombres exactos
+6. **TABLAS AUTOMÁTICAS**: Las líneas `[[TABLA_...]]` se reemplazan por tablas generadas desde los datos. Escríbelas tal cual, en su propia línea, y NO reproduzcas su contenido como tabla: aporta solo el análisis narrativo
 
 **DATOS DE ENTRADA:**
 
@@ -298,6 +312,8 @@ Tu tarea: Sintetizar los análisis detallados en un **Reporte Ejecutivo Técnico
 
 {analisis_produccion}
 
+{tendencias}
+
 ---
 
 # Reporte Ejecutivo Técnico - Minera Centinela
@@ -318,19 +334,13 @@ Tu tarea: Sintetizar los análisis detallados en un **Reporte Ejecutivo Técnico
 
 ### 2.1 Quiebres de Plan (QP)
 
-**Si hay QPs, usa esta tabla:**
-| QP Número | Área | Fecha/Hora | Equipo/TAG | Horas Perdidas | Causa Raíz Específica | Impacto Cuantificado | Responsable | Reportado por | Estado |
+[[TABLA_QP]]
 
-**Si NO hay QPs explícitos:** Indicar claramente "No se reportaron Quiebres de Plan formalizados en el período analizado"
+Si hay QPs, comenta en 2-3 frases los de mayor impacto en el plan.
 
 ### 2.2 Demoras Operacionales
 
-**TABLA CON MÁXIMO DETALLE:**
-| Actividad Completa (incluir: nombre trabajo + equipo/TAG + ubicación específica + contexto) | Demora (horas exactas) | Causa Raíz Detallada | Impacto Cuantificado | Empresa/Responsable/Usuario | Fecha/Hora |
-
-**EJEMPLO DE DETALLE REQUERIDO:**
-✅ CORRECTO: "Cambio motor doble eje `762-ER-001` ubicado en sala eléctrica SSEE sector norte, requiere desconexión red contra incendio por procedimiento seguridad"
-❌ INCORRECTO: "Cambio motor"
+[[TABLA_DEMORAS]]
 
 Incluir análisis de causas recurrentes con porcentajes calculados.
 
@@ -426,20 +436,15 @@ Para CADA equipo mencionado:
 
 ### 4.1 Incidentes
 
-**TABLA COMPLETA:**
-| Fecha/Hora Exacta | Tipo | Descripción Técnica Detallada | Afectado (Nombre Completo) | Empresa del Afectado | Reportado por (Usuario/Remitente) | Causa Raíz | Acción Correctiva | Días Perdidos | Estado |
-
-**IMPORTANTE:** SIEMPRE incluir quién reportó (buscar en remitente de mensajes)
+[[TABLA_INCIDENTES]]
 
 ### 4.2 Hallazgos de Seguridad
 
-**TABLA:**
-| Fecha/Hora | Descripción Específica del Hallazgo | Ubicación Exacta (Planta/Área/TAG) | Empresa Responsable Área | Detectado/Reportado por (Usuario) | Severidad | Riesgo Específico | Acción Inmediata Tomada | Estado Actual |
+[[TABLA_HALLAZGOS]]
 
 ### 4.3 Compromisos Pendientes
 
-**TABLA CON CONTEXTO:**
-| Compromiso (descripción completa) | Responsable (Nombre + Cargo + Empresa) | Plazo Específico | Origen del Compromiso (qué evento/incidente lo generó) | Estado |
+[[TABLA_COMPROMISOS]]
 
 ### 4.4 Indicadores
 
@@ -454,23 +459,13 @@ Para CADA equipo mencionado:
 
 ### 5.1 Producción
 
-**🚨 REGLA: NO INCLUIR COLUMNAS "TARGET" NI "DESVIACIÓN" A MENOS QUE ESTÉN EXPLÍCITAS EN LOS DATOS**
-
-**TABLA SIMPLIFICADA (usar siempre):**
-| Equipo/TAG | Parámetro | Valor Real | Unidad | Fecha/Turno | Observaciones Técnicas |
-
-**EJEMPLO:**
-| `UF-A Moly` | Caudal | 68 | m³/h | 09/12 Turno Día | Operando bajo frecuencia nominal (40 Hz vs diseño 49 Hz) |
+[[TABLA_PRODUCCION]]
 
-**SOLO SI** el target está explícito en datos, agregar columnas:
-| Equipo/TAG | Parámetro | Valor Real | Target Reportado | Desviación | Unidad | Fecha/Turno |
+Comenta solo los valores que destaquen (sin inventar targets ni desviaciones).
 
 ### 5.2 Disponibilidad de Equipos Críticos
 
-**🚨 NO INCLUIR COLUMNA "TARGET" NI "DISPONIBILIDAD %"**
-
-**TABLA SIMPLIFICADA:**
-| Equipo/TAG | Tiempo Operativo (h) | Tiempo Detenido (h) | Causa Principal Detención Detallada | Empresa Responsable | Reportado por |
+[[TABLA_DISPONIBILIDAD]]
 
 ### 5.3 Parámetros Fuera de Rango
 
@@ -482,15 +477,11 @@ Si no hay rangos: "No se reportaron rangos normales de operación para comparaci
 
 ## 6. ANÁLISIS DE TENDENCIAS
 
-### 6.1 Equipos con Fallas Recurrentes
-
-Lista numerada:
-1. [Equipo/Sistema]: [Patrón identificado] - [Frecuencia] - [Impacto acumulado] - [Acción sugerida]
+Escribe SOLO la siguiente línea (las tablas precalculadas se insertan automáticamente, NO las copies):
 
-### 6.2 Áreas con Mayor Actividad
+[[TABLAS_TENDENCIAS]]
 
-Ranking:
-1. [Área]: [Cantidad trabajos] - [Descripción actividades principales] - [Empresas involucradas]
+Usa las TENDENCIAS PRECALCULADAS de los datos de entrada para priorizar las recomendaciones de la sección 7.
 
 ---
 
@@ -556,7 +547,7 @@ Especificaciones, procedimientos, análisis metalúrgicos, protocolos mencionado
 
 Basado en análisis de comunicaciones operacionales mediante:
 - **Vectorización:** OpenAI text-embedding-3-small (1,536 dimensiones)
-- **Análisis Multi-pasada:** Anthropic Claude Sonnet 4
+- **Análisis Multi-pasada:** Anthropic Claude (modelo rápido para extracción, Sonnet 4 para síntesis)
   - Pasada 1: Demoras y Quiebres de Plan
   - Pasada 2: Actividades y Ubicaciones
   - Pasada 3: Seguridad y Medio Ambiente
@@ -588,6 +579,93 @@ Minera Centinela - Antofagasta Minerals
 
 Genera el reporte ahora:"""
 
+# ----------------------------------------------------
+# SÍNTESIS POR SECCIONES
+# ----------------------------------------------------
+
+# Las instrucciones de cada sección se toman de PROMPT_SINTESIS_FINAL (misma
+# plantilla en ambos modos). Cada sección recibe solo las pasadas que necesita.
+SYNTHESIS_SECTIONS = [
+    {"clave": "cumplimiento", "seccion": "2", "pasadas": ["pass.demoras"], "max_tokens": 2500},
+    {"clave": "ejecucion.sstt", "seccion": "3", "superintendencia": "SSTT",
+     "pasadas": ["pass.actividades", "pass.demoras"], "max_tokens": 3000},
+    {"clave": "ejecucion.iiee", "seccion": "3", "superintendencia": "IIEE",
+     "pasadas": ["pass.actividades", "pass.produccion", "pass.demoras"], "max_tokens": 3000},
+    {"clave": "seguridad", "seccion": "4", "pasadas": ["pass.seguridad"], "max_tokens": 1500},
+    {"clave": "indicadores", "seccion": "5", "pasadas": ["pass.produccion"], "max_tokens": 1000},
+    {"clave": "recomendaciones", "seccion": "7", "tendencias": True,
+     "pasadas": ["pass.demoras", "pass.actividades", "pass.seguridad", "pass.produccion"], "max_tokens": 2500},
+    {"clave": "anexos", "seccion": "8",
+     "pasadas": ["pass.demoras", "pass.actividades", "pass.seguridad", "pass.produccion"], "max_tokens": 1500},
+]
+SUMMARY_MAX_TOKENS = 1500
+
+PROMPT_SINTESIS_SECCION = """{reglas}
+
+**DATOS DE ENTRADA:**
+
+{datos}
+
+---
+
+Genera SOLO la sección "{titulo}" del Reporte Ejecutivo Técnico (período: {periodo_texto}).
+Las demás secciones las redactan otros analistas en paralelo: no las incluyas ni repitas el encabezado del reporte.
+{alcance}
+**INSTRUCCIONES DE LA SECCIÓN:**
+
+{instrucciones}
+
+{instrucciones_finales}
+
+Comienza directamente con el encabezado `{encabezado}`:"""
+
+PROMPT_RESUMEN_EJECUTIVO = """{reglas}
+
+**SECCIONES YA REDACTADAS DEL REPORTE:**
+
+{secciones}
+
+---
+
+Genera SOLO la sección "1. RESUMEN EJECUTIVO" del Reporte Ejecutivo Técnico (período: {periodo_texto}),
+a partir de las secciones anteriores. No agregues hechos ni números que no aparezcan en ellas.
+
+**INSTRUCCIONES DE LA SECCIÓN:**
+
+{instrucciones}
+
+{instrucciones_finales}
+
+Comienza directamente con el encabezado `## 1. RESUMEN EJECUTIVO`:"""
+
+def _split_synthesis_template(template: str) -> dict:
+    """
+    Divide PROMPT_SINTESIS_FINAL en reglas, secciones numeradas, firma e
+    instrucciones finales.
+    """
+    inicio = template.index("## 1. RESUMEN EJECUTIVO")
+    firma = template.index("**FIRMA DEL REPORTE:**")
+    finales = template.index("**INSTRUCCIONES FINALES:**")
+    
+    secciones = {}
+    for bloque in re.split(r"\n(?=## \d\. )", template[inicio:firma]):
+        bloque = bloque.strip().rstrip("-").strip()
+        encabezado = bloque.split("\n", 1)[0]
+        secciones[encabezado[3]] = {"encabezado": encabezado, "instrucciones": bloque}
+    
+    return {
+        "reglas": template[:template.index("**DATOS DE ENTRADA:**")].strip(),
+        "secciones": secciones,
+        "superintendencias": {
+            codigo: encabezado
+            for encabezado, codigo in re.findall(r"^(### SUPERINTENDENCIA: .+\((\w+)\))$", template, re.M)
+        },
+        "firma": template[firma + len("**FIRMA DEL REPORTE:**"):finales].strip().strip("-").strip(),
+        "instrucciones_finales": template[finales:template.index("Genera el reporte ahora:")].strip()
+    }
+
+SYNTHESIS_TEMPLATE = _split_synthesis_template(PROMPT_SINTESIS_FINAL)
+
 def generate_advanced_technical_report(messages: list, groups_data: dict, periodo_texto: str) -> str:
     """
     Genera reporte técnico avanzado usando análisis multi-pasada con Claude.
@@ -600,105 +678,511 @@ def generate_advanced_technical_report(messages: list, groups_data: dict, period
     Returns:
         Reporte en formato Markdown
     """
+    return analyze_messages(messages, periodo_texto)[0]
+
+def analyze_messages(messages: list, periodo_texto: str, previous_analyses: dict = None,
+                     run_id: str = None, db_client=None, total_mensajes: int = None) -> tuple:
+    """
+    Pasadas de extracción sobre los mensajes y síntesis del reporte.
+    
+    Con previous_analyses (actualización incremental, ver incremental_refresh.py)
+    las pasadas procesan solo los mensajes nuevos y su extracción se une a la
+    acumulada antes de la síntesis.
+    
+    Args:
+        messages: Mensajes a analizar (la ventana completa o solo el delta)
+        periodo_texto: Descripción del período
+        previous_analyses: Extracción acumulada de ejecuciones anteriores del día
+        run_id: Ejecución a la que se atribuyen las tendencias (por defecto la actual)
+        db_client: Cliente Supabase para persistir la extracción (sin cliente no se persiste)
+        total_mensajes: Mensajes cubiertos por el reporte, para la firma (por defecto len(messages))
+        
+    Returns:
+        (reporte en Markdown, extracción acumulada por pasada)
+    """
+    
+    # Presupuesto: reducir contexto si las 4 pasadas + síntesis no caben (paso 1 de degradación)
+    prompts_pasadas = [PROMPT_ANALISIS_DEMORAS_QP, PROMPT_ANALISIS_ACTIVIDADES,
+                       PROMPT_ANALISIS_SEGURIDAD, PROMPT_ANALISIS_PRODUCCION_KPI]
+    reserve_tokens, reserve_output_tokens = synthesis_reserve_tokens()
+    max_chars = get_budget().fit_context_chars(
+        CONTEXT_MAX_CHARS,
+        calls=len(prompts_pasadas),
+        overhead_chars=max(len(p) for p in prompts_pasadas),
+        output_tokens_per_call=ANALYSIS_MAX_TOKENS,
+        reserve_tokens=reserve_tokens,
+        reserve_output_tokens=reserve_output_tokens,
+        model=resolve_model("pass")
+    )
     
     # Preparar conversaciones
-    conversaciones = format_messages_for_context(messages, max_chars=50000)
+    with span("format_context") as s:
+        if should_use_hierarchy(messages, max_chars, format_messages_for_context):
+            # Ventanas de varios días: árbol de resúmenes en vez de truncar cronológicamente
+            conversaciones = build_hierarchical_context(
+                messages, max_chars, claude_client, format_messages_for_context
+            )
+            s.set(hierarchical=True)
+        else:
+            conversaciones = format_messages_for_context(messages, max_chars=max_chars)
+        s.add(rows=len(messages))
+        s.set(chars=len(conversaciones))
     
     print("\n🔬 ANÁLISIS TÉCNICO AVANZADO EN MÚLTIPLES PASADAS")
     print("="*70)
     
     # PASADA 1: Análisis de demoras y QP
     print("📊 Pasada 1/4: Analizando demoras y quiebres de plan...")
-    analisis_demoras_json = call_claude_analysis(
-        PROMPT_ANALISIS_DEMORAS_QP.format(conversaciones=conversaciones)
-    )
+    with span("pass.demoras"):
+        analisis_demoras_json = call_claude_analysis(
+            PROMPT_ANALISIS_DEMORAS_QP.format(conversaciones=conversaciones),
+            stage="pass.demoras", priority=PRIORITY_HIGH
+        )
     
     # PASADA 2: Análisis de actividades
     print("🔧 Pasada 2/4: Analizando actividades y ubicaciones...")
-    analisis_actividades_json = call_claude_analysis(
-        PROMPT_ANALISIS_ACTIVIDADES.format(conversaciones=conversaciones)
-    )
+    with span("pass.actividades"):
+        analisis_actividades_json = call_claude_analysis(
+            PROMPT_ANALISIS_ACTIVIDADES.format(conversaciones=conversaciones),
+            stage="pass.actividades", priority=PRIORITY_LOW
+        )
     
     # PASADA 3: Análisis de seguridad
     print("🛡️ Pasada 3/4: Analizando seguridad y hallazgos...")
-    analisis_seguridad_json = call_claude_analysis(
-        PROMPT_ANALISIS_SEGURIDAD.format(conversaciones=conversaciones)
-    )
+    with span("pass.seguridad"):
+        analisis_seguridad_json = call_claude_analysis(
+            PROMPT_ANALISIS_SEGURIDAD.format(conversaciones=conversaciones),
+            stage="pass.seguridad", priority=PRIORITY_HIGH
+        )
     
     # PASADA 4: Análisis de producción y KPIs
     print("📈 Pasada 4/4: Analizando producción e indicadores...")
-    analisis_produccion_json = call_claude_analysis(
-        PROMPT_ANALISIS_PRODUCCION_KPI.format(conversaciones=conversaciones)
-    )
+    with span("pass.produccion"):
+        analisis_produccion_json = call_claude_analysis(
+            PROMPT_ANALISIS_PRODUCCION_KPI.format(conversaciones=conversaciones),
+            stage="pass.produccion", priority=PRIORITY_LOW
+        )
+    
+    analyses = {
+        "pass.demoras": analisis_demoras_json,
+        "pass.actividades": analisis_actividades_json,
+        "pass.seguridad": analisis_seguridad_json,
+        "pass.produccion": analisis_produccion_json
+    }
+    
+    # PERSISTENCIA: filas extraídas con procedencia en Supabase (sin red en modo replay).
+    # Solo la extracción de estos mensajes: la acumulada ya se persistió antes.
+    if not replay.is_replaying():
+        with span("persist_extractions") as s:
+            try:
+                written = persist_extractions(analyses, messages, get_run_id(), periodo_texto, db_client)
+                s.add(rows=sum(written.values()))
+            except Exception as e:
+                print(f"⚠️ Error persistiendo extracción: {e}")
+                s.fail(e)
+    
+    if previous_analyses:
+        analyses = merge_analyses(previous_analyses, analyses)
+        print("   ➕ Extracción del delta unida a la acumulada del día")
+    
+    # TENDENCIAS: persistir la extracción y calcular recurrencia entre ejecuciones (sección 6)
+    with span("trends") as s:
+        try:
+            tendencias = replay.memo("tendencias", lambda: build_trends(
+                run_id or get_run_id(), periodo_texto, analyses, replay.now(), messages=messages
+            ))
+        except Exception as e:
+            print(f"⚠️ Error calculando tendencias: {e}")
+            s.fail(e)
+            tendencias = None
     
     # SÍNTESIS FINAL
     print("📝 Síntesis final: Generando reporte ejecutivo...")
-    reporte_final = call_claude_synthesis(
-        PROMPT_SINTESIS_FINAL.format(
-            periodo=periodo_texto,
-            periodo_texto=periodo_texto,
-            fecha_generacion=datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-            analisis_demoras=format_json_for_prompt(analisis_demoras_json, "Demoras y QP"),
-            analisis_actividades=format_json_for_prompt(analisis_actividades_json, "Actividades"),
-            analisis_seguridad=format_json_for_prompt(analisis_seguridad_json, "Seguridad"),
-            analisis_produccion=format_json_for_prompt(analisis_produccion_json, "Producción")
+    with span("synthesis", mode=SYNTHESIS_MODE):
+        reporte_final = synthesize_report(
+            analyses, periodo_texto, tendencias,
+            total_mensajes=len(messages) if total_mensajes is None else total_mensajes
         )
-    )
     
     print("✅ Análisis técnico completado")
     print("="*70 + "\n")
     
-    return reporte_final
+    return reporte_final, analyses
 
-def call_claude_analysis(prompt: str, max_tokens: int = 4000) -> dict:
+# ----------------------------------------------------
+# SÍNTESIS
+# ----------------------------------------------------
+
+def synthesis_reserve_tokens() -> tuple:
     """
-    Llama a Claude para análisis y retorna JSON parseado.
+    Tokens de entrada y de salida que la síntesis reserva en el presupuesto
+    (paso 1 de degradación en analyze_messages).
     """
-    try:
-        response = claude_client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=max_tokens,
-            temperature=0.1,  # Más determinístico para análisis técnico
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        content = response.content[0].text
+    if SYNTHESIS_MODE == "single":
+        return estimate_tokens(PROMPT_SINTESIS_FINAL) + ANALYSIS_MAX_TOKENS, SYNTHESIS_MAX_TOKENS
+    
+    fixed = estimate_tokens(SYNTHESIS_TEMPLATE["reglas"] + SYNTHESIS_TEMPLATE["instrucciones_finales"])
+    input_tokens = sum(
+        fixed + estimate_tokens(SYNTHESIS_TEMPLATE["secciones"][spec["seccion"]]["instrucciones"])
+        + ANALYSIS_MAX_TOKENS * len(spec["pasadas"]) // 4
+        for spec in SYNTHESIS_SECTIONS
+    )
+    sections_output = sum(spec["max_tokens"] for spec in SYNTHESIS_SECTIONS)
+    input_tokens += fixed + sections_output
+    return input_tokens, sections_output + SUMMARY_MAX_TOKENS
+
+def synthesize_report(analyses: dict, periodo_texto: str, tendencias: str,
+                      total_mensajes: int = None) -> str:
+    """
+    Redacta el reporte a partir de la extracción de las pasadas.
+    
+    Con SYNTHESIS_MODE="sections" cada sección es una llamada independiente que
+    recibe solo las pasadas que necesita; las secciones se generan en paralelo,
+    el resumen ejecutivo se escribe al final a partir de ellas y el reporte se
+    arma en orden. Con "single" se usa la plantilla completa en una llamada.
+    
+    Args:
+        analyses: Extracción por pasada
+        periodo_texto: Descripción del período
+        tendencias: Tablas precalculadas (trend_engine.build_trends)
+        total_mensajes: Mensajes analizados, para la firma del reporte
         
-        # Extraer JSON del response (puede venir con ```json wrapper)
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0]
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0]
+    Returns:
+        Reporte en Markdown, o None si la síntesis falló
+    """
+    fecha_generacion = replay.now().strftime("%d/%m/%Y %H:%M:%S")
+    
+    if SYNTHESIS_MODE == "single":
+        reporte = call_claude_synthesis(
+            PROMPT_SINTESIS_FINAL.format(
+                periodo=periodo_texto,
+                periodo_texto=periodo_texto,
+                fecha_generacion=fecha_generacion,
+                analisis_demoras=format_json_for_prompt(analyses["pass.demoras"], "Demoras y QP"),
+                analisis_actividades=format_json_for_prompt(analyses["pass.actividades"], "Actividades"),
+                analisis_seguridad=format_json_for_prompt(analyses["pass.seguridad"], "Seguridad"),
+                analisis_produccion=format_json_for_prompt(analyses["pass.produccion"], "Producción"),
+                tendencias=f"## Tendencias Precalculadas\n{tendencias or TRENDS_UNAVAILABLE}"
+            )
+        )
+        return insert_trends(insert_tables(reporte, analyses), tendencias)
+    
+    print(f"   🧩 {len(SYNTHESIS_SECTIONS)} secciones en paralelo + resumen ejecutivo")
+    with ThreadPoolExecutor(max_workers=min(SYNTHESIS_MAX_WORKERS, len(SYNTHESIS_SECTIONS))) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, _synthesize_section,
+                            spec, analyses, periodo_texto, tendencias)
+            for spec in SYNTHESIS_SECTIONS
+        ]
+        textos = {spec["clave"]: future.result() for spec, future in zip(SYNTHESIS_SECTIONS, futures)}
+    
+    if not any(textos.values()):
+        return None
+    
+    secciones = SYNTHESIS_TEMPLATE["secciones"]
+    cuerpo = {
+        "2": textos["cumplimiento"] or _missing_section(secciones["2"]["encabezado"]),
+        "3": "\n\n".join([secciones["3"]["encabezado"]] + [
+            textos[spec["clave"]] or _missing_section(SYNTHESIS_TEMPLATE["superintendencias"][spec["superintendencia"]])
+            for spec in SYNTHESIS_SECTIONS if spec["seccion"] == "3"
+        ]),
+        "4": textos["seguridad"] or _missing_section(secciones["4"]["encabezado"]),
+        "5": textos["indicadores"] or _missing_section(secciones["5"]["encabezado"]),
+        "6": f"{secciones['6']['encabezado']}\n\n[[TABLAS_TENDENCIAS]]",
+        "7": textos["recomendaciones"] or _missing_section(secciones["7"]["encabezado"]),
+        "8": textos["anexos"] or _missing_section(secciones["8"]["encabezado"]),
+    }
+    
+    # Resumen ejecutivo al final, a partir de las secciones ya redactadas
+    with span("synthesis.resumen"):
+        resumen = call_claude_synthesis(
+            PROMPT_RESUMEN_EJECUTIVO.format(
+                reglas=SYNTHESIS_TEMPLATE["reglas"],
+                secciones="\n\n---\n\n".join(texto for n, texto in sorted(cuerpo.items()) if n != "6"),
+                periodo_texto=periodo_texto,
+                instrucciones=secciones["1"]["instrucciones"],
+                instrucciones_finales=SYNTHESIS_TEMPLATE["instrucciones_finales"]
+            ),
+            max_tokens=SUMMARY_MAX_TOKENS, stage="synthesis.resumen"
+        )
+    cuerpo["1"] = _with_heading(resumen, secciones["1"]["encabezado"]) if resumen else \
+        _missing_section(secciones["1"]["encabezado"])
+    
+    firma = SYNTHESIS_TEMPLATE["firma"].format(periodo_texto=periodo_texto, fecha_generacion=fecha_generacion)
+    firma = firma.replace("[Indicar cantidad si disponible]",
+                          f"{total_mensajes:,}" if total_mensajes is not None else "No reportado")
+    firma = firma.replace("[fecha + 168 horas]",
+                          (replay.now() + timedelta(hours=168)).strftime("%d/%m/%Y %H:%M"))
+    
+    encabezado = (f"# Reporte Ejecutivo Técnico - Minera Centinela\n"
+                  f"**Período:** {periodo_texto}  \n**Generado:** {fecha_generacion}")
+    reporte = "\n\n---\n\n".join([encabezado] + [cuerpo[n] for n in sorted(cuerpo)] + [firma])
+    return insert_trends(reporte, tendencias)
+
+def _synthesize_section(spec: dict, analyses: dict, periodo_texto: str, tendencias: str) -> str:
+    """Redacta una sección del reporte con las pasadas indicadas en su especificación."""
+    seccion = SYNTHESIS_TEMPLATE["secciones"][spec["seccion"]]
+    encabezado, titulo, alcance = seccion["encabezado"], seccion["encabezado"][3:], ""
+    
+    superintendencia = spec.get("superintendencia")
+    if superintendencia:
+        encabezado = SYNTHESIS_TEMPLATE["superintendencias"][superintendencia]
+        titulo = f"{titulo} / {encabezado[4:]}"
+        alcance = (f"Redacta SOLO la subsección de la superintendencia {superintendencia} "
+                   f"(empresas: {', '.join(_superintendencia_empresas(superintendencia))}); "
+                   f"la otra superintendencia se redacta por separado.\n")
+    if spec.get("tendencias"):
+        alcance += "Usa las TENDENCIAS PRECALCULADAS de los datos de entrada para priorizar.\n"
+    
+    datos = [
+        format_json_for_prompt(
+            _filter_by_superintendencia(analyses.get(stage), superintendencia) if stage == "pass.actividades"
+            else analyses.get(stage),
+            PASS_TITLES[stage]
+        )
+        for stage in spec["pasadas"]
+    ]
+    if spec.get("tendencias"):
+        datos.append(f"## Tendencias Precalculadas\n{tendencias or TRENDS_UNAVAILABLE}")
+    
+    stage = f"synthesis.{spec['clave']}"
+    with span(stage):
+        texto = call_claude_synthesis(
+            PROMPT_SINTESIS_SECCION.format(
+                reglas=SYNTHESIS_TEMPLATE["reglas"],
+                datos="\n\n".join(datos),
+                titulo=titulo,
+                periodo_texto=periodo_texto,
+                alcance=alcance,
+                instrucciones=seccion["instrucciones"],
+                instrucciones_finales=SYNTHESIS_TEMPLATE["instrucciones_finales"],
+                encabezado=encabezado
+            ),
+            max_tokens=spec["max_tokens"], stage=stage
+        )
+    if not texto:
+        return None
+    return insert_tables(_with_heading(texto, encabezado), analyses, sections=[spec["seccion"]])
+
+def _with_heading(texto: str, encabezado: str) -> str:
+    """Asegura que la sección comience con su encabezado y sin separadores sueltos."""
+    texto = re.sub(r"^\s*-{3,}\s*|\s*-{3,}\s*$", "", texto)
+    return texto if texto.startswith("#") else f"{encabezado}\n\n{texto}"
+
+def _missing_section(encabezado: str) -> str:
+    print(f"   ⚠️ Sección sin generar: {encabezado.lstrip('# ')}")
+    return f"{encabezado}\n\n*No reportado: la generación de esta sección falló.*"
+
+def _superintendencia_empresas(superintendencia: str) -> list:
+    return sorted({
+        info["empresa"] for info in GRUPOS_EMPRESAS.values()
+        if info.get("superintendencia") == superintendencia
+    })
+
+def _filter_by_superintendencia(data: dict, superintendencia: str) -> dict:
+    """
+    Actividades de una superintendencia: se descartan solo las ejecutadas por
+    empresas de la otra; las de empresa desconocida se conservan en ambas.
+    """
+    if not superintendencia or not data or not isinstance(data.get("actividades"), list):
+        return data
+    
+    otras = [
+        info["empresa"].upper() for info in GRUPOS_EMPRESAS.values()
+        if info.get("superintendencia") not in (None, superintendencia)
+    ]
+    
+    def ajena(actividad) -> bool:
+        ejecutor = actividad.get("ejecutor") if isinstance(actividad, dict) else None
+        empresa = str((ejecutor or {}).get("empresa") or "").upper()
+        return bool(empresa) and any(otra in empresa for otra in otras)
+    
+    return {**data, "actividades": [a for a in data["actividades"] if not ajena(a)]}
+
+def call_claude_analysis(prompt: str, max_tokens: int = ANALYSIS_MAX_TOKENS,
+                         stage: str = "analysis", priority: int = PRIORITY_HIGH) -> dict:
+    """
+    Llama a Claude para análisis y retorna JSON parseado.
+    
+    La pasada usa el modelo asignado en MODEL_ROUTES (modelo rápido por defecto).
+    Si la salida no es JSON válido, viene vacía o no contiene ninguna de las claves
+    esperadas (PASS_EXPECTED_KEYS), se repite una vez con el modelo de escalamiento.
+    Si el presupuesto obliga a omitir la pasada, retorna {}.
+    """
+    s = current_span()
+    model = resolve_model(stage)
+    models = [model] if model == escalation_model() else [model, escalation_model()]
+    result = {}
+    
+    for attempt, attempt_model in enumerate(models):
+        try:
+            response = create_claude_message(
+                claude_client,
+                stage=stage,
+                prompt=prompt,
+                max_tokens=max_tokens,
+                temperature=0.1,  # Más determinístico para análisis técnico
+                model=attempt_model,
+                priority=priority
+            )
+            
+            if response is None:
+                print(f"   ⏭️ {stage} omitida por presupuesto")
+                return result if isinstance(result, dict) else {}
+            
+            result = parse_analysis_json(response.content[0].text)
+            error = None if is_valid_analysis(result, PASS_EXPECTED_KEYS.get(stage)) else "salida vacía o sin claves esperadas"
+            
+        except Exception as e:
+            result, error = {}, e
         
-        return json.loads(content.strip())
+        if error is None:
+            if s and isinstance(result, dict):
+                s.add(rows=sum(len(v) for v in result.values() if isinstance(v, list)))
+                s.set(escalated=attempt > 0)
+            return result
         
-    except Exception as e:
-        print(f"⚠️ Error en análisis: {e}")
-        return {}
+        if attempt + 1 < len(models):
+            print(f"   🔁 {stage}: {error} con {attempt_model}, escalando a {models[attempt + 1]}")
+            if s:
+                s.add(retries=1)
+        else:
+            print(f"⚠️ Error en análisis: {error}")
+            if s:
+                s.fail(error)
+    
+    return result if isinstance(result, dict) else {}
+
+def parse_analysis_json(content: str) -> dict:
+    """
+    Extrae y parsea el JSON de la respuesta (puede venir con ```json wrapper).
+    """
+    if "```json" in content:
+        content = content.split("```json")[1].split("```")[0]
+    elif "```" in content:
+        content = content.split("```")[1].split("```")[0]
+    
+    return json.loads(content.strip())
 
-def call_claude_synthesis(prompt: str, max_tokens: int = 8000) -> str:
+def is_valid_analysis(result, expected_keys: list = None) -> bool:
+    """
+    Valida la salida de una pasada: dict no vacío con al menos una clave esperada.
+    """
+    if not isinstance(result, dict) or not result:
+        return False
+    if expected_keys:
+        return any(key in result for key in expected_keys)
+    return True
+
+def call_claude_synthesis(prompt: str, max_tokens: int = SYNTHESIS_MAX_TOKENS, stage: str = "synthesis") -> str:
     """
     Llama a Claude para síntesis final del reporte.
     """
+    s = current_span()
     try:
-        response = claude_client.messages.create(
-            model="claude-sonnet-4-20250514",
+        response = create_claude_message(
+            claude_client,
+            stage=stage,
+            prompt=prompt,
             max_tokens=max_tokens,
             temperature=0.2,
-            messages=[{"role": "user", "content": prompt}]
+            priority=PRIORITY_REQUIRED
         )
         
+        if s:
+            s.set(stop_reason=getattr(response, "stop_reason", None))
+        
         return response.content[0].text
         
     except Exception as e:
         print(f"❌ Error en síntesis: {e}")
+        if s:
+            s.fail(e)
         return None
 
-def format_json_for_prompt(data: dict, title: str) -> str:
+def format_json_for_prompt(data: dict, title: str, encoding: str = None) -> str:
     """
     Formatea JSON de análisis para incluir en prompt de síntesis.
+    
+    Args:
+        data: Resultado de una pasada
+        title: Título del bloque
+        encoding: SYNTHESIS_ENCODING por defecto ("compact" o "json")
     """
     if not data:
         return f"## {title}\nNo se identificó información relevante en esta categoría.\n"
     
+    if (encoding or SYNTHESIS_ENCODING) == "compact":
+        return f"## {title}\n{serialize_compact(data)}\n"
+    
     return f"## {title}\n```json\n{json.dumps(data, indent=2, ensure_ascii=False)}\n```\n"
+
+def _is_blank(value) -> bool:
+    if value is None or value == "" or value == [] or value == {}:
+        return True
+    return isinstance(value, str) and value.strip().lower() in ("no reportado", "null", "none", "n/a", "-")
+
+def _prune(value):
+    """Quita recursivamente nulos, vacíos y "No reportado"."""
+    if isinstance(value, dict):
+        pruned = {key: _prune(item) for key, item in value.items()}
+        return {key: item for key, item in pruned.items() if not _is_blank(item)}
+    if isinstance(value, list):
+        return [item for item in (_prune(item) for item in value) if not _is_blank(item)]
+    return value
+
+def _flatten(row: dict, prefix: str = "") -> dict:
+    """Objeto anidado → columnas con ruta (ej: equipo.tag)."""
+    flat = {}
+    for key, value in row.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def _compact_text(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, list):
+        return "; ".join(_compact_text(item) for item in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return re.sub(r"\s+", " ", str(value)).strip().replace("|", "/")
+
+def serialize_compact(data: dict) -> str:
+    """
+    Serialización compacta del resultado de una pasada para los prompts de síntesis.
+    
+    - Se omiten nulos, vacíos y "No reportado" (celda vacía = No reportado)
+    - Los arreglos de objetos se escriben como tabla: una línea de columnas y una por fila
+    - Los textos largos repetidos se escriben una vez y se citan como §n
+    """
+    data = _prune(data)
+    
+    # Bloques (encabezado, filas de celdas) antes de resolver repeticiones
+    blocks = []
+    for key, value in data.items():
+        if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+            rows = [_flatten(item) for item in value]
+            columns = list(dict.fromkeys(column for row in rows for column in row))
+            blocks.append((f"{key} ({len(rows)}): " + " | ".join(columns),
+                           [[_compact_text(row[c]) if c in row else "" for c in columns] for row in rows]))
+        elif isinstance(value, list):
+            blocks.append((f"{key} ({len(value)}):", [[_compact_text(item)] for item in value]))
+        elif isinstance(value, dict):
+            blocks.append((f"{key}:", [[f"{k}={_compact_text(v)}" for k, v in _flatten(value).items()]]))
+        else:
+            blocks.append((f"{key}: {_compact_text(value)}", []))
+    
+    counts = Counter(cell for _, rows in blocks for row in rows for cell in row if len(cell) >= DEDUP_MIN_CHARS)
+    refs = {text: f"§{i}" for i, text in enumerate((text for text, n in counts.items() if n > 1), 1)}
+    
+    lines = ["(Tablas: primera línea = columnas separadas por \" | \"; celda vacía = No reportado; "
+             "§n = texto repetido, ver referencias)"]
+    if refs:
+        lines += [f"{ref} = {text}" for text, ref in refs.items()]
+    for header, rows in blocks:
+        lines.append(header)
+        lines += [" | ".join(refs.get(cell, cell) for cell in row) for row in rows]
+    return "\n".join(lines)
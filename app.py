@@ -4,6 +4,9 @@ from supabase import create_client, Client
 from openai import OpenAI
 import anthropic
 import json
+import gzip
+import hashlib
+import re
 
 # Importar catálogo de grupos
 from grupos_config import (
@@ -15,7 +18,43 @@ from grupos_config import (
 )
 
 # Importar sistema de análisis avanzado
-from advanced_analysis import generate_advanced_technical_report
+from advanced_analysis import analyze_messages, SYNTHESIS_MODE
+from hierarchical_summary import HIERARCHICAL_SUMMARY
+
+# Trazas estructuradas por etapa
+from tracing import span, current_span, start_run, end_run, get_run_id
+
+# Presupuesto de tokens/costo y llamadas a Claude
+from budget import start_budget
+from llm_gateway import create_claude_message, create_openai_chat
+
+# Grabación/replay de ejecuciones
+import replay
+
+# Selección de mensajes por relevancia cuando no caben en el contexto
+from context_packing import pack_messages, attachment_marker, CONTEXT_PACKING, CONTEXT_ENCODING, SITE_TIMEZONE
+from conversation_threads import CONTEXT_THREADING
+
+# Espejo local incremental de mensajes (opcional, LOCAL_MIRROR_PATH)
+import message_mirror
+
+# Lectura concurrente por tramos de tiempo (ventanas de varios días)
+import async_fetch
+
+# Actualización incremental durante el día (INCREMENTAL_REFRESH)
+import incremental_refresh
+
+# Reutilizar la ejecución anterior si los mensajes no cambiaron (SKIP_UNCHANGED_RUNS)
+import run_fingerprint
+
+# Completar embeddings pendientes antes de consultar la ventana (EMBEDDING_BACKFILL)
+import embedding_backfill
+
+# Embeddings cuantizados en la consulta (EMBEDDING_TRANSFER=quantized)
+import embedding_codec
+
+# Perfil de CPU y memoria por etapa (PROFILE_STAGES)
+import stage_profiler
 
 # ----------------------------------------------------
 # 1. CONFIGURACIÓN
@@ -26,9 +65,9 @@ SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")  # Para usar Claude
 
-# Inicializar clientes
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# Inicializar clientes (opcionales para permitir modo replay sin credenciales)
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY) if SUPABASE_URL and SUPABASE_SERVICE_KEY else None
+openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 claude_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
 
 # Configuración del reporte
@@ -38,12 +77,40 @@ REPORT_END_DATE = os.environ.get("REPORT_END_DATE")      # Formato: "2025-12-06"
 MAX_MESSAGES_IN_REPORT = int(os.environ.get("MAX_MESSAGES_IN_REPORT", "500"))  # Máximo de mensajes (configurable)
 SIMILARITY_THRESHOLD = 0.3     # Umbral mínimo de similitud para búsqueda semántica
 USE_ADVANCED_ANALYSIS = os.environ.get("USE_ADVANCED_ANALYSIS", "true").lower() == "true"  # Análisis multi-pasada
+# Ventanas de más de un día con resumen jerárquico (hierarchical_summary.py): límite de mensajes propio
+HIERARCHICAL_MAX_MESSAGES = int(os.environ.get("HIERARCHICAL_MAX_MESSAGES", "20000"))
+FETCH_PAGE_SIZE = 1000  # max-rows por defecto de PostgREST
+MESSAGE_BASE_COLUMNS = 'id, grupo_id, fecha_hora, remitente, contenido_texto, es_imagen, url_storage, whatsapp_message_id'
+MESSAGE_COLUMNS = f'{MESSAGE_BASE_COLUMNS}, {embedding_codec.embedding_column()}'
+
+# Configuración de Storage
+# Artefactos de texto que se almacenan comprimidos con gzip ("md", "html"). Storage no permite
+# fijar Content-Encoding: el objeto queda como "<archivo>.gz" (application/gzip) y quien lo
+# descarga recibe el archivo comprimido y debe descomprimirlo (ej: gunzip). Desactivado por defecto.
+STORAGE_GZIP_TYPES = [t.strip() for t in os.environ.get("STORAGE_GZIP_TYPES", "").split(",") if t.strip()]
+# Líneas con la hora de generación: se excluyen de la clave de contenido de los artefactos
+GENERATION_TIME_LINES = re.compile(
+    r"^\*\*(?:Fecha de generación|Generado|Próxima actualización automática):\*\*.*$", re.MULTILINE
+)
 
 # ----------------------------------------------------
 # 2. FUNCIONES DE CONSULTA RAG
 # ----------------------------------------------------
 
-def get_messages_by_date_range(start_date: str = None, end_date: str = None, hours: int = None) -> list:
+def _resolve_window(start_date: str = None, end_date: str = None, hours: int = None) -> tuple:
+    """
+    Inicio y fin (ISO) de la ventana: rango específico o últimas N horas (fin abierto).
+    """
+    if start_date and end_date:
+        start_str = start_date if 'T' in start_date else f"{start_date}T00:00:00"
+        end_str = end_date if 'T' in end_date else f"{end_date}T23:59:59"
+        return start_str, end_str
+    if hours:
+        return (datetime.now() - timedelta(hours=hours)).isoformat(), None
+    raise ValueError("Debe especificar start_date/end_date o hours")
+
+def get_messages_by_date_range(start_date: str = None, end_date: str = None, hours: int = None,
+                               limit: int = None, embeddings: bool = True) -> list:
     """
     Obtiene mensajes por rango de fechas o por últimas N horas.
     
@@ -55,35 +122,62 @@ def get_messages_by_date_range(start_date: str = None, end_date: str = None, hou
         start_date: Fecha inicio en formato ISO "2025-12-01" o "2025-12-01T00:00:00"
         end_date: Fecha fin en formato ISO "2025-12-06" o "2025-12-06T23:59:59"
         hours: Número de horas hacia atrás desde ahora
+        limit: Máximo de mensajes (por defecto MAX_MESSAGES_IN_REPORT)
+        embeddings: Incluir la columna embedding (el filtro "con embedding" se aplica igual)
+    
+    En modo replay retorna los mensajes grabados en el bundle. Si LOCAL_MIRROR_PATH
+    está definido, la ventana se sirve desde el espejo local tras una sincronización incremental.
+    Las ventanas de varios días se leen por tramos concurrentes (async_fetch.py).
     """
+    if replay.is_replaying():
+        messages = replay.replay_messages()
+        print(f"   ▶️ {len(messages)} mensajes desde bundle de replay")
+        return messages
+    
+    limit = limit or MAX_MESSAGES_IN_REPORT
+    columns = MESSAGE_COLUMNS if embeddings else MESSAGE_BASE_COLUMNS
+    
     try:
         # Determinar el rango de fechas
+        start_str, end_str = _resolve_window(start_date, end_date, hours)
         if start_date and end_date:
-            # Usar rango específico
-            start_str = start_date if 'T' in start_date else f"{start_date}T00:00:00"
-            end_str = end_date if 'T' in end_date else f"{end_date}T23:59:59"
-            
             print(f"   📅 Rango de fechas: {start_str} a {end_str}")
-            
-            # Consultar mensajes en rango
-            response = supabase.from_('mensajes_analisis').select(
-                'id, grupo_id, fecha_hora, remitente, contenido_texto, es_imagen, url_storage, embedding, whatsapp_message_id'
-            ).gte('fecha_hora', start_str).lte('fecha_hora', end_str).is_('deleted_at', 'null').not_.is_('embedding', 'null').order('fecha_hora', desc=False).limit(MAX_MESSAGES_IN_REPORT).execute()
-            
-        elif hours:
-            # Usar últimas N horas
-            cutoff_time = datetime.now() - timedelta(hours=hours)
-            cutoff_str = cutoff_time.isoformat()
-            
-            print(f"   ⏰ Últimas {hours} horas (desde {cutoff_str})")
-            
-            response = supabase.from_('mensajes_analisis').select(
-                'id, grupo_id, fecha_hora, remitente, contenido_texto, es_imagen, url_storage, embedding, whatsapp_message_id'
-            ).gte('fecha_hora', cutoff_str).is_('deleted_at', 'null').not_.is_('embedding', 'null').order('fecha_hora', desc=False).limit(MAX_MESSAGES_IN_REPORT).execute()
         else:
-            raise ValueError("Debe especificar start_date/end_date o hours")
+            print(f"   ⏰ Últimas {hours} horas (desde {start_str})")
         
-        return response.data if response.data else []
+        if message_mirror.is_enabled():
+            # Sincronizar solo lo nuevo y servir la ventana desde el espejo local
+            message_mirror.sync(supabase)
+            messages = message_mirror.get_messages(start_str, end_str, limit=limit, embeddings=embeddings)
+            print(f"   🪞 {len(messages)} mensajes desde espejo local")
+            replay.record_messages(messages)
+            return messages
+        
+        if async_fetch.is_enabled(start_str, end_str):
+            try:
+                messages = async_fetch.fetch_messages(start_str, end_str, limit, columns.replace(' ', ''))
+                replay.record_messages(messages)
+                return messages
+            except Exception as e:
+                print(f"   ⚠️ Lectura concurrente falló ({e.__class__.__name__}: {e}); se usa el paginado secuencial")
+        
+        # Paginado: PostgREST entrega como máximo FETCH_PAGE_SIZE filas por request
+        messages = []
+        while len(messages) < limit:
+            offset = len(messages)
+            page_size = min(FETCH_PAGE_SIZE, limit - offset)
+            query = supabase.from_('mensajes_analisis').select(columns).gte('fecha_hora', start_str)
+            if end_str:
+                query = query.lte('fecha_hora', end_str)
+            response = query.is_('deleted_at', 'null').not_.is_('embedding', 'null').order('fecha_hora', desc=False).order('id', desc=False).range(offset, offset + page_size - 1).execute()
+            
+            page = response.data if response.data else []
+            messages.extend(page)
+            if len(page) < page_size:
+                break
+        
+        replay.record_messages(messages)
+        return messages
         
     except Exception as e:
         print(f"❌ Error obteniendo mensajes: {e}")
@@ -114,11 +208,11 @@ def semantic_search(query_text: str, top_k: int = 20, time_filter_hours: int = N
         print(f"   🔍 Búsqueda semántica: '{query_text}'")
         
         # 1. Generar embedding de la consulta
-        embedding_response = openai_client.embeddings.create(
+        query_embedding = replay.create_embedding(
+            openai_client,
             input=query_text,
             model="text-embedding-3-small"
-        )
-        query_embedding = embedding_response.data[0].embedding
+        )[0]
         
         # 2. Preparar parámetros para la búsqueda
         params = {
@@ -164,10 +258,52 @@ def semantic_search(query_text: str, top_k: int = 20, time_filter_hours: int = N
             return get_messages_last_n_hours(time_filter_hours)
         return []
 
-def aggregate_messages_by_topic(messages: list) -> dict:
+def get_group_stats(start_date: str = None, end_date: str = None, hours: int = None) -> dict:
+    """
+    Estadísticas por grupo de la ventana completa en un solo round-trip
+    (función SQL get_group_stats), sin descargar el contenido de los mensajes.
+    
+    Args:
+        start_date / end_date / hours: Igual que get_messages_by_date_range
+    
+    Returns:
+        Dict {grupo_id: {mensajes, primer_mensaje, ultimo_mensaje, remitentes, adjuntos, imagenes}}
+        o None si no están disponibles (se usan los conteos de los mensajes descargados)
+    """
+    start_str, end_str = _resolve_window(start_date, end_date, hours)
+    
+    def _compute():
+        if message_mirror.is_enabled():
+            return message_mirror.get_group_stats(start_str, end_str)
+        params = {'window_start': start_str}
+        if end_str:
+            params['window_end'] = end_str
+        return supabase.rpc('get_group_stats', params).execute().data or []
+    
+    try:
+        rows = replay.memo("group_stats", _compute)
+    except KeyError:
+        # Bundle grabado antes de existir las estadísticas
+        return None
+    except Exception as e:
+        error_msg = str(e).lower()
+        if 'get_group_stats' in error_msg or 'does not exist' in error_msg or 'could not find' in error_msg:
+            print("   ⚠️ Función SQL 'get_group_stats' no encontrada en Supabase")
+            print("   📝 Ejecuta el archivo 'setup_group_stats.sql' en SQL Editor")
+        else:
+            print(f"   ⚠️ Estadísticas por grupo no disponibles: {e}")
+        return None
+    
+    return {row['grupo_id']: row for row in rows}
+
+def aggregate_messages_by_topic(messages: list, stats: dict = None) -> dict:
     """
     Agrupa mensajes por grupos/empresas y temas.
     Retorna un diccionario con análisis por grupo.
+    
+    Con stats (get_group_stats), 'count' refleja la ventana completa aunque
+    los mensajes descargados estén limitados por MAX_MESSAGES_IN_REPORT, y
+    cada grupo incluye sus estadísticas en 'stats'.
     """
     # Agrupar por grupo_id
     messages_by_group = {}
@@ -186,8 +322,39 @@ def aggregate_messages_by_topic(messages: list) -> dict:
         messages_by_group[grupo_id]['messages'].append(msg)
         messages_by_group[grupo_id]['count'] += 1
     
+    for grupo_id, group_stats in (stats or {}).items():
+        data = messages_by_group.setdefault(grupo_id, {
+            'info': get_grupo_info(grupo_id),
+            'messages': [],
+            'count': 0
+        })
+        data['count'] = group_stats['mensajes']
+        data['stats'] = group_stats
+    
     return messages_by_group
 
+def format_groups_summary(groups_data: dict) -> str:
+    """
+    Resumen de actividad por grupo para los prompts (una línea por grupo activo).
+    """
+    groups_summary = []
+    for grupo_id, data in groups_data.items():
+        if data['count'] > 0:
+            info = data['info']
+            if info:
+                line = f"- {info['nombre']} ({info['empresa']}): {data['count']} mensajes - {info['tipo_servicio']}"
+            else:
+                line = f"- Grupo ID {grupo_id}: {data['count']} mensajes"
+            stats = data.get('stats')
+            if stats:
+                line += (
+                    f" ({stats['remitentes']} remitentes, {stats['adjuntos']} adjuntos, "
+                    f"{str(stats['primer_mensaje'])[:16].replace('T', ' ')} → "
+                    f"{str(stats['ultimo_mensaje'])[:16].replace('T', ' ')})"
+                )
+            groups_summary.append(line)
+    return "\n".join(groups_summary)
+
 def aggregate_by_superintendencia(groups_data: dict) -> dict:
     """
     Agrupa los datos de empresas por superintendencia.
@@ -222,51 +389,16 @@ def format_messages_for_context(messages: list, max_chars: int = 20000) -> str:
     """
     Formatea los mensajes en un contexto legible para la IA.
     Incluye información sobre archivos adjuntos (imágenes, videos, documentos).
+    Si los mensajes no caben en max_chars, se seleccionan por relevancia
+    (ver context_packing.py, CONTEXT_PACKING).
     """
-    context_parts = []
-    current_length = 0
-    
-    for msg in messages:
-        timestamp = msg.get('fecha_hora', 'N/A')
-        sender = msg.get('remitente', 'Desconocido')
-        content = msg.get('contenido_texto', '[Sin texto]')
-        is_image = msg.get('es_imagen', False)
-        url_storage = msg.get('url_storage', '')
-        
-        # Formato con remitente
-        msg_text = f"\n[{timestamp}] {sender}"
-        
-        # Identificar tipo de archivo adjunto
-        if url_storage:
-            if '.mp4' in url_storage.lower() or '.mov' in url_storage.lower():
-                msg_text += " [🎬 Video adjunto]"
-            elif is_image or any(ext in url_storage.lower() for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']):
-                msg_text += " [📷 Imagen adjunta]"
-            elif '.pdf' in url_storage.lower():
-                msg_text += " [📄 PDF adjunto]"
-            elif any(ext in url_storage.lower() for ext in ['.xlsx', '.xls']):
-                msg_text += " [📊 Excel adjunto]"
-            elif any(ext in url_storage.lower() for ext in ['.docx', '.doc']):
-                msg_text += " [📝 Word adjunto]"
-            else:
-                msg_text += " [📎 Archivo adjunto]"
-        
-        msg_text += f":\n{content}\n"
-        
-        if current_length + len(msg_text) > max_chars:
-            context_parts.append("\n... (mensajes adicionales omitidos por límite de longitud)")
-            break
-        
-        context_parts.append(msg_text)
-        current_length += len(msg_text)
-    
-    return "".join(context_parts)
+    return pack_messages(messages, max_chars)
 
 def generate_report_with_claude(messages: list, groups_data: dict) -> str:
     """
     Genera el reporte ejecutivo usando Claude (Anthropic).
     """
-    if not claude_client:
+    if not claude_client and not replay.is_replaying():
         print("⚠️ Claude API no configurado, usando GPT-4 como fallback")
         return generate_report_with_gpt4(messages, groups_data)
     
@@ -275,18 +407,7 @@ def generate_report_with_claude(messages: list, groups_data: dict) -> str:
         context = format_messages_for_context(messages)
         
         # Resumen de grupos activos
-        groups_summary = []
-        for grupo_id, data in groups_data.items():
-            if data['count'] > 0:
-                info = data['info']
-                if info:
-                    groups_summary.append(
-                        f"- {info['nombre']} ({info['empresa']}): {data['count']} mensajes - {info['tipo_servicio']}"
-                    )
-                else:
-                    groups_summary.append(f"- Grupo ID {grupo_id}: {data['count']} mensajes")
-        
-        groups_summary_text = "\n".join(groups_summary)
+        groups_summary_text = format_groups_summary(groups_data)
         
         # Contexto de todas las empresas
         all_grupos_context = get_summary_all_grupos()
@@ -346,9 +467,9 @@ Tu tarea es generar un **Reporte Ejecutivo Diario DETALLADO** basado en las conv
    - Si se mencionan procedimientos o normativas (SPCI, permisos, etc.), inclúyelos
 
 4. **Tratamiento de Archivos Adjuntos:**
-   - Cuando veas [📷 Imagen adjunta], menciona: "Se adjuntó evidencia fotográfica"
-   - Cuando veas [🎬 Video adjunto], menciona: "Se registró video del evento/equipo"
-   - Cuando veas [📄 PDF adjunto] o [📊 Excel adjunto], menciona el tipo de documento
+   - Cuando veas {attachment_marker("image")}, menciona: "Se adjuntó evidencia fotográfica"
+   - Cuando veas {attachment_marker("video")}, menciona: "Se registró video del evento/equipo"
+   - Cuando veas {attachment_marker("pdf")}, {attachment_marker("excel")} o {attachment_marker("word")}, menciona el tipo de documento
    - Si el análisis de imagen/video generado por IA está en el mensaje, úsalo para enriquecer el reporte
 
 5. **Estilo:**
@@ -368,18 +489,20 @@ Tu tarea es generar un **Reporte Ejecutivo Diario DETALLADO** basado en las conv
 
 Genera el reporte ahora, siendo lo más detallado y técnico posible:"""
 
-        response = claude_client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=6000,  # Aumentado para reportes más detallados
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
+        response = create_claude_message(
+            claude_client,
+            stage="report_standard",
+            prompt=prompt,
+            max_tokens=6000  # Aumentado para reportes más detallados
         )
         
         return response.content[0].text
         
     except Exception as e:
         print(f"❌ Error generando reporte con Claude: {e}")
+        s = current_span()
+        if s:
+            s.fail(e)
         return None
 
 def generate_report_with_gpt4(messages: list, groups_data: dict) -> str:
@@ -390,18 +513,7 @@ def generate_report_with_gpt4(messages: list, groups_data: dict) -> str:
         context = format_messages_for_context(messages)
         
         # Resumen de grupos activos
-        groups_summary = []
-        for grupo_id, data in groups_data.items():
-            if data['count'] > 0:
-                info = data['info']
-                if info:
-                    groups_summary.append(
-                        f"- {info['nombre']} ({info['empresa']}): {data['count']} mensajes - {info['tipo_servicio']}"
-                    )
-                else:
-                    groups_summary.append(f"- Grupo ID {grupo_id}: {data['count']} mensajes")
-        
-        groups_summary_text = "\n".join(groups_summary)
+        groups_summary_text = format_groups_summary(groups_data)
         all_grupos_context = get_summary_all_grupos()
         
         prompt = f"""{CONTEXTO_MINERA_CENTINELA}
@@ -436,15 +548,18 @@ def generate_report_with_gpt4(messages: list, groups_data: dict) -> str:
    - Registra personal clave mencionado
 
 3. **Archivos Adjuntos:**
-   - [📷 Imagen]: "Se adjuntó evidencia fotográfica"
-   - [🎬 Video]: "Se registró video"
+   - {attachment_marker("image")}: "Se adjuntó evidencia fotográfica"
+   - {attachment_marker("video")}: "Se registró video"
+   - {attachment_marker("pdf")} / {attachment_marker("excel")} / {attachment_marker("word")}: menciona el tipo de documento
    - Si hay análisis de IA de imagen/video, úsalo
 
 4. **Formato Markdown profesional con tablas, bullets y código para TAGs**
 
 Genera reporte técnico detallado ahora:"""
 
-        response = openai_client.chat.completions.create(
+        response = create_openai_chat(
+            openai_client,
+            stage="report_standard",
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "Eres un analista experto en operaciones mineras con profundo conocimiento técnico."},
@@ -468,79 +583,163 @@ Genera reporte técnico detallado ahora:"""
 # 4. GUARDADO Y EXPORTACIÓN
 # ----------------------------------------------------
 
-def upload_to_supabase_storage(filepath: str, bucket_name: str = "reportes") -> str:
+def upload_to_supabase_storage(artifact: dict, bucket_name: str = "reportes", bucket=None) -> str:
     """
-    Sube un archivo a Supabase Storage y retorna la URL pública.
+    Sube un artefacto en memoria a Supabase Storage y retorna la URL pública.
+    
+    Los objetos se guardan bajo una carpeta con el hash del reporte sin horas de
+    generación (artifact['content_hash'], ver report_content_hash), compartida por el
+    Markdown, HTML y PDF del mismo reporte
+    (ej: "3fa1.../reporte_ejecutivo_2025-12-09_08-00.pdf"). Si la carpeta ya tiene
+    un artefacto del mismo tipo, no se vuelve a subir y se reutiliza su URL.
+    Los tipos configurados en STORAGE_GZIP_TYPES se almacenan comprimidos (.gz,
+    application/gzip): quien descarga esa URL recibe el archivo comprimido.
     
     Args:
-        filepath: Path local del archivo
+        artifact: Entrada del manifiesto (tipo, filename, content, content_type, content_hash)
         bucket_name: Nombre del bucket en Supabase
+        bucket: Cliente de bucket ya abierto (para reutilizar la conexión)
         
     Returns:
         URL pública del archivo o None si falla
     """
-    try:
-        filename = os.path.basename(filepath)
-        
-        # Detectar content-type según extensión
-        if filename.endswith('.html'):
-            content_type = "text/html; charset=utf-8"
-        elif filename.endswith('.pdf'):
-            content_type = "application/pdf"
-        elif filename.endswith('.md'):
-            content_type = "text/markdown; charset=utf-8"
-        else:
-            content_type = "application/octet-stream"
-        
-        # Leer archivo
-        with open(filepath, 'rb') as f:
-            file_data = f.read()
-        
-        # Subir a Supabase Storage
-        response = supabase.storage.from_(bucket_name).upload(
-            path=filename,  # Sin prefijo "reportes/" - el nombre del bucket ya está en bucket_name
-            file=file_data,
-            file_options={
-                "content-type": content_type,
-                "cache-control": "3600",
-                "upsert": "true"  # Sobrescribir si ya existe
-            }
-        )
+    with span(f"upload.{artifact.get('tipo')}") as s:
+        try:
+            filename = artifact['filename']
+            content = artifact['content']
+            content_type = artifact['content_type']
         
-        # Obtener URL pública (sin duplicar el nombre del bucket)
-        public_url = supabase.storage.from_(bucket_name).get_public_url(filename)
+            if bucket is None:
+                bucket = supabase.storage.from_(bucket_name)
         
-        print(f"   ✅ Subido: {filename} ({content_type})")
-        return public_url
+            # Clave por contenido: la del reporte o, si falta, el hash de los bytes sin comprimir
+            content_hash = artifact.get('content_hash') or hashlib.sha256(content).hexdigest()[:32]
         
-    except Exception as e:
-        print(f"   ⚠️ Error al subir: {e}")
-        return None
+            # Reutilizar objeto existente del mismo tipo con el mismo contenido
+            extension = os.path.splitext(filename)[1]
+            existing = [
+                entry for entry in bucket.list(content_hash) or []
+                if entry['name'].endswith(extension) or entry['name'].endswith(f"{extension}.gz")
+            ]
+            if existing:
+                existing_path = f"{content_hash}/{existing[0]['name']}"
+                print(f"   ♻️ Sin cambios, reutilizando: {existing_path}")
+                s.add(cache_hits=1)
+                return bucket.get_public_url(existing_path)
+        
+            # Comprimir artefactos de texto (mtime=0 para que el resultado sea determinístico)
+            if artifact.get('tipo') in STORAGE_GZIP_TYPES:
+                original_size = len(content)
+                content = gzip.compress(content, mtime=0)
+                filename = f"{filename}.gz"
+                content_type = "application/gzip"
+                print(f"   🗜️ {artifact['filename']}: {original_size:,} → {len(content):,} bytes (gzip)")
+        
+            object_path = f"{content_hash}/{filename}"
+            s.set(bytes=len(content), path=object_path)
+        
+            # Subir a Supabase Storage directamente desde memoria
+            bucket.upload(
+                path=object_path,  # Sin prefijo "reportes/" - el nombre del bucket ya está en bucket_name
+                file=content,
+                file_options={
+                    "content-type": content_type,
+                    "cache-control": "31536000",  # Inmutable: la ruta cambia si cambia el contenido
+                    "upsert": "true"
+                }
+            )
+        
+            # Obtener URL pública (sin duplicar el nombre del bucket)
+            public_url = bucket.get_public_url(object_path)
+        
+            print(f"   ✅ Subido: {object_path} ({content_type})")
+            return public_url
+        
+        except Exception as e:
+            print(f"   ⚠️ Error al subir {artifact.get('filename')}: {e}")
+            s.fail(e)
+            return None
 
-def save_report_to_file(report_content: str, periodo_texto: str, output_dir: str = "/tmp") -> str:
+def upload_artifacts(manifest: dict, bucket_name: str = "reportes") -> dict:
     """
-    Guarda el reporte en formato Markdown y PDF con timestamp.
+    Sube todos los artefactos del manifiesto en paralelo.
+    
+    Todas las subidas comparten el mismo cliente de bucket, de modo que
+    reutilizan el pool de conexiones HTTP de Supabase Storage.
+    
+    Args:
+        manifest: Manifiesto retornado por save_report_to_file
+        bucket_name: Nombre del bucket en Supabase
+        
+    Returns:
+        Dict {tipo: url_publica} con los artefactos subidos correctamente
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    artifacts = manifest.get('artifacts', [])
+    if not artifacts:
+        return {}
+    
+    bucket = supabase.storage.from_(bucket_name)
+    
+    with ThreadPoolExecutor(max_workers=len(artifacts)) as executor:
+        futures = {
+            artifact['tipo']: executor.submit(upload_to_supabase_storage, artifact, bucket_name, bucket)
+            for artifact in artifacts
+        }
+        urls = {tipo: future.result() for tipo, future in futures.items()}
+    
+    return {tipo: url for tipo, url in urls.items() if url}
+
+def report_content_hash(report_content: str, periodo_texto: str) -> str:
+    """
+    Clave de contenido de los artefactos de un reporte.
+    
+    Se calcula sobre el Markdown sin las líneas de hora de generación (encabezado,
+    síntesis y firma) ni metadatos del PDF, de modo que dos ejecuciones que producen
+    el mismo reporte comparten la clave aunque se generen en momentos distintos.
+    """
+    canonical = GENERATION_TIME_LINES.sub("", report_content or "")
+    payload = json.dumps([periodo_texto, canonical], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def save_report_to_file(report_content: str, periodo_texto: str, output_dir: str = "/tmp") -> dict:
+    """
+    Genera el reporte en Markdown, HTML y PDF como buffers en memoria.
+    
+    Solo el Markdown se guarda además en disco como copia local; HTML y PDF
+    se mantienen en memoria y se suben directamente desde el manifiesto.
     
     Args:
         report_content: Contenido del reporte en Markdown
         periodo_texto: Texto descriptivo del período (ej: "Últimas 24 horas")
-        output_dir: Directorio donde guardar (default: /tmp para Railway)
+        output_dir: Directorio donde guardar la copia Markdown (default: /tmp para Railway)
     
     Returns:
-        Path del archivo PDF generado
+        Manifiesto de artefactos:
+        {
+            'filename_base': "reporte_ejecutivo_...",
+            'local_path': path del Markdown local (o None),
+            'content_hash': report_content_hash(...),
+            'artifacts': [{'tipo', 'filename', 'content', 'content_type', 'content_hash'}, ...]
+        }
+        o None si falla
     """
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
+        timestamp = replay.now().strftime("%Y-%m-%d_%H-%M")
         filename_base = f"reporte_ejecutivo_{timestamp}"
         
-        # Paths de archivos
-        md_filepath = os.path.join(output_dir, f"{filename_base}.md")
-        pdf_filepath = os.path.join(output_dir, f"{filename_base}.pdf")
+        manifest = {
+            'filename_base': filename_base,
+            'local_path': None,
+            'content_hash': report_content_hash(report_content, periodo_texto),
+            'artifacts': []
+        }
         
         # Header del reporte
         header = f"""# Reporte Ejecutivo Diario - Minera Centinela
 **Equipo:** GSdSO (Gestión de Sistemas de Operación)  
-**Fecha de generación:** {datetime.now().strftime("%d/%m/%Y %H:%M:%S")}  
+**Fecha de generación:** {replay.now().strftime("%d/%m/%Y %H:%M:%S")}  
 **Período analizado:** {periodo_texto}  
 
 ---
@@ -549,23 +748,41 @@ def save_report_to_file(report_content: str, periodo_texto: str, output_dir: str
         
         full_content = header + report_content
         
-        # 1. Guardar Markdown
-        with open(md_filepath, 'w', encoding='utf-8') as f:
-            f.write(full_content)
-        print(f"✅ Reporte Markdown guardado: {md_filepath}")
+        # 1. Markdown (siempre disponible)
+        manifest['artifacts'].append({
+            'tipo': 'md',
+            'filename': f"{filename_base}.md",
+            'content': full_content.encode('utf-8'),
+            'content_type': "text/markdown; charset=utf-8",
+            'content_hash': manifest['content_hash']
+        })
+        
+        md_filepath = os.path.join(output_dir, f"{filename_base}.md")
+        try:
+            with open(md_filepath, 'w', encoding='utf-8') as f:
+                f.write(full_content)
+            manifest['local_path'] = md_filepath
+            print(f"✅ Reporte Markdown guardado: {md_filepath}")
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar copia local del Markdown: {e}")
         
         # 2. Convertir a HTML visual (opcional)
-        html_filepath = None
+        html_content = None
         try:
             from markdown_to_html_converter import convert_report_to_html
             
-            html_content = convert_report_to_html(full_content, periodo_texto)
-            html_filepath = os.path.join(output_dir, f"{filename_base}.html")
-            
-            with open(html_filepath, 'w', encoding='utf-8') as f:
-                f.write(html_content)
+            with span("html") as s:
+                html_content = convert_report_to_html(full_content, periodo_texto)
+                s.set(bytes=len(html_content))
+            manifest['artifacts'].append({
+                'tipo': 'html',
+                'filename': f"{filename_base}.html",
+                'content': html_content.encode('utf-8'),
+                'content_type': "text/html; charset=utf-8",
+                'content_hash': manifest['content_hash']
+            })
             
-            print(f"✅ Reporte HTML generado: {html_filepath}")
+            print(f"✅ Reporte HTML generado en memoria ({len(html_content):,} caracteres)")
             
         except ImportError as e:
             print(f"⚠️ No se pudo importar markdown_to_html_converter: {e}")
@@ -573,141 +790,31 @@ def save_report_to_file(report_content: str, periodo_texto: str, output_dir: str
             print(f"⚠️ No se pudo generar HTML: {e}")
         
         # 3. Convertir a PDF (opcional, requiere WeasyPrint)
-        pdf_filepath = os.path.join(output_dir, f"{filename_base}.pdf")
         try:
-            # Intentar generar PDF desde HTML o Markdown
-            if html_filepath and os.path.exists(html_filepath):
+            if html_content:
                 print("   📄 Intentando generar PDF desde HTML...")
-                from weasyprint import HTML
-                HTML(html_filepath).write_pdf(pdf_filepath)
-                print(f"✅ Reporte PDF generado: {pdf_filepath}")
+                with span("pdf") as s:
+                    from weasyprint import HTML
+                    pdf_bytes = HTML(string=html_content).write_pdf()
+                    s.set(bytes=len(pdf_bytes))
+                manifest['artifacts'].append({
+                    'tipo': 'pdf',
+                    'filename': f"{filename_base}.pdf",
+                    'content': pdf_bytes,
+                    'content_type': "application/pdf",
+                    'content_hash': manifest['content_hash']
+                })
+                print(f"✅ Reporte PDF generado en memoria ({len(pdf_bytes):,} bytes)")
             else:
                 print("   ⚠️ HTML no disponible, saltando generación de PDF")
-                pdf_filepath = None
                 
         except ImportError:
             print("   ⚠️ WeasyPrint no está disponible. Saltando generación de PDF.")
             print("   💡 Para habilitar PDF, instala: apt-get install -y libpango-1.0-0 libpangocairo-1.0-0")
-            pdf_filepath = None
         except Exception as e:
             print(f"   ⚠️ No se pudo generar PDF: {e}")
-            pdf_filepath = None
         
-        # Retornar el archivo principal (Markdown siempre existe)
-        return md_filepath
-        try:
-            import markdown
-            from weasyprint import HTML, CSS
-            
-            # Convertir Markdown a HTML
-            html_content = markdown.markdown(
-                full_content,
-                extensions=['tables', 'fenced_code', 'codehilite']
-            )
-            
-            # CSS para estilo profesional
-            css_style = CSS(string="""
-                @page {
-                    size: letter;
-                    margin: 2cm;
-                    @top-center {
-                        content: "Minera Centinela - Reporte Ejecutivo";
-                        font-size: 10pt;
-                        color: #666;
-                    }
-                    @bottom-right {
-                        content: "Página " counter(page) " de " counter(pages);
-                        font-size: 9pt;
-                        color: #666;
-                    }
-                }
-                body {
-                    font-family: 'Helvetica', 'Arial', sans-serif;
-                    font-size: 11pt;
-                    line-height: 1.6;
-                    color: #333;
-                }
-                h1 {
-                    color: #1a5490;
-                    border-bottom: 3px solid #1a5490;
-                    padding-bottom: 10px;
-                    margin-top: 20px;
-                }
-                h2 {
-                    color: #2c6ea8;
-                    border-bottom: 2px solid #ccc;
-                    padding-bottom: 5px;
-                    margin-top: 15px;
-                }
-                h3 {
-                    color: #3d7eb5;
-                    margin-top: 12px;
-                }
-                strong {
-                    color: #c0392b;
-                }
-                code {
-                    background-color: #f4f4f4;
-                    padding: 2px 6px;
-                    border-radius: 3px;
-                    font-family: 'Courier New', monospace;
-                    color: #e74c3c;
-                }
-                table {
-                    border-collapse: collapse;
-                    width: 100%;
-                    margin: 15px 0;
-                }
-                th, td {
-                    border: 1px solid #ddd;
-                    padding: 8px;
-                    text-align: left;
-                }
-                th {
-                    background-color: #1a5490;
-                    color: white;
-                }
-                tr:nth-child(even) {
-                    background-color: #f9f9f9;
-                }
-                blockquote {
-                    border-left: 4px solid #1a5490;
-                    padding-left: 15px;
-                    color: #666;
-                    font-style: italic;
-                }
-            """)
-            
-            # Generar PDF
-            html_doc = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <title>Reporte Ejecutivo - Minera Centinela</title>
-            </head>
-            <body>
-                {html_content}
-            </body>
-            </html>
-            """
-            
-            HTML(string=html_doc).write_pdf(pdf_filepath, stylesheets=[css_style])
-            print(f"✅ Reporte PDF generado: {pdf_filepath}")
-            
-        except Exception as e:
-            print(f"⚠️ No se pudo generar PDF: {e}")
-            print(f"   El reporte está disponible en Markdown")
-        
-        # 3. Imprimir contenido completo en logs
-        print("\n" + "="*70)
-        print("📄 CONTENIDO COMPLETO DEL REPORTE:")
-        print("="*70)
-        print(full_content)
-        print("="*70 + "\n")
-        
-        # Retornar path del PDF si existe, sino del Markdown
-        return pdf_filepath if os.path.exists(pdf_filepath) else md_filepath
+        return manifest
         
     except Exception as e:
         print(f"❌ Error guardando reporte: {e}")
@@ -722,6 +829,7 @@ def save_report_to_file(report_content: str, periodo_texto: str, output_dir: str
 def generate_daily_report():
     """
     Genera el reporte ejecutivo diario completo.
+    Cada ejecución se registra como un run con spans por etapa (ver tracing.py).
     """
     print("\n" + "="*70)
     print("📊 GENERADOR DE REPORTE EJECUTIVO DIARIO")
@@ -740,17 +848,98 @@ def generate_daily_report():
     
     print("="*70 + "\n")
     
+    replay_mode = replay.start()
+    start_run(periodo=periodo_texto, advanced=USE_ADVANCED_ANALYSIS, max_messages=MAX_MESSAGES_IN_REPORT,
+              replay_mode=replay_mode)
+    budget = start_budget()
+    stage_profiler.start()
+    filepath = None
+    try:
+        filepath = _run_report_stages(periodo_texto)
+        return filepath
+    finally:
+        budget.print_report()
+        end_run(budget=budget.summary())
+        stage_profiler.write_report(os.path.dirname(filepath) if filepath and os.path.isfile(filepath) else "/tmp")
+        replay.save()
+        replay.stop()
+
+def _report_window_hours() -> float:
+    """Duración de la ventana configurada del reporte, en horas."""
+    if REPORT_START_DATE and REPORT_END_DATE:
+        start = datetime.fromisoformat(REPORT_START_DATE if 'T' in REPORT_START_DATE else f"{REPORT_START_DATE}T00:00:00")
+        end = datetime.fromisoformat(REPORT_END_DATE if 'T' in REPORT_END_DATE else f"{REPORT_END_DATE}T23:59:59")
+        return (end - start).total_seconds() / 3600
+    return REPORT_TIME_WINDOW_HOURS
+
+def _run_report_stages(periodo_texto: str):
+    """
+    Etapas del reporte diario: consulta, agrupación, IA, guardado y subida.
+    """
     # 1. Obtener mensajes del período
+    # Ventanas de varios días se resumen jerárquicamente: se traen todos sus mensajes.
+    # Con ese límite la columna embedding completa (JSON de 1.536 floats por fila) no cabe
+    # en memoria: se trae solo cuantizada (EMBEDDING_TRANSFER=quantized) o no se trae
+    max_messages = MAX_MESSAGES_IN_REPORT
+    fetch_embeddings = True
+    if USE_ADVANCED_ANALYSIS and HIERARCHICAL_SUMMARY != "false" and _report_window_hours() > 24:
+        max_messages = max(MAX_MESSAGES_IN_REPORT, HIERARCHICAL_MAX_MESSAGES)
+        fetch_embeddings = embedding_codec.EMBEDDING_TRANSFER == "quantized"
+    
+    # Actualización incremental: si ya hubo una ejecución hoy, solo se procesan los mensajes nuevos
+    window_key = f"{REPORT_START_DATE}..{REPORT_END_DATE}" if REPORT_START_DATE and REPORT_END_DATE else f"{REPORT_TIME_WINDOW_HOURS}h"
+    today = replay.now().strftime("%Y-%m-%d")
+    refresh_state = None
+    if USE_ADVANCED_ANALYSIS and incremental_refresh.is_enabled():
+        refresh_state = replay.memo("refresh_state", lambda: incremental_refresh.load_state(window_key, today))
+        if refresh_state:
+            periodo_texto = f"{refresh_state['periodo_texto']} (actualizado {replay.now().strftime('%H:%M')})"
+    
+    # Embeddings pendientes: la consulta filtra por embedding y sin vector el mensaje quedaría fuera
+    if embedding_backfill.EMBEDDING_BACKFILL and supabase and openai_client and not replay.is_replaying():
+        print("🧬 Completando embeddings pendientes de la ventana...")
+        if refresh_state:
+            backfill_start, backfill_end = incremental_refresh.fetch_since(refresh_state), None
+        else:
+            backfill_start, backfill_end = _resolve_window(REPORT_START_DATE, REPORT_END_DATE, REPORT_TIME_WINDOW_HOURS)
+        try:
+            embedding_backfill.backfill_embeddings(supabase, openai_client, backfill_start, backfill_end)
+        except Exception as e:
+            print(f"   ⚠️ Completado de embeddings omitido: {e}")
+    
     print("📥 Obteniendo mensajes del período...")
-    print(f"   📊 Límite configurado: {MAX_MESSAGES_IN_REPORT} mensajes")
+    print(f"   📊 Límite configurado: {max_messages} mensajes")
     
-    if REPORT_START_DATE and REPORT_END_DATE:
-        messages = get_messages_by_date_range(
-            start_date=REPORT_START_DATE,
-            end_date=REPORT_END_DATE
-        )
-    else:
-        messages = get_messages_by_date_range(hours=REPORT_TIME_WINDOW_HOURS)
+    with span("fetch", incremental=refresh_state is not None) as s:
+        if refresh_state:
+            print(f"   🔄 Actualización incremental: mensajes posteriores a {refresh_state['watermark']}")
+            messages = get_messages_by_date_range(
+                start_date=incremental_refresh.fetch_since(refresh_state),
+                end_date=replay.now().isoformat(),
+                limit=max_messages,
+                embeddings=fetch_embeddings
+            )
+            messages = incremental_refresh.new_messages(refresh_state, messages)
+        elif REPORT_START_DATE and REPORT_END_DATE:
+            messages = get_messages_by_date_range(
+                start_date=REPORT_START_DATE,
+                end_date=REPORT_END_DATE,
+                limit=max_messages,
+                embeddings=fetch_embeddings
+            )
+        else:
+            messages = get_messages_by_date_range(hours=REPORT_TIME_WINDOW_HOURS, limit=max_messages,
+                                                  embeddings=fetch_embeddings)
+        s.add(rows=len(messages))
+    
+    if embedding_codec.EMBEDDING_TRANSFER == "quantized" and fetch_embeddings:
+        sin_cuantizar = sum(1 for msg in messages if msg.get('embedding') is None)
+        if sin_cuantizar:
+            print(f"   ⚠️ {sin_cuantizar} mensajes sin embedding_q: ejecuta el UPDATE de 'setup_quantized_embeddings.sql'")
+    
+    if not messages and refresh_state:
+        print("✅ Sin mensajes nuevos desde la última ejecución: se mantiene el reporte vigente.")
+        return refresh_state.get('report_path')
     
     if not messages:
         print("⚠️ No se encontraron mensajes en el período especificado.")
@@ -758,17 +947,49 @@ def generate_daily_report():
     
     print(f"✅ Se encontraron {len(messages)} mensajes con embeddings.")
     
-    if len(messages) >= MAX_MESSAGES_IN_REPORT:
-        print(f"⚠️ ADVERTENCIA: Se alcanzó el límite de {MAX_MESSAGES_IN_REPORT} mensajes.")
+    if len(messages) >= max_messages:
+        print(f"⚠️ ADVERTENCIA: Se alcanzó el límite de {max_messages} mensajes.")
         print(f"   Es posible que haya más mensajes en el período que no fueron incluidos.")
         print(f"   Para analizar más mensajes, aumenta MAX_MESSAGES_IN_REPORT en Railway variables.")
     
+    # Huella de la ejecución: un reintento sobre los mismos mensajes reutiliza los artefactos
+    fingerprint = None
+    if run_fingerprint.SKIP_UNCHANGED_RUNS and not refresh_state and not replay.is_replaying() and supabase:
+        with span("fingerprint") as s:
+            fingerprint = run_fingerprint.compute_fingerprint(messages, {
+                "ventana": window_key,
+                "avanzado": USE_ADVANCED_ANALYSIS,
+                "sintesis": SYNTHESIS_MODE,
+                "embeddings": embedding_codec.EMBEDDING_TRANSFER,
+                "max_mensajes": max_messages,
+                "contexto": [CONTEXT_PACKING, CONTEXT_ENCODING, CONTEXT_THREADING, SITE_TIMEZONE]
+            })
+            previous = run_fingerprint.find_previous_run(supabase.storage.from_("reportes"), fingerprint)
+            s.set(fingerprint=fingerprint, reused=previous is not None)
+        
+        if previous:
+            print(f"\n♻️ Mensajes sin cambios desde la ejecución {previous.get('run_id')} ({previous.get('generado')})")
+            print("   Se reutilizan sus reportes:")
+            for tipo, url in previous.get('urls', {}).items():
+                print(f"   📎 {tipo}: {url}")
+            return run_fingerprint.restore_markdown(supabase.storage.from_("reportes"), previous)
+    
     # 2. Agrupar por grupos/empresas
     print("\n🏷️ Agrupando mensajes por grupos/empresas...")
-    groups_data = aggregate_messages_by_topic(messages)
-    
-    # Agrupar por superintendencia
-    by_superintendencia = aggregate_by_superintendencia(groups_data)
+    with span("aggregate") as s:
+        # Conteos de la ventana completa calculados en el servidor (setup_group_stats.sql)
+        if refresh_state:
+            stats = get_group_stats(start_date=refresh_state['window_start'], end_date=replay.now().isoformat())
+        elif REPORT_START_DATE and REPORT_END_DATE:
+            stats = get_group_stats(start_date=REPORT_START_DATE, end_date=REPORT_END_DATE)
+        else:
+            stats = get_group_stats(hours=REPORT_TIME_WINDOW_HOURS)
+        groups_data = aggregate_messages_by_topic(messages, stats)
+        
+        # Agrupar por superintendencia
+        by_superintendencia = aggregate_by_superintendencia(groups_data)
+        s.add(rows=len(messages))
+        s.set(groups=len(groups_data))
     
     print("\n📊 Distribución por Superintendencia:")
     for si_codigo, si_data in by_superintendencia.items():
@@ -778,20 +999,31 @@ def generate_daily_report():
         
         for grupo_id, data in si_data['grupos'].items():
             info = data['info']
+            detalle = ""
+            if data.get('stats'):
+                detalle = f" ({data['stats']['remitentes']} remitentes, {data['stats']['adjuntos']} adjuntos)"
             if info:
-                print(f"      • {info['empresa']}: {data['count']} mensajes")
+                print(f"      • {info['empresa']}: {data['count']} mensajes{detalle}")
             else:
-                print(f"      • Grupo ID {grupo_id}: {data['count']} mensajes")
+                print(f"      • Grupo ID {grupo_id}: {data['count']} mensajes{detalle}")
     
     # 3. Generar reporte con IA
     print("\n🤖 Generando reporte ejecutivo con IA...")
     
-    if USE_ADVANCED_ANALYSIS and claude_client:
+    analyses = None
+    if USE_ADVANCED_ANALYSIS and (claude_client or replay.is_replaying()):
         print("   🔬 Modo: Análisis Técnico Avanzado (Multi-pasada)")
-        report = generate_advanced_technical_report(messages, groups_data, periodo_texto)
+        report, analyses = analyze_messages(
+            messages, periodo_texto,
+            previous_analyses=refresh_state['analyses'] if refresh_state else None,
+            run_id=refresh_state['run_id'] if refresh_state else None,
+            db_client=supabase,
+            total_mensajes=incremental_refresh.processed_count(refresh_state, messages) if refresh_state else None
+        )
     else:
         print("   📝 Modo: Análisis Estándar")
-        report = generate_report_with_claude(messages, groups_data)
+        with span("report_standard"):
+            report = generate_report_with_claude(messages, groups_data)
     
     if not report:
         print("❌ No se pudo generar el reporte.")
@@ -801,54 +1033,41 @@ def generate_daily_report():
     
     # 4. Guardar reporte
     print("\n💾 Guardando reporte...")
-    filepath = save_report_to_file(report, periodo_texto)
+    manifest = save_report_to_file(report, periodo_texto)
     
-    if filepath:
+    if manifest:
+        filepath = manifest['local_path']
+        
+        # Estado para la próxima actualización incremental del día
+        if analyses is not None and incremental_refresh.is_enabled() and not replay.is_replaying():
+            window_start = _resolve_window(REPORT_START_DATE, REPORT_END_DATE, REPORT_TIME_WINDOW_HOURS)[0]
+            incremental_refresh.save_state(incremental_refresh.build_state(
+                refresh_state, get_run_id(), window_key, today, window_start,
+                periodo_texto, analyses, messages, report_path=filepath
+            ))
+        
         print(f"\n{'='*70}")
         print("✅ REPORTE COMPLETADO")
         print(f"📄 Archivo local: {filepath}")
         
-        # Subir archivos a Supabase Storage
-        print("\n📤 Subiendo reportes a Supabase Storage...")
-        
-        # Detectar archivos generados buscando por timestamp aproximado
-        output_dir = "/tmp"
-        import glob
-        
-        # Buscar archivos recientes (últimos 5 minutos)
-        recent_time = datetime.now().timestamp() - 300  # 5 minutos
-        
-        html_files = glob.glob(os.path.join(output_dir, "reporte_ejecutivo_*.html"))
-        pdf_files = glob.glob(os.path.join(output_dir, "reporte_ejecutivo_*.pdf"))
-        
-        # Filtrar solo archivos recientes
-        html_files = [f for f in html_files if os.path.getmtime(f) > recent_time]
-        pdf_files = [f for f in pdf_files if os.path.getmtime(f) > recent_time]
-        
-        urls = {}
-        
-        # Subir HTML más reciente si existe
-        if html_files:
-            html_file = max(html_files, key=os.path.getmtime)  # Más reciente
-            html_url = upload_to_supabase_storage(html_file, bucket_name="reportes")
-            if html_url:
-                urls['html'] = html_url
-                print(f"   ✅ HTML: {html_url}")
-        
-        # Subir PDF más reciente si existe
-        if pdf_files:
-            pdf_file = max(pdf_files, key=os.path.getmtime)  # Más reciente
-            pdf_url = upload_to_supabase_storage(pdf_file, bucket_name="reportes")
-            if pdf_url:
-                urls['pdf'] = pdf_url
-                print(f"   ✅ PDF: {pdf_url}")
+        # Subir artefactos del manifiesto a Supabase Storage (en paralelo)
+        if replay.is_replaying():
+            print("\n▶️ Modo replay: subida a Supabase Storage omitida")
+            urls = {}
+        else:
+            print("\n📤 Subiendo reportes a Supabase Storage...")
+            urls = upload_artifacts(manifest, bucket_name="reportes")
+            if fingerprint and urls:
+                run_fingerprint.record_run(supabase.storage.from_("reportes"), fingerprint, get_run_id(), filepath, urls)
         
-        if urls:
+        if 'html' in urls or 'pdf' in urls:
             print("\n💡 Reportes disponibles:")
             if 'html' in urls:
                 print(f"   📊 Visualizar (interactivo): {urls['html']}")
             if 'pdf' in urls:
                 print(f"   📄 Descargar (PDF): {urls['pdf']}")
+            if 'md' in urls:
+                print(f"   📝 Markdown: {urls['md']}")
         else:
             print("   ℹ️ Solo Markdown disponible (HTML/PDF requieren dependencias adicionales)")
         
@@ -0,0 +1,142 @@
+"""
+Lectura Concurrente de Mensajes por Particiones de Tiempo
+Minera Centinela - GSdSO
+Divide la ventana del reporte en tramos, los consulta en paralelo contra PostgREST
+con un cliente httpx asíncrono (HTTP/2, conexiones reutilizadas) y une los resultados en orden
+"""
+
+import asyncio
+import heapq
+import os
+from datetime import datetime, timedelta
+
+try:
+    import httpx
+except ImportError:  # Dependencia opcional: sin httpx se usa el paginado secuencial
+    httpx = None
+
+from tracing import span
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")
+
+# "auto": se usa cuando la ventana abarca más de una partición; "true" / "false"
+ASYNC_FETCH = os.environ.get("ASYNC_FETCH", "auto").lower()
+FETCH_PARTITION_HOURS = float(os.environ.get("FETCH_PARTITION_HOURS", "24"))
+FETCH_CONCURRENCY = int(os.environ.get("FETCH_CONCURRENCY", "6"))
+FETCH_RETRIES = int(os.environ.get("FETCH_RETRIES", "3"))
+FETCH_TIMEOUT_SECONDS = float(os.environ.get("FETCH_TIMEOUT_SECONDS", "60"))
+FETCH_PAGE_SIZE = 1000  # max-rows por defecto de PostgREST
+# Un resto final más corto que esta fracción de tramo se une al tramo anterior. Sin fin
+# explícito, "ahora" se calcula después que el inicio de la ventana (últimas N horas) y
+# una ventana de 24 h mediría unos milisegundos más que un tramo
+PARTITION_MERGE_FRACTION = 0.05
+
+# Transporte httpx alternativo (benchmark: PostgREST simulado en memoria)
+TRANSPORT = None
+
+def _parse(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def partition_window(start_str: str, end_str: str = None, hours: float = None) -> list:
+    """
+    Tramos [desde, hasta) de la ventana; el último incluye el extremo final y
+    absorbe un resto menor que PARTITION_MERGE_FRACTION de tramo.
+
+    Returns:
+        Lista de tuplas (desde, hasta, es_ultimo) en formato ISO
+    """
+    hours = hours or FETCH_PARTITION_HOURS
+    start = _parse(start_str)
+    end = _parse(end_str) if end_str else datetime.now(start.tzinfo)
+    partitions = []
+    cursor = start
+    step = timedelta(hours=hours)
+    while cursor < end:
+        upper = cursor + step
+        if end - upper <= step * PARTITION_MERGE_FRACTION:
+            upper = end
+        partitions.append((cursor.isoformat(), upper.isoformat(), upper >= end))
+        cursor = upper
+    return partitions or [(start.isoformat(), end.isoformat(), True)]
+
+def is_enabled(start_str: str, end_str: str = None) -> bool:
+    """
+    Indica si la ventana se lee con el cliente concurrente.
+    """
+    if ASYNC_FETCH == "false" or httpx is None:
+        return False
+    if TRANSPORT is None and not (SUPABASE_URL and SUPABASE_SERVICE_KEY):
+        return False
+    return ASYNC_FETCH == "true" or len(partition_window(start_str, end_str)) > 1
+
+async def _fetch_partition(client, semaphore, columns: str, lower: str, upper: str,
+                           last: bool, limit: int) -> list:
+    """
+    Lee un tramo completo (paginado) con reintentos propios: un tramo lento o
+    fallido se reintenta sin repetir los demás.
+    """
+    with span("fetch.partition", desde=lower, hasta=upper) as s:
+        for attempt in range(FETCH_RETRIES + 1):
+            try:
+                rows = []
+                async with semaphore:
+                    while len(rows) < limit:
+                        page_size = min(FETCH_PAGE_SIZE, limit - len(rows))
+                        response = await client.get("/mensajes_analisis", params=[
+                            ("select", columns),
+                            ("fecha_hora", f"gte.{lower}"),
+                            ("fecha_hora", f"{'lte' if last else 'lt'}.{upper}"),
+                            ("deleted_at", "is.null"),
+                            ("embedding", "not.is.null"),
+                            ("order", "fecha_hora.asc,id.asc"),
+                            ("offset", str(len(rows))),
+                            ("limit", str(page_size)),
+                        ])
+                        response.raise_for_status()
+                        page = response.json()
+                        rows.extend(page)
+                        if len(page) < page_size:
+                            break
+                s.add(rows=len(rows))
+                return rows
+            except (httpx.HTTPError, ValueError) as e:
+                s.add(retries=1)
+                if attempt == FETCH_RETRIES:
+                    raise
+                print(f"   ⚠️ Tramo {lower[:16]} → {upper[:16]}: {e.__class__.__name__}, reintento {attempt + 1}")
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+async def _fetch_all(columns: str, partitions: list, limit: int) -> list:
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    async with httpx.AsyncClient(
+        base_url=f"{SUPABASE_URL}/rest/v1",
+        headers={"apikey": SUPABASE_SERVICE_KEY or "", "Authorization": f"Bearer {SUPABASE_SERVICE_KEY or ''}"},
+        http2=TRANSPORT is None,
+        transport=TRANSPORT,
+        limits=httpx.Limits(max_connections=FETCH_CONCURRENCY, max_keepalive_connections=FETCH_CONCURRENCY),
+        timeout=FETCH_TIMEOUT_SECONDS
+    ) as client:
+        return await asyncio.gather(*[
+            _fetch_partition(client, semaphore, columns, lower, upper, last, limit)
+            for lower, upper, last in partitions
+        ])
+
+def fetch_messages(start_str: str, end_str: str, limit: int, columns: str) -> list:
+    """
+    Lee la ventana en tramos concurrentes y los une en orden (fecha_hora, id).
+
+    Args:
+        start_str: Inicio de la ventana (ISO)
+        end_str: Fin de la ventana (ISO, None = ahora)
+        limit: Máximo de mensajes (los más antiguos, igual que el paginado secuencial)
+        columns: Columnas del select de PostgREST
+
+    Returns:
+        Lista de mensajes en orden cronológico
+    """
+    partitions = partition_window(start_str, end_str)
+    print(f"   🔀 Lectura concurrente: {len(partitions)} tramos, hasta {FETCH_CONCURRENCY} en paralelo")
+    results = asyncio.run(_fetch_all(columns, partitions, limit))
+    merged = heapq.merge(*results, key=lambda row: (row.get('fecha_hora') or '', row.get('id') or 0))
+    return [row for _, row in zip(range(limit), merged)]
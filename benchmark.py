@@ -0,0 +1,901 @@
+"""
+Benchmark Offline del Pipeline de Reportes
+Minera Centinela - GSdSO
+Tráfico sintético de WhatsApp y servicios simulados (Supabase, OpenAI, Claude)
+
+Uso:
+    python benchmark.py --messages 5000 --hours 24 --output bench_results.json
+    python benchmark.py --messages 100000 --max-messages 100000 --claude-latency 0
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from datetime import datetime, timedelta
+
+# Credenciales de relleno: app.py crea sus clientes al importarse, pero en el
+# benchmark todos se reemplazan por los simulados antes de cualquier llamada.
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYmVuY2htYXJrIn0.benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("ANTHROPIC_API_KEY", "sk-ant-benchmark")
+
+from grupos_config import GRUPOS_EMPRESAS
+import embedding_codec
+
+EMBEDDING_DIM = 1536
+
+# ----------------------------------------------------
+# 1. GENERADOR DE TRÁFICO SINTÉTICO
+# ----------------------------------------------------
+
+REMITENTES = [
+    "Juan Pérez", "María González", "Carlos Rojas", "Patricia Muñoz", "Luis Soto",
+    "Andrea Contreras", "Jorge Silva", "Camila Morales", "Rodrigo Fuentes", "Francisca Díaz",
+    "Pedro Araya", "Valentina Castillo", "Felipe Tapia", "Daniela Reyes", "Sebastián Vega",
+    "Supervisor Turno A", "Supervisor Turno B", "Jefe Mantención", "Planificador GSdSO"
+]
+
+TAGS_POR_GRUPO = {
+    1: ["GR-110", "GR-220", "CP-015", "MH-032", "GH-007"],
+    2: ["AND-SPS-502", "AND-CH-001", "EST-410", "AND-SE-12"],
+    3: ["GEN-045", "LUM-118", "CMP-077", "GEN-102"],
+    4: ["CMP-GA-90", "CMP-ZR-160", "GEN-QAS-200", "CMP-GA-75"],
+    5: ["UF-A Moly", "UF-B Sulfuro", "P-101", "TK-305", "RO-2A", "BB-12"],
+    6: ["AA-SSEE-04", "CH-HVAC-02", "UMA-31", "AA-SALA-CTRL"],
+    7: ["762-ER-001", "TR-220-3", "PORT-AT-07", "LAT-110-A"]
+}
+
+AREAS = [
+    "Concentradora", "Hidrometalurgia", "Chancador Primario", "SPS-502", "Sala Compresores",
+    "SSEE sector norte", "Planta RO", "Sala Eléctrica", "Espesadores", "Taller Mina"
+]
+
+EMPRESAS_POR_GRUPO = {grupo_id: info['empresa'] for grupo_id, info in GRUPOS_EMPRESAS.items()}
+
+PLANTILLAS = [
+    "Buenos días, se inicia {trabajo} en `{tag}` ubicado en {area}. Personal: {n} técnicos {empresa}.",
+    "Se finaliza {trabajo} en {tag}, equipo queda operativo. Horas trabajadas: {h} HH.",
+    "QP #{qp}: se detiene {trabajo} en {area} por falta de permiso SPCI. Demora estimada {h} horas.",
+    "Demora en {trabajo} de {tag} por espera de materiales, llegan mañana turno día.",
+    "Reporte turno {turno}: {tag} caudal {caudal} m³/h, presión {presion} bar, frecuencia {hz} Hz.",
+    "Incidente: casi accidente en {area}, trabajador {empresa} sin lesiones. Se detiene trabajo y se realiza charla.",
+    "Hallazgo de seguridad: baranda suelta en andamio {tag}, se segrega el área y se informa a supervisor.",
+    "Producción turno {turno}: Moly {moly} m³, Sulfuro {sulfuro} m³. Sin novedades.",
+    "Falla recurrente en {tag}, tercera vez esta semana. Se solicita revisión de {trabajo}.",
+    "Compromiso: {empresa} entrega informe de {trabajo} antes del viernes. Responsable {remitente}.",
+    "Emergente: se prioriza {trabajo} en {tag}, se desplaza mantención preventiva programada.",
+    "Temperatura {tag} {temp} °C, fuera de rango normal 35-45 °C, se monitorea.",
+    "Ok, recibido.",
+    "Conforme, quedamos atentos.",
+    "Se adjunta registro fotográfico del avance en {area}.",
+]
+
+TRABAJOS = [
+    "cambio de rodamientos", "mantención preventiva", "lavado de aisladores", "armado de andamio",
+    "izaje de motor", "cambio de membranas", "revisión de tablero", "cambio de filtros",
+    "calibración de instrumentos", "desarme de estructura", "cambio motor doble eje",
+    "inspección termográfica", "reparación de fuga"
+]
+
+ADJUNTOS = [".jpg", ".jpeg", ".png", ".mp4", ".pdf", ".xlsx", ".docx"]
+
+def _embedding_pool(size: int, dim: int, rng: random.Random) -> list:
+    """
+    Genera un conjunto de embeddings normalizados serializados como texto.
+
+    PostgREST entrega las columnas vector como string "[0.1,0.2,...]"; se usa un
+    pool compartido para que 100k filas no ocupen gigabytes de memoria.
+    """
+    pool = []
+    for _ in range(size):
+        vector = [rng.gauss(0, 1) for _ in range(dim)]
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        pool.append("[" + ",".join(f"{v / norm:.6f}" for v in vector) + "]")
+    return pool
+
+def generate_synthetic_messages(count: int = 1000, hours: int = 24, end_time: datetime = None,
+                                seed: int = 42, embedding_dim: int = EMBEDDING_DIM,
+                                attachment_ratio: float = 0.15) -> list:
+    """
+    Genera filas sintéticas con el mismo esquema que mensajes_analisis.
+
+    Args:
+        count: Número de mensajes a generar (probado hasta 100k)
+        hours: Ventana de tiempo cubierta por los mensajes
+        end_time: Fin de la ventana (default: ahora)
+        seed: Semilla para que el corpus sea reproducible
+        embedding_dim: Dimensión de los embeddings sintéticos
+        attachment_ratio: Proporción de mensajes con archivo adjunto
+
+    Returns:
+        Lista de diccionarios ordenada por fecha_hora
+    """
+    rng = random.Random(seed)
+    end_time = end_time or datetime.now()
+    start_time = end_time - timedelta(hours=hours)
+    window_seconds = hours * 3600
+
+    embeddings = _embedding_pool(min(256, max(count, 1)), embedding_dim, rng)
+    grupo_ids = list(GRUPOS_EMPRESAS.keys())
+    # Los grupos de mayor actividad reciben más tráfico
+    pesos = [3, 2, 2, 1, 4, 1, 2][:len(grupo_ids)]
+
+    timestamps = sorted(rng.random() * window_seconds for _ in range(count))
+
+    messages = []
+    for i, offset in enumerate(timestamps, 1):
+        grupo_id = rng.choices(grupo_ids, weights=pesos)[0]
+        remitente = rng.choice(REMITENTES)
+        fecha_hora = start_time + timedelta(seconds=offset)
+
+        texto = rng.choice(PLANTILLAS).format(
+            trabajo=rng.choice(TRABAJOS),
+            tag=rng.choice(TAGS_POR_GRUPO.get(grupo_id, ["EQ-000"])),
+            area=rng.choice(AREAS),
+            empresa=EMPRESAS_POR_GRUPO.get(grupo_id, "CONTRATISTA"),
+            remitente=remitente,
+            n=rng.randint(2, 12),
+            h=round(rng.uniform(0.5, 8), 1),
+            qp=rng.randint(100, 999),
+            turno=rng.choice(["día", "noche"]),
+            caudal=rng.randint(40, 90),
+            presion=round(rng.uniform(2, 12), 1),
+            hz=rng.randint(35, 50),
+            moly=rng.randint(800, 1500),
+            sulfuro=rng.randint(1500, 3000),
+            temp=rng.randint(30, 60)
+        )
+
+        url_storage = ""
+        es_imagen = False
+        if rng.random() < attachment_ratio:
+            ext = rng.choice(ADJUNTOS)
+            es_imagen = ext in (".jpg", ".jpeg", ".png")
+            url_storage = f"https://storage.local/adjuntos/{grupo_id}/{i:07d}{ext}"
+            if es_imagen:
+                texto += " [Análisis IA de imagen: se observa personal con EPP completo y equipo en posición.]"
+
+        messages.append({
+            'id': i,
+            'grupo_id': grupo_id,
+            'fecha_hora': fecha_hora.isoformat(timespec='seconds'),
+            'remitente': remitente,
+            'contenido_texto': texto,
+            'es_imagen': es_imagen,
+            'url_storage': url_storage,
+            'embedding': embeddings[rng.randrange(len(embeddings))],
+            'whatsapp_message_id': f"wamid.{hashlib.md5(str(i).encode()).hexdigest()[:20]}",
+            'deleted_at': None
+        })
+
+    return messages
+
+# ----------------------------------------------------
+# 2. SERVICIOS SIMULADOS
+# ----------------------------------------------------
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+class FakeQuery:
+    """
+    Imitación mínima del query builder de PostgREST (select/filtros/order/limit).
+    """
+
+    def __init__(self, table: "FakeTable"):
+        self._table = table
+        self._filters = []
+        self._negate_next = False
+        self._orders = []
+        self._limit = None
+        self._range = None
+        self._columns = None
+        self._upsert_rows = None
+        self._on_conflict = None
+        self._update_values = None
+
+    # Selección y modificadores
+    def select(self, columns: str = "*", **kwargs):
+        if columns and columns.strip() != "*":
+            # "alias:columna" renombra la columna en la respuesta, como en PostgREST
+            self._columns = [tuple(c.strip().split(":", 1)) if ":" in c else (c.strip(), c.strip())
+                             for c in columns.split(",")]
+        return self
+
+    @property
+    def not_(self):
+        self._negate_next = True
+        return self
+
+    def _add(self, predicate):
+        if self._negate_next:
+            self._negate_next = False
+            self._filters.append(lambda row, p=predicate: not p(row))
+        else:
+            self._filters.append(predicate)
+        return self
+
+    def eq(self, column, value):
+        return self._add(lambda row: row.get(column) == value)
+
+    def neq(self, column, value):
+        return self._add(lambda row: row.get(column) != value)
+
+    def gt(self, column, value):
+        return self._add(lambda row: row.get(column) is not None and row.get(column) > value)
+
+    def gte(self, column, value):
+        return self._add(lambda row: row.get(column) is not None and row.get(column) >= value)
+
+    def lt(self, column, value):
+        return self._add(lambda row: row.get(column) is not None and row.get(column) < value)
+
+    def lte(self, column, value):
+        return self._add(lambda row: row.get(column) is not None and row.get(column) <= value)
+
+    def in_(self, column, values):
+        values = set(values)
+        return self._add(lambda row: row.get(column) in values)
+
+    def is_(self, column, value):
+        if value in ('null', None):
+            return self._add(lambda row: row.get(column) is None)
+        return self._add(lambda row: row.get(column) == value)
+
+    def order(self, column, desc=False, **kwargs):
+        self._orders.append((column, desc))
+        return self
+
+    def limit(self, count, **kwargs):
+        self._limit = count
+        return self
+
+    def range(self, start, end, **kwargs):
+        self._range = (start, end)
+        return self
+
+    def upsert(self, rows, on_conflict=None, **kwargs):
+        self._upsert_rows = rows if isinstance(rows, list) else [rows]
+        self._on_conflict = on_conflict
+        return self
+
+    def insert(self, rows, **kwargs):
+        return self.upsert(rows)
+
+    def update(self, values, **kwargs):
+        self._update_values = values
+        return self
+
+    def execute(self):
+        self._table.client._sleep()
+
+        if self._upsert_rows is not None:
+            if self._on_conflict:
+                keys = {row.get(self._on_conflict) for row in self._upsert_rows}
+                self._table.rows[:] = [row for row in self._table.rows if row.get(self._on_conflict) not in keys]
+            self._table.rows.extend(self._upsert_rows)
+            return _Response(self._upsert_rows)
+
+        rows = [row for row in self._table.rows if all(f(row) for f in self._filters)]
+
+        if self._update_values is not None:
+            for row in rows:
+                row.update(self._update_values)
+            return _Response(rows)
+
+        # Orden estable: se aplica desde la última clave hacia la primera
+        for column, desc in reversed(self._orders):
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        if self._range:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        if self._columns:
+            rows = [{alias: row.get(column) for alias, column in self._columns} for row in rows]
+        else:
+            rows = [dict(row) for row in rows]
+
+        return _Response(rows)
+
+class FakeTable:
+    def __init__(self, client, rows):
+        self.client = client
+        self.rows = rows
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def upload(self, path, file, file_options=None):
+        self.client._sleep(len(file) / self.client.upload_bytes_per_second)
+        self.client.objects[f"{self.name}/{path}"] = file
+        return {"Key": f"{self.name}/{path}"}
+
+    def download(self, path):
+        self.client._sleep()
+        key = f"{self.name}/{path}"
+        if key not in self.client.objects:
+            raise Exception(f"Object not found: {path}")
+        return self.client.objects[key]
+
+    def list(self, path=None, options=None):
+        self.client._sleep()
+        prefix = f"{self.name}/{path}/" if path else f"{self.name}/"
+        return [{"name": key[len(prefix):]} for key in self.client.objects
+                if key.startswith(prefix) and "/" not in key[len(prefix):]]
+
+    def get_public_url(self, path, options=None):
+        return f"{self.client.url}/storage/v1/object/public/{self.name}/{path}"
+
+class FakeStorage:
+    def __init__(self, client):
+        self.client = client
+
+    def from_(self, bucket_name):
+        return FakeBucket(self.client, bucket_name)
+
+class FakeSupabase:
+    """
+    Cliente Supabase en memoria con latencia configurable por round-trip.
+
+    Args:
+        tables: Dict {nombre_tabla: lista de filas}
+        latency_ms: Latencia fija por request
+        rpc_handlers: Dict {nombre_funcion: callable(params) -> list}
+    """
+
+    def __init__(self, tables: dict = None, latency_ms: float = 0, rpc_handlers: dict = None,
+                 upload_bytes_per_second: float = 20e6):
+        self.url = "http://localhost:54321"
+        self.latency_ms = latency_ms
+        self.upload_bytes_per_second = upload_bytes_per_second
+        self.tables = {name: FakeTable(self, rows) for name, rows in (tables or {}).items()}
+        self.rpc_handlers = rpc_handlers or {}
+        self.objects = {}
+        self.storage = FakeStorage(self)
+        self.requests = 0
+
+    def _sleep(self, extra_seconds: float = 0):
+        self.requests += 1
+        delay = self.latency_ms / 1000 + extra_seconds
+        if delay > 0:
+            time.sleep(delay)
+
+    def from_(self, table_name):
+        if table_name not in self.tables:
+            self.tables[table_name] = FakeTable(self, [])
+        return FakeQuery(self.tables[table_name])
+
+    table = from_
+
+    def rpc(self, name, params=None):
+        client = self
+        handler = self.rpc_handlers.get(name)
+
+        class _RPC:
+            def execute(self_inner):
+                client._sleep()
+                if handler is None:
+                    raise Exception(f"function {name} does not exist")
+                return _Response(handler(params or {}))
+
+        return _RPC()
+
+def fake_group_stats(rows: list):
+    """
+    Equivalente en memoria de la función SQL get_group_stats (setup_group_stats.sql).
+    """
+    def handler(params):
+        start, end = params['window_start'], params.get('window_end')
+        stats = {}
+        for row in rows:
+            if row.get('deleted_at') or row.get('embedding') is None or row['fecha_hora'] < start:
+                continue
+            if end and row['fecha_hora'] > end:
+                continue
+            group = stats.setdefault(row['grupo_id'], {
+                'grupo_id': row['grupo_id'], 'mensajes': 0, 'primer_mensaje': row['fecha_hora'],
+                'ultimo_mensaje': row['fecha_hora'], 'remitentes': set(), 'adjuntos': 0, 'imagenes': 0
+            })
+            group['mensajes'] += 1
+            group['primer_mensaje'] = min(group['primer_mensaje'], row['fecha_hora'])
+            group['ultimo_mensaje'] = max(group['ultimo_mensaje'], row['fecha_hora'])
+            group['remitentes'].add(row.get('remitente'))
+            group['adjuntos'] += 1 if row.get('url_storage') else 0
+            group['imagenes'] += 1 if row.get('es_imagen') else 0
+        return [{**group, 'remitentes': len(group['remitentes'])} for _, group in sorted(stats.items())]
+
+    return handler
+
+def fake_update_embeddings(rows: list):
+    """
+    Equivalente en memoria de la función SQL update_embeddings (setup_embedding_backfill.sql).
+    """
+    by_id = {row['id']: row for row in rows}
+
+    def handler(params):
+        updated = 0
+        for item in params['updates']:
+            row = by_id.get(item['id'])
+            if row is not None and row.get('embedding') is None:
+                row['embedding'] = item['embedding']
+                # Trigger trg_embedding_q de setup_quantized_embeddings.sql
+                row['embedding_q'] = embedding_codec.encode(embedding_codec.decode(item['embedding']))
+                updated += 1
+        return updated
+
+    return handler
+
+def fake_postgrest_transport(fake: FakeSupabase):
+    """
+    Transporte httpx que atiende las consultas REST de async_fetch.py con las tablas
+    de FakeSupabase (misma latencia por request, sin bloquear el event loop).
+    """
+    import asyncio
+    import httpx
+
+    async def handler(request):
+        query = fake.from_(request.url.path.rsplit("/", 1)[-1])
+        offset, limit = 0, None
+        for key, value in request.url.params.multi_items():
+            if key == "select":
+                query.select(value)
+            elif key == "order":
+                for part in value.split(","):
+                    column, _, direction = part.partition(".")
+                    query.order(column, desc=direction == "desc")
+            elif key == "offset":
+                offset = int(value)
+            elif key == "limit":
+                limit = int(value)
+            else:
+                if value.startswith("not."):
+                    query = query.not_
+                    value = value[4:]
+                op, _, operand = value.partition(".")
+                getattr(query, "is_" if op == "is" else op)(key, operand)
+        if limit is not None:
+            query.range(offset, offset + limit - 1)
+        response = await asyncio.to_thread(query.execute)
+        return httpx.Response(200, json=response.data)
+
+    return httpx.MockTransport(handler)
+
+class _Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class FakeEmbeddings:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, input, model="text-embedding-3-small", **kwargs):
+        inputs = input if isinstance(input, list) else [input]
+        self.owner._sleep()
+        data = []
+        for index, text in enumerate(inputs):
+            rng = random.Random(hashlib.sha256(str(text).encode()).hexdigest())
+            vector = [rng.gauss(0, 1) for _ in range(self.owner.embedding_dim)]
+            norm = sum(v * v for v in vector) ** 0.5 or 1.0
+            data.append(_Obj(embedding=[v / norm for v in vector], index=index))
+        return _Obj(data=data, usage=_Obj(prompt_tokens=sum(len(str(t)) // 4 for t in inputs)))
+
+class FakeOpenAI:
+    """
+    Cliente OpenAI simulado: embeddings determinísticos por hash del texto.
+    """
+
+    def __init__(self, latency_ms: float = 0, embedding_dim: int = EMBEDDING_DIM):
+        self.latency_ms = latency_ms
+        self.embedding_dim = embedding_dim
+        self.embeddings = FakeEmbeddings(self)
+        self.calls = 0
+
+    def _sleep(self):
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+def _fake_extraction(prompt: str) -> dict:
+    """
+    Genera un JSON de extracción plausible según la pasada detectada en el prompt.
+    """
+    tags = sorted(set(re.findall(r"`([^`]+)`", prompt)))[:10] or ["EQ-000"]
+    if "QUIEBRES DE PLAN" in prompt:
+        return {
+            "quiebres_plan": [{"qp_numero": f"QP-{i}", "fecha": "No reportado", "area": AREAS[i % len(AREAS)],
+                               "equipo": tag, "razon": "Falta de permiso SPCI", "demora_horas": 2.5,
+                               "impacto": "Desplaza plan", "evidencia": None} for i, tag in enumerate(tags[:3])],
+            "demoras": [{"actividad": f"Cambio de filtros {tag}", "fecha": None, "demora_horas": 1.5,
+                         "causa": "Espera de materiales", "responsable": "No reportado", "impacto": None}
+                        for tag in tags[:5]],
+            "emergentes": []
+        }
+    if "actividades de mantenimiento" in prompt:
+        return {"actividades": [{"id": i, "tipo": "Correctivo", "descripcion": f"Mantención {tag}",
+                                 "equipo": {"tag": tag, "nombre": None, "sistema": None},
+                                 "ubicacion": {"planta": "Concentradora", "area": AREAS[i % len(AREAS)], "nivel": None},
+                                 "ejecutor": {"empresa": "AMECO", "personal": 4, "supervisor": None},
+                                 "tiempos": {"inicio_programado": None, "inicio_real": None,
+                                             "termino_programado": None, "termino_real": None, "demora_horas": None},
+                                 "estado": "Completado", "observaciones": None} for i, tag in enumerate(tags)]}
+    if "seguridad" in prompt.lower() and "incidentes" in prompt:
+        return {"incidentes": [{"fecha": None, "hora": None, "tipo": "Casi accidente", "descripcion": "Caída de objeto",
+                                "afectado": None, "empresa": "FTF", "lesion": None, "derivacion": None,
+                                "causa_inmediata": None, "causa_raiz": None, "dias_perdidos": 0}],
+                "hallazgos": [{"fecha": None, "tipo": "Condición insegura", "descripcion": f"Baranda suelta {tags[0]}",
+                               "ubicacion": "SPS-502", "severidad": "Media", "riesgo": "Caída", "detectado_por": None,
+                               "accion_inmediata": "Segregación", "estado": "Abierto"}],
+                "permisos": [], "compromisos": []}
+    return {"produccion": [{"equipo": tag, "parametro": "Caudal", "valor": 68, "unidad": "m³/h", "target": None,
+                            "desviacion": None, "desviacion_porcentaje": None, "fecha": None, "turno": "Día"}
+                           for tag in tags[:4]],
+            "parametros_proceso": [], "disponibilidad": [], "consumos": []}
+
+class FakeMessages:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model, max_tokens, messages, temperature=None, **kwargs):
+        prompt = "".join(m["content"] if isinstance(m["content"], str) else json.dumps(m["content"])
+                         for m in messages)
+        if "Responde SOLO con el JSON" in prompt:
+            text = json.dumps(_fake_extraction(prompt), ensure_ascii=False)
+        elif "Comienza directamente con el encabezado" in prompt:
+            heading = prompt.rsplit("Comienza directamente con el encabezado `", 1)[1].split("`", 1)[0]
+            text = (f"{heading}\n\nContenido sintético de la sección.\n\n"
+                    f"| Equipo/TAG | Parámetro | Valor |\n|---|---|---|\n| `P-101` | Caudal | 68 |")
+            text += "".join(f"\n\n{marker}" for marker in dict.fromkeys(re.findall(r"\[\[TABLA_\w+\]\]", prompt)))
+        else:
+            sections = "\n\n".join(f"## {n}. SECCIÓN {n}\n\nContenido sintético de la sección {n}.\n\n"
+                                   f"| Equipo/TAG | Parámetro | Valor |\n|---|---|---|\n| `P-101` | Caudal | 68 |"
+                                   for n in range(1, 9))
+            text = f"# Reporte Ejecutivo Técnico - Minera Centinela\n\n{sections}"
+            text += "".join(f"\n\n{marker}" for marker in dict.fromkeys(re.findall(r"\[\[TABLA_\w+\]\]", prompt)))
+
+        input_tokens = len(prompt) // 4
+        output_tokens = min(max_tokens, len(text) // 4)
+        self.owner._sleep(output_tokens)
+        self.owner.calls += 1
+        self.owner.input_tokens += input_tokens
+        self.owner.output_tokens += output_tokens
+
+        return _Obj(
+            content=[_Obj(type="text", text=text)],
+            model=model,
+            stop_reason="end_turn",
+            usage=_Obj(input_tokens=input_tokens, output_tokens=output_tokens)
+        )
+
+class FakeClaude:
+    """
+    Cliente Anthropic simulado con latencia base + latencia por token de salida.
+    """
+
+    def __init__(self, latency_ms: float = 0, ms_per_output_token: float = 0):
+        self.latency_ms = latency_ms
+        self.ms_per_output_token = ms_per_output_token
+        self.messages = FakeMessages(self)
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def _sleep(self, output_tokens: int):
+        delay = (self.latency_ms + self.ms_per_output_token * output_tokens) / 1000
+        if delay > 0:
+            time.sleep(delay)
+
+# ----------------------------------------------------
+# 3. EJECUCIÓN DEL BENCHMARK
+# ----------------------------------------------------
+
+class StageTimer:
+    """Acumula tiempos por etapa (segundos)."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name: str, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.stages[name] = round(time.perf_counter() - start, 4)
+        print(f"   ⏱️ {name}: {self.stages[name]:.3f}s")
+        return result
+
+def install_fakes(messages: list, supabase_latency_ms: float = 0, openai_latency_ms: float = 0,
+                  claude_latency_ms: float = 0, claude_ms_per_token: float = 0) -> dict:
+    """
+    Reemplaza los clientes reales de app.py, advanced_analysis.py y async_fetch.py
+    por los simulados.
+
+    Returns:
+        Dict con los clientes simulados instalados
+    """
+    import app
+    import advanced_analysis
+    import async_fetch
+
+    fakes = {
+        'supabase': FakeSupabase({'mensajes_analisis': messages}, latency_ms=supabase_latency_ms,
+                                 rpc_handlers={'get_group_stats': fake_group_stats(messages),
+                                               'update_embeddings': fake_update_embeddings(messages)}),
+        'openai': FakeOpenAI(latency_ms=openai_latency_ms),
+        'claude': FakeClaude(latency_ms=claude_latency_ms, ms_per_output_token=claude_ms_per_token)
+    }
+
+    app.supabase = fakes['supabase']
+    app.openai_client = fakes['openai']
+    app.claude_client = fakes['claude']
+    advanced_analysis.claude_client = fakes['claude']
+    async_fetch.TRANSPORT = fake_postgrest_transport(fakes['supabase'])
+
+    return fakes
+
+def measure_quantization(corpus: list, k: int = 10, queries: int = 50, seed: int = 42) -> dict:
+    """
+    Compara los embeddings cuantizados (embedding_codec.py) con los de precisión completa:
+    bytes por vector en la respuesta y recall@k de la búsqueda por similitud.
+
+    Args:
+        corpus: Filas con embedding en texto "[0.1,...]"
+        k: Vecinos a comparar
+        queries: Consultas (vectores del corpus con ruido)
+
+    Returns:
+        Dict {formato: {bytes_por_vector, recall_at_k}} más los parámetros de la medición
+    """
+    import numpy as np
+
+    unique = sorted({row['embedding'] for row in corpus if isinstance(row.get('embedding'), str)})
+    if len(unique) <= k:
+        return {}
+    full = np.stack([embedding_codec.decode(text) for text in unique])
+
+    rng = np.random.default_rng(seed)
+    query_vectors = full[rng.choice(len(full), size=min(queries, len(full)), replace=False)]
+    query_vectors = query_vectors + rng.normal(0, 0.5 / np.sqrt(full.shape[1]), query_vectors.shape)
+    expected = np.argsort(-(query_vectors @ full.T), axis=1)[:, :k]
+
+    results = {"json": {"bytes_por_vector": round(sum(len(text) for text in unique) / len(unique)),
+                        "recall_at_k": 1.0}}
+    for kind in ("int8", "float16"):
+        encoded = [embedding_codec.encode(vector, kind) for vector in full]
+        decoded = np.stack([embedding_codec.decode(text) for text in encoded])
+        found = np.argsort(-(query_vectors @ decoded.T), axis=1)[:, :k]
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(expected, found)])
+        results[kind] = {
+            "bytes_por_vector": round(sum(len(text) for text in encoded) / len(encoded)),
+            "recall_at_k": round(float(recall), 4)
+        }
+    return {"k": k, "consultas": len(query_vectors), "vectores": len(unique), **results}
+
+def run_benchmark(count: int = 1000, hours: int = 24, max_messages: int = 500, seed: int = 42,
+                  supabase_latency_ms: float = 0, openai_latency_ms: float = 0,
+                  claude_latency_ms: float = 0, claude_ms_per_token: float = 0,
+                  embedding_dim: int = EMBEDDING_DIM, bundle_path: str = None,
+                  missing_embeddings: float = 0) -> dict:
+    """
+    Ejecuta el pipeline completo contra servicios simulados midiendo cada etapa.
+
+    Con bundle_path se usa un bundle grabado (replay.py) como fixture: los mensajes
+    y las respuestas de Claude son los de la ejecución real grabada.
+
+    Con missing_embeddings (fracción 0-1) esa parte del corpus queda sin embedding
+    y se mide el completado previo a la consulta (embedding_backfill.py).
+
+    Returns:
+        Dict con configuración, tiempos por etapa y contadores
+    """
+    import app
+    import advanced_analysis as aa
+    import replay
+    from trend_engine import build_trends
+    from report_tables import REPORT_TABLES, render_table
+    from budget import estimate_tokens
+    from context_packing import pack_messages
+
+    print("\n" + "="*70)
+    print("🏁 BENCHMARK OFFLINE DEL PIPELINE DE REPORTES")
+    print("="*70)
+
+    timer = StageTimer()
+    if bundle_path:
+        replay.start(replay_path=bundle_path)
+        corpus = replay.replay_messages()
+        count = len(corpus)
+    else:
+        corpus = timer.run("generate_corpus", generate_synthetic_messages,
+                           count=count, hours=hours, seed=seed, embedding_dim=embedding_dim)
+
+    if embedding_codec.EMBEDDING_TRANSFER == "quantized" and not bundle_path:
+        # Columna embedding_q que mantiene el trigger de setup_quantized_embeddings.sql
+        quantized = {}
+        for row in corpus:
+            if row.get('embedding') is not None:
+                if row['embedding'] not in quantized:
+                    quantized[row['embedding']] = embedding_codec.encode(embedding_codec.decode(row['embedding']))
+                row['embedding_q'] = quantized[row['embedding']]
+
+    fakes = install_fakes(corpus, supabase_latency_ms, openai_latency_ms,
+                          claude_latency_ms, claude_ms_per_token)
+    app.MAX_MESSAGES_IN_REPORT = max_messages
+    periodo_texto = f"Últimas {hours} horas"
+
+    backfill = None
+    if missing_embeddings and not bundle_path:
+        import embedding_backfill
+        for row in random.Random(seed).sample(corpus, int(len(corpus) * missing_embeddings)):
+            row['embedding'] = None
+        backfill = timer.run("embedding_backfill", embedding_backfill.backfill_embeddings,
+                             fakes['supabase'], fakes['openai'],
+                             (datetime.now() - timedelta(hours=hours)).isoformat())
+
+    messages = timer.run("fetch", app.get_messages_by_date_range, hours=hours)
+
+    quantization = measure_quantization(corpus, seed=seed)
+    if quantization:
+        print(f"   🧬 Embeddings int8: {quantization['int8']['bytes_por_vector']:,} vs "
+              f"{quantization['json']['bytes_por_vector']:,} bytes por vector, "
+              f"recall@{quantization['k']} {quantization['int8']['recall_at_k']:.1%} "
+              f"(float16: {quantization['float16']['recall_at_k']:.1%})")
+
+    def _aggregate():
+        groups = app.aggregate_messages_by_topic(messages, app.get_group_stats(hours=hours))
+        return groups, app.aggregate_by_superintendencia(groups)
+
+    groups_data, _ = timer.run("aggregate", _aggregate)
+    conversaciones = timer.run("format", aa.format_messages_for_context, messages, max_chars=50000)
+
+    # Ahorro del formato compacto sobre la ventana completa (sin límite de contexto)
+    encoded = {enc: pack_messages(messages, 10**9, encoding=enc) for enc in ("verbose", "compact")}
+    encoding_chars = {enc: len(text) for enc, text in encoded.items()}
+    encoding_tokens = {enc: estimate_tokens(text) for enc, text in encoded.items()}
+    print(f"   🗜️ Contexto compacto: {encoding_tokens['compact']:,} vs {encoding_tokens['verbose']:,} tokens "
+          f"({1 - encoding_tokens['compact'] / max(1, encoding_tokens['verbose']):.1%} menos)")
+
+    pasadas = [
+        ("pass.demoras", aa.PROMPT_ANALISIS_DEMORAS_QP),
+        ("pass.actividades", aa.PROMPT_ANALISIS_ACTIVIDADES),
+        ("pass.seguridad", aa.PROMPT_ANALISIS_SEGURIDAD),
+        ("pass.produccion", aa.PROMPT_ANALISIS_PRODUCCION_KPI),
+    ]
+    resultados = {}
+    for name, template in pasadas:
+        resultados[name] = timer.run(name, aa.call_claude_analysis,
+                                     template.format(conversaciones=conversaciones), stage=name)
+
+    # Datos de cada pasada en los prompts de síntesis: JSON indentado vs serialización compacta
+    data_tokens = {
+        name: {enc: estimate_tokens(aa.format_json_for_prompt(result, name, encoding=enc)) for enc in ("json", "compact")}
+        for name, result in resultados.items()
+    }
+    for name, tokens in data_tokens.items():
+        print(f"   🗜️ {name}: {tokens['compact']:,} vs {tokens['json']:,} tokens "
+              f"({1 - tokens['compact'] / max(1, tokens['json']):.1%} menos)")
+
+    tendencias = timer.run("trends", replay.memo, "tendencias",
+                           lambda: build_trends(None, periodo_texto, resultados, replay.now(), messages=messages))
+
+    # Prompt de síntesis en una sola llamada (SYNTHESIS_MODE=single), como referencia de tamaño
+    prompt_sintesis = aa.PROMPT_SINTESIS_FINAL.format(
+        periodo=periodo_texto,
+        periodo_texto=periodo_texto,
+        fecha_generacion=replay.now().strftime("%d/%m/%Y %H:%M:%S"),
+        analisis_demoras=aa.format_json_for_prompt(resultados["pass.demoras"], "Demoras y QP"),
+        analisis_actividades=aa.format_json_for_prompt(resultados["pass.actividades"], "Actividades"),
+        analisis_seguridad=aa.format_json_for_prompt(resultados["pass.seguridad"], "Seguridad"),
+        analisis_produccion=aa.format_json_for_prompt(resultados["pass.produccion"], "Producción"),
+        tendencias=f"## Tendencias Precalculadas\n{tendencias}"
+    )
+    report = timer.run("synthesis", aa.synthesize_report, resultados, periodo_texto, tendencias,
+                       total_mensajes=len(messages))
+    # Tablas generadas en local desde la extracción (el modelo ya no las transcribe)
+    tables = "\n\n".join(render_table(marker, resultados) for marker in REPORT_TABLES)
+    print(f"   📋 Tablas locales: {len(tables):,} caracteres (~{estimate_tokens(tables):,} tokens de salida evitados)")
+
+    from markdown_to_html_converter import convert_report_to_html
+    html_content = timer.run("html", convert_report_to_html, report, periodo_texto)
+
+    pdf_bytes = None
+    try:
+        from weasyprint import HTML
+        pdf_bytes = timer.run("pdf", lambda: HTML(string=html_content).write_pdf())
+    except Exception as e:
+        print(f"   ⚠️ PDF omitido: {e.__class__.__name__}")
+
+    manifest = {'artifacts': [
+        {'tipo': 'md', 'filename': 'bench.md', 'content': report.encode('utf-8'),
+         'content_type': "text/markdown; charset=utf-8"},
+        {'tipo': 'html', 'filename': 'bench.html', 'content': html_content.encode('utf-8'),
+         'content_type': "text/html; charset=utf-8"},
+    ]}
+    if pdf_bytes:
+        manifest['artifacts'].append({'tipo': 'pdf', 'filename': 'bench.pdf', 'content': pdf_bytes,
+                                      'content_type': "application/pdf"})
+    timer.run("upload", app.upload_artifacts, manifest)
+    replay.stop()
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'messages': count, 'hours': hours, 'max_messages': max_messages, 'seed': seed,
+            'embedding_dim': embedding_dim, 'supabase_latency_ms': supabase_latency_ms,
+            'openai_latency_ms': openai_latency_ms, 'claude_latency_ms': claude_latency_ms,
+            'claude_ms_per_token': claude_ms_per_token, 'bundle': bundle_path,
+            'synthesis_mode': aa.SYNTHESIS_MODE, 'missing_embeddings': missing_embeddings,
+            'embedding_transfer': embedding_codec.EMBEDDING_TRANSFER
+        },
+        'stages': timer.stages,
+        'total_seconds': round(sum(v for k, v in timer.stages.items() if k != "generate_corpus"), 4),
+        'counts': {
+            'fetched_messages': len(messages),
+            'embeddings_backfilled': backfill['actualizados'] if backfill else 0,
+            'groups': len(groups_data),
+            'context_chars': len(conversaciones),
+            'context_chars_verbose': encoding_chars['verbose'],
+            'context_chars_compact': encoding_chars['compact'],
+            'context_tokens_verbose': encoding_tokens['verbose'],
+            'context_tokens_compact': encoding_tokens['compact'],
+            'synthesis_prompt_chars': len(prompt_sintesis),
+            'report_chars': len(report or ""),
+            'table_chars': len(tables),
+            'synthesis_data_tokens': data_tokens,
+            'embedding_quantization': quantization,
+            'html_bytes': len(html_content.encode('utf-8')),
+            'pdf_bytes': len(pdf_bytes) if pdf_bytes else None,
+            'supabase_requests': fakes['supabase'].requests,
+            'claude_calls': fakes['claude'].calls,
+            'claude_input_tokens': fakes['claude'].input_tokens,
+            'claude_output_tokens': fakes['claude'].output_tokens
+        }
+    }
+
+    print("="*70 + "\n")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del pipeline de reportes")
+    parser.add_argument("--messages", type=int, default=1000, help="Mensajes sintéticos a generar")
+    parser.add_argument("--hours", type=int, default=24, help="Ventana del reporte en horas")
+    parser.add_argument("--max-messages", type=int, default=500, help="Equivalente a MAX_MESSAGES_IN_REPORT")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--embedding-dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--supabase-latency", type=float, default=0, help="ms por request a Supabase")
+    parser.add_argument("--openai-latency", type=float, default=0, help="ms por request de embeddings")
+    parser.add_argument("--claude-latency", type=float, default=0, help="ms base por llamada a Claude")
+    parser.add_argument("--claude-ms-per-token", type=float, default=0, help="ms por token de salida")
+    parser.add_argument("--bundle", help="Bundle grabado (REPORT_RECORD_PATH) a usar como fixture")
+    parser.add_argument("--missing-embeddings", type=float, default=0,
+                        help="Fracción del corpus sin embedding (se completa antes de la consulta)")
+    parser.add_argument("--output", default="bench_results.json", help="Archivo JSON de resultados")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        count=args.messages,
+        hours=args.hours,
+        max_messages=args.max_messages,
+        seed=args.seed,
+        supabase_latency_ms=args.supabase_latency,
+        openai_latency_ms=args.openai_latency,
+        claude_latency_ms=args.claude_latency,
+        claude_ms_per_token=args.claude_ms_per_token,
+        embedding_dim=args.embedding_dim,
+        bundle_path=args.bundle,
+        missing_embeddings=args.missing_embeddings
+    )
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+    print(f"✅ Resultados guardados en {args.output}")
+    print(json.dumps(results['stages'], indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Presupuesto de Tokens y Costo por Ejecución
+Minera Centinela - GSdSO
+Controla el gasto en Claude antes de cada llamada y degrada en orden definido
+"""
+
+import math
+import os
+import threading
+
+# Límites por ejecución (0 = sin límite)
+REPORT_MAX_INPUT_TOKENS = int(os.environ.get("REPORT_MAX_INPUT_TOKENS", "0"))
+REPORT_MAX_OUTPUT_TOKENS = int(os.environ.get("REPORT_MAX_OUTPUT_TOKENS", "0"))
+REPORT_MAX_COST_USD = float(os.environ.get("REPORT_MAX_COST_USD", "0"))
+
+# Modelo económico al que se cambia cuando el presupuesto no alcanza
+BUDGET_FALLBACK_MODEL = os.environ.get("BUDGET_FALLBACK_MODEL", "claude-haiku-4-5-20251001")
+
+# Pisos de degradación
+MIN_CONTEXT_CHARS = int(os.environ.get("BUDGET_MIN_CONTEXT_CHARS", "12000"))
+MIN_OUTPUT_TOKENS = 1000
+
+# Estimación de tokens para español (conservadora)
+CHARS_PER_TOKEN = 3.5
+
+# Precios USD por millón de tokens (entrada, salida)
+MODEL_PRICING_USD_PER_MTOK = {
+    "claude-sonnet-4-20250514": (3.00, 15.00),
+    "claude-haiku-4-5-20251001": (1.00, 5.00),
+    "claude-3-5-haiku-20241022": (0.80, 4.00),
+}
+DEFAULT_PRICING = (3.00, 15.00)
+
+# Prioridades de llamadas: las de prioridad >= PRIORITY_LOW se pueden omitir
+PRIORITY_REQUIRED = 0
+PRIORITY_HIGH = 1
+PRIORITY_LOW = 2
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida de tokens a partir de caracteres."""
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """Costo en USD de una llamada."""
+    price_in, price_out = MODEL_PRICING_USD_PER_MTOK.get(model, DEFAULT_PRICING)
+    return (input_tokens * price_in + output_tokens * price_out) / 1_000_000
+
+class BudgetDecision:
+    """
+    Resultado de planificar una llamada contra el presupuesto.
+    """
+
+    def __init__(self, model: str, max_tokens: int, skip: bool = False, degradation: str = None):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.skip = skip
+        self.degradation = degradation
+        self.reservation = None  # (tokens entrada, tokens salida, USD) apartados hasta record()
+
+class RunBudget:
+    """
+    Presupuesto de una ejecución del reporte.
+
+    Orden de degradación cuando el presupuesto es ajustado:
+        1. Reducir contexto (fit_context_chars) y max_tokens de la llamada
+        2. Omitir pasadas de baja prioridad
+        3. Cambiar al modelo económico (BUDGET_FALLBACK_MODEL)
+    Las llamadas obligatorias (síntesis) se ejecutan siempre, con el modelo
+    económico y el mínimo de tokens si ya no queda presupuesto.
+
+    Cada llamada planificada aparta su entrada estimada y su max_tokens hasta que
+    record() registra el consumo real, para que las llamadas en paralelo (síntesis
+    por secciones, resúmenes jerárquicos) no vean todas el mismo saldo.
+    """
+
+    def __init__(self, max_input_tokens: int = 0, max_output_tokens: int = 0, max_cost_usd: float = 0):
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.max_cost_usd = max_cost_usd
+        self.used_input_tokens = 0
+        self.used_output_tokens = 0
+        self.cost_usd = 0.0
+        self.reserved_input_tokens = 0
+        self.reserved_output_tokens = 0
+        self.reserved_cost_usd = 0.0
+        self.calls = []
+        self.degradations = []
+        self._lock = threading.RLock()
+
+    @property
+    def limited(self) -> bool:
+        return bool(self.max_input_tokens or self.max_output_tokens or self.max_cost_usd)
+
+    @property
+    def committed_input_tokens(self) -> int:
+        """Entrada consumida más la apartada por llamadas en curso."""
+        return self.used_input_tokens + self.reserved_input_tokens
+
+    @property
+    def committed_output_tokens(self) -> int:
+        return self.used_output_tokens + self.reserved_output_tokens
+
+    @property
+    def committed_cost_usd(self) -> float:
+        return self.cost_usd + self.reserved_cost_usd
+
+    def _fits(self, input_tokens: int, output_tokens: int, model: str) -> bool:
+        if self.max_input_tokens and self.committed_input_tokens + input_tokens > self.max_input_tokens:
+            return False
+        if self.max_output_tokens and self.committed_output_tokens + output_tokens > self.max_output_tokens:
+            return False
+        if (self.max_cost_usd and
+                self.committed_cost_usd + estimate_cost(model, input_tokens, output_tokens) > self.max_cost_usd):
+            return False
+        return True
+
+    def _affordable_output(self, input_tokens: int, model: str) -> int:
+        """Máximo de tokens de salida que caben tras pagar la entrada."""
+        limits = []
+        if self.max_input_tokens and self.committed_input_tokens + input_tokens > self.max_input_tokens:
+            return 0
+        if self.max_output_tokens:
+            limits.append(self.max_output_tokens - self.committed_output_tokens)
+        if self.max_cost_usd:
+            price_in, price_out = MODEL_PRICING_USD_PER_MTOK.get(model, DEFAULT_PRICING)
+            remaining = self.max_cost_usd - self.committed_cost_usd - input_tokens * price_in / 1_000_000
+            limits.append(int(remaining * 1_000_000 / price_out))
+        return max(0, min(limits)) if limits else 10**9
+
+    def fit_context_chars(self, default_chars: int, calls: int, overhead_chars: int,
+                          output_tokens_per_call: int, reserve_tokens: int = 0,
+                          reserve_output_tokens: int = 0,
+                          model: str = "claude-sonnet-4-20250514") -> int:
+        """
+        Paso 1 de degradación: tamaño de contexto que permite hacer `calls` llamadas
+        con el mismo contexto dentro del presupuesto restante.
+
+        Args:
+            default_chars: Tamaño de contexto deseado
+            calls: Llamadas que recibirán el contexto completo
+            overhead_chars: Caracteres fijos del prompt (instrucciones)
+            output_tokens_per_call: max_tokens de cada llamada
+            reserve_tokens: Tokens de entrada reservados para llamadas posteriores (síntesis)
+            reserve_output_tokens: Tokens de salida reservados para llamadas posteriores
+            model: Modelo con el que se calcula el costo
+
+        Returns:
+            max_chars a usar en format_messages_for_context
+        """
+        if not self.limited or calls <= 0:
+            return default_chars
+
+        budgets = []
+        overhead_tokens = math.ceil(overhead_chars / CHARS_PER_TOKEN)
+        if self.max_input_tokens:
+            available = self.max_input_tokens - self.committed_input_tokens - reserve_tokens
+            budgets.append(available / calls - overhead_tokens)
+        if self.max_cost_usd:
+            price_in, price_out = MODEL_PRICING_USD_PER_MTOK.get(model, DEFAULT_PRICING)
+            available_usd = (self.max_cost_usd - self.committed_cost_usd
+                             - estimate_cost(model, reserve_tokens, reserve_output_tokens))
+            per_call_usd = available_usd / calls - output_tokens_per_call * price_out / 1_000_000
+            budgets.append(per_call_usd * 1_000_000 / price_in - overhead_tokens)
+
+        if not budgets:
+            return default_chars
+
+        chars = int(min(budgets) * CHARS_PER_TOKEN)
+        fitted = max(MIN_CONTEXT_CHARS, min(default_chars, chars))
+        if fitted < default_chars:
+            self._degrade("contexto", f"{default_chars:,} → {fitted:,} caracteres")
+        return fitted
+
+    def plan(self, stage: str, prompt: str, max_tokens: int, model: str,
+             priority: int = PRIORITY_REQUIRED) -> BudgetDecision:
+        """
+        Decide cómo ejecutar una llamada según el presupuesto restante y aparta
+        su consumo estimado (ver release/record).
+        """
+        if not self.limited:
+            return BudgetDecision(model, max_tokens)
+
+        input_tokens = estimate_tokens(prompt)
+        with self._lock:
+            decision = self._decide(stage, input_tokens, max_tokens, model, priority)
+            if not decision.skip:
+                decision.reservation = (input_tokens, decision.max_tokens,
+                                        estimate_cost(decision.model, input_tokens, decision.max_tokens))
+                self._apply_reservation(decision.reservation, 1)
+        return decision
+
+    def _decide(self, stage: str, input_tokens: int, max_tokens: int, model: str,
+                priority: int) -> BudgetDecision:
+        if self._fits(input_tokens, max_tokens, model):
+            return BudgetDecision(model, max_tokens)
+
+        # 1. Reducir max_tokens de la llamada
+        affordable = self._affordable_output(input_tokens, model)
+        if affordable >= MIN_OUTPUT_TOKENS:
+            affordable = min(max_tokens, affordable)
+            self._degrade(stage, f"max_tokens {max_tokens} → {affordable}")
+            return BudgetDecision(model, affordable, degradation="max_tokens")
+
+        # 2. Omitir pasadas de baja prioridad
+        if priority >= PRIORITY_LOW:
+            self._degrade(stage, "pasada omitida")
+            return BudgetDecision(model, 0, skip=True, degradation="skip")
+
+        # 3. Modelo económico
+        fallback = BUDGET_FALLBACK_MODEL
+        if fallback and fallback != model:
+            affordable = min(max_tokens, self._affordable_output(input_tokens, fallback))
+            if affordable >= MIN_OUTPUT_TOKENS:
+                self._degrade(stage, f"modelo {model} → {fallback}")
+                return BudgetDecision(fallback, affordable, degradation="model")
+
+        if priority == PRIORITY_REQUIRED:
+            self._degrade(stage, "presupuesto excedido (llamada obligatoria)")
+            return BudgetDecision(fallback or model, MIN_OUTPUT_TOKENS, degradation="over_budget")
+
+        self._degrade(stage, "pasada omitida")
+        return BudgetDecision(model, 0, skip=True, degradation="skip")
+
+    def _apply_reservation(self, reservation: tuple, sign: int):
+        input_tokens, output_tokens, cost = reservation
+        self.reserved_input_tokens += sign * input_tokens
+        self.reserved_output_tokens += sign * output_tokens
+        self.reserved_cost_usd += sign * cost
+
+    def release(self, decision: BudgetDecision):
+        """Libera lo apartado por plan() para una llamada que no llegó a completarse."""
+        with self._lock:
+            if decision is not None and decision.reservation:
+                self._apply_reservation(decision.reservation, -1)
+                decision.reservation = None
+
+    def record(self, stage: str, model: str, response, latency_ms: float = None,
+               decision: BudgetDecision = None) -> dict:
+        """
+        Registra el consumo real informado por la API y la latencia de la llamada,
+        liquidando lo apartado por plan() para esa llamada (decision).
+        """
+        usage = getattr(response, "usage", None)
+        input_tokens = getattr(usage, "input_tokens", 0) or 0
+        output_tokens = getattr(usage, "output_tokens", 0) or 0
+        cost = estimate_cost(model, input_tokens, output_tokens)
+
+        entry = {
+            "stage": stage,
+            "model": model,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cost_usd": round(cost, 6),
+            "latency_ms": latency_ms
+        }
+        with self._lock:
+            self.release(decision)
+            self.used_input_tokens += input_tokens
+            self.used_output_tokens += output_tokens
+            self.cost_usd += cost
+            self.calls.append(entry)
+        return entry
+
+    def _degrade(self, stage: str, detail: str):
+        with self._lock:
+            self.degradations.append({"stage": stage, "detail": detail})
+        print(f"   💸 Presupuesto ajustado [{stage}]: {detail}")
+
+    def summary(self) -> dict:
+        return {
+            "input_tokens": self.used_input_tokens,
+            "output_tokens": self.used_output_tokens,
+            "cost_usd": round(self.cost_usd, 4),
+            "limits": {
+                "input_tokens": self.max_input_tokens or None,
+                "output_tokens": self.max_output_tokens or None,
+                "cost_usd": self.max_cost_usd or None
+            },
+            "calls": list(self.calls),
+            "degradations": list(self.degradations)
+        }
+
+    def print_report(self):
+        """Imprime el consumo real de la ejecución."""
+        print("\n💰 CONSUMO DE LA EJECUCIÓN")
+        print("-"*70)
+        for call in self.calls:
+            print(f"   • {call['stage']:<22} {call['model']:<28} "
+                  f"in={call['input_tokens']:>7,} out={call['output_tokens']:>6,} ${call['cost_usd']:.4f} "
+                  f"{(call['latency_ms'] or 0) / 1000:.1f}s")
+        print(f"   Total: {self.used_input_tokens:,} tokens entrada, "
+              f"{self.used_output_tokens:,} tokens salida, ${self.cost_usd:.4f} USD")
+        if self.limited:
+            print(f"   Límites: entrada={self.max_input_tokens or '∞'}, salida={self.max_output_tokens or '∞'}, "
+                  f"costo={'$' + str(self.max_cost_usd) if self.max_cost_usd else '∞'}")
+        for item in self.degradations:
+            print(f"   ⚠️ Degradación [{item['stage']}]: {item['detail']}")
+        print("-"*70)
+
+_current_budget = RunBudget()
+
+def start_budget() -> RunBudget:
+    """Crea el presupuesto de una nueva ejecución con los límites configurados."""
+    global _current_budget
+    _current_budget = RunBudget(REPORT_MAX_INPUT_TOKENS, REPORT_MAX_OUTPUT_TOKENS, REPORT_MAX_COST_USD)
+    return _current_budget
+
+def get_budget() -> RunBudget:
+    return _current_budget
@@ -0,0 +1,349 @@
+"""
+Empaquetado de Contexto por Relevancia
+Minera Centinela - GSdSO
+Cuando los mensajes no caben en el contexto, selecciona los más relevantes
+(palabras clave, lecturas numéricas, adjuntos, rol del remitente, novedad semántica)
+en vez de conservar solo los más antiguos
+"""
+
+import os
+import re
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+
+from conversation_threads import CONTEXT_THREADING, assign_threads, split_units
+from embedding_codec import decode as decode_embedding
+
+# "ranked": selección por relevancia; "chronological": truncar por orden de llegada (comportamiento anterior)
+CONTEXT_PACKING = os.environ.get("CONTEXT_PACKING", "ranked").lower()
+# "compact": alias de remitentes, encabezados por día y HH:MM; "verbose": timestamp ISO y nombre por mensaje
+CONTEXT_ENCODING = os.environ.get("CONTEXT_ENCODING", "compact").lower()
+# Zona horaria de la faena: el formato compacto muestra horas y días locales
+SITE_TIMEZONE = os.environ.get("SITE_TIMEZONE", "America/Santiago")
+# Peso de la penalización por redundancia semántica (similitud coseno con lo ya seleccionado)
+NOVELTY_WEIGHT = float(os.environ.get("CONTEXT_NOVELTY_WEIGHT", "3.0"))
+# Hilos: tamaño máximo de una unidad de selección y peso de sus mensajes no principales
+THREAD_UNIT_MAX_CHARS = int(os.environ.get("THREAD_UNIT_MAX_CHARS", "600"))
+UNIT_REST_WEIGHT = 0.2
+
+# Señales de relevancia (peso por coincidencia)
+KEYWORD_WEIGHTS = {
+    r"\bqp\b|quiebre": 4.0,
+    r"incidente|accidente|lesi[oó]n|derrame|emergencia": 4.0,
+    r"hallazgo|condici[oó]n insegura|acto inseguro|riesgo": 3.0,
+    r"demora|retraso|espera|detenid|detenci[oó]n|falla|fuga": 3.0,
+    r"spci|permiso|loto|bloqueo": 2.0,
+    r"emergente|prioriza|compromiso|plazo": 2.0,
+    r"fuera de rango|cr[ií]tico|alarma": 2.5,
+}
+READING_PATTERN = re.compile(
+    r"\d+(?:[.,]\d+)?\s*(?:m³/h|m3/h|l/min|gpm|bar|psi|kpa|°c|hz|rpm|kw|kwh|mw|%|hh|horas|h\b|ton|tph|ppm|g/l)",
+    re.IGNORECASE
+)
+TAG_PATTERN = re.compile(r"\b[A-Z0-9]{1,6}(?:-[A-Z0-9]{1,6}){1,3}\b")
+SENIOR_ROLES = re.compile(r"supervisor|jefe|planificador|gerente|superintendente|administrador|coordinador", re.IGNORECASE)
+ACKNOWLEDGEMENTS = re.compile(r"^\s*(ok|oka|okey|recibido|conforme|gracias|ya|listo|vale|👍)[\s,.!]*", re.IGNORECASE)
+
+OMITTED_NOTE = "\n... (mensajes adicionales omitidos por límite de longitud)"
+
+# Tipos de adjunto: (marcador detallado, código corto del formato compacto)
+ATTACHMENT_KINDS = {
+    "video": ("[🎬 Video adjunto]", "VID"),
+    "image": ("[📷 Imagen adjunta]", "IMG"),
+    "pdf": ("[📄 PDF adjunto]", "PDF"),
+    "excel": ("[📊 Excel adjunto]", "XLS"),
+    "word": ("[📝 Word adjunto]", "DOC"),
+    "file": ("[📎 Archivo adjunto]", "ADJ"),
+}
+
+def attachment_marker(kind: str, encoding: str = None) -> str:
+    """
+    Marcador con que aparece un tipo de adjunto en el contexto ("[📷 Imagen adjunta]"
+    o "[IMG]"), para que las instrucciones de los prompts coincidan con CONTEXT_ENCODING.
+    """
+    detailed, code = ATTACHMENT_KINDS[kind]
+    return f"[{code}]" if (encoding or CONTEXT_ENCODING) == "compact" else detailed
+
+def _attachment_kind(msg: dict) -> str:
+    """Tipo de archivo adjunto del mensaje (None si no tiene)."""
+    url_storage = msg.get('url_storage', '')
+    if not url_storage:
+        return None
+    if '.mp4' in url_storage.lower() or '.mov' in url_storage.lower():
+        return "video"
+    if msg.get('es_imagen', False) or any(ext in url_storage.lower() for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']):
+        return "image"
+    if '.pdf' in url_storage.lower():
+        return "pdf"
+    if any(ext in url_storage.lower() for ext in ['.xlsx', '.xls']):
+        return "excel"
+    if any(ext in url_storage.lower() for ext in ['.docx', '.doc']):
+        return "word"
+    return "file"
+
+def format_message(msg: dict) -> str:
+    """
+    Formatea un mensaje para el contexto de la IA, incluyendo el tipo de archivo adjunto.
+    """
+    timestamp = msg.get('fecha_hora', 'N/A')
+    sender = msg.get('remitente', 'Desconocido')
+    content = msg.get('contenido_texto', '[Sin texto]')
+
+    # Formato con remitente
+    msg_text = f"\n[{timestamp}] {sender}"
+
+    # Identificar tipo de archivo adjunto
+    kind = _attachment_kind(msg)
+    if kind:
+        msg_text += f" {ATTACHMENT_KINDS[kind][0]}"
+
+    msg_text += f":\n{content}\n"
+    return msg_text
+
+# ----------------------------------------------------
+# FORMATO COMPACTO
+# ----------------------------------------------------
+
+def _site_zone():
+    try:
+        return ZoneInfo(SITE_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+def _site_zone_name() -> str:
+    zone = _site_zone()
+    return SITE_TIMEZONE if zone is not timezone.utc else "UTC"
+
+def _local_time(msg: dict) -> datetime:
+    """
+    fecha_hora del mensaje en la hora local de la faena (None si no se puede interpretar).
+    Los timestamps sin zona se interpretan como UTC, igual que en message_mirror.
+    """
+    value = msg.get('fecha_hora')
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(_site_zone())
+
+def _local_day(msg: dict) -> str:
+    local = _local_time(msg)
+    return local.strftime("%Y-%m-%d") if local else "sin fecha"
+
+def _compact_line(msg: dict, alias: str) -> str:
+    """
+    Línea del formato compacto: "HH:MM R3 [PDF]: texto", en hora local de la faena.
+    alias="·" indica que el remitente es el mismo de la línea anterior.
+    """
+    local = _local_time(msg)
+    time_text = local.strftime("%H:%M") if local else "--:--"
+    content = msg.get('contenido_texto') or '[Sin texto]'
+    kind = _attachment_kind(msg)
+    code = f" [{ATTACHMENT_KINDS[kind][1]}]" if kind else ""
+    return f"{time_text} {alias}{code}: {content.replace(chr(10), chr(10) + '  ')}\n"
+
+def _sender_aliases(messages: list) -> dict:
+    aliases = {}
+    for msg in messages:
+        sender = msg.get('remitente') or 'Desconocido'
+        if sender not in aliases:
+            aliases[sender] = f"R{len(aliases) + 1}"
+    return aliases
+
+def _compact_header(aliases: dict) -> str:
+    senders = " | ".join(f"{alias}={sender}" for sender, alias in aliases.items())
+    return (
+        f"REMITENTES (usa el nombre completo al citar quién reportó): {senders}\n"
+        f"ADJUNTOS: IMG=imagen, VID=video, PDF, XLS=Excel, DOC=Word, ADJ=otro archivo\n"
+        f"FORMATO: HH:MM remitente [adjunto]: texto · \"·\" = mismo remitente que la línea anterior\n"
+        f"HORAS: días y horas en hora local ({_site_zone_name()})\n"
+    )
+
+def render_compact(messages: list) -> str:
+    """
+    Formato compacto: tabla de alias de remitentes, encabezado por día, horas HH:MM
+    (hora local de la faena, SITE_TIMEZONE), códigos cortos de adjuntos y mensajes
+    consecutivos del mismo remitente colapsados.
+    """
+    aliases = _sender_aliases(messages)
+    parts = [_compact_header(aliases)]
+    current_day = None
+    previous_sender = None
+
+    for msg in messages:
+        day = _local_day(msg)
+        if day != current_day:
+            parts.append(f"\n## {day}\n")
+            current_day = day
+            previous_sender = None
+        sender = msg.get('remitente') or 'Desconocido'
+        parts.append(_compact_line(msg, "·" if sender == previous_sender else aliases[sender]))
+        previous_sender = sender
+
+    return "".join(parts)
+
+def score_message(msg: dict) -> float:
+    """
+    Relevancia de un mensaje para el reporte, sin considerar redundancia.
+    """
+    text = msg.get('contenido_texto') or ''
+    lowered = text.lower()
+    score = 0.0
+
+    for pattern, weight in KEYWORD_WEIGHTS.items():
+        if re.search(pattern, lowered):
+            score += weight
+
+    score += min(3, len(READING_PATTERN.findall(text))) * 1.5
+    score += min(2, len(TAG_PATTERN.findall(text))) * 1.0
+
+    url_storage = (msg.get('url_storage') or '').lower()
+    if url_storage:
+        score += 2.0 if any(ext in url_storage for ext in ['.pdf', '.xlsx', '.xls', '.docx']) else 1.5
+
+    if SENIOR_ROLES.search(msg.get('remitente') or ''):
+        score += 1.5
+
+    if len(text) < 40 and ACKNOWLEDGEMENTS.match(text) and not url_storage:
+        score -= 3.0
+
+    return score
+
+def _embedding_matrix(messages: list):
+    """
+    Matriz normalizada de embeddings (filas sin embedding quedan en cero).
+    PostgREST entrega la columna vector como string "[0.1,...]"; con
+    EMBEDDING_TRANSFER=quantized llega cuantizada (embedding_codec.py).
+    """
+    vectors = []
+    dim = None
+    for msg in messages:
+        vector = decode_embedding(msg.get('embedding'))
+        if vector is not None and vector.size:
+            dim = dim or vector.size
+        vectors.append(vector)
+
+    if not dim:
+        return None
+
+    matrix = np.zeros((len(messages), dim), dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        if vector is not None and vector.size == dim:
+            matrix[i] = vector
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def select_messages(messages: list, max_chars: int, sizes: list, units: list = None) -> list:
+    """
+    Selección greedy por relevancia marginal dentro de max_chars.
+
+    En cada paso se elige la unidad con mayor score - NOVELTY_WEIGHT * similitud
+    máxima con las ya seleccionadas (MMR), que quepa en el espacio restante.
+
+    Args:
+        messages: Mensajes candidatos
+        max_chars: Espacio disponible
+        sizes: Largo de cada mensaje ya formateado
+        units: Grupos de índices que se seleccionan juntos (hilos); por defecto cada mensaje
+
+    Returns:
+        Índices seleccionados en orden cronológico
+    """
+    grouped = units is not None
+    units = units or [[i] for i in range(len(messages))]
+    scores = [score_message(msg) for msg in messages]
+
+    # Una unidad vale por su mensaje más relevante más una fracción del resto
+    base = np.array([
+        max(scores[i] for i in unit) + UNIT_REST_WEIGHT * (sum(scores[i] for i in unit) - max(scores[i] for i in unit))
+        for unit in units
+    ], dtype=np.float32)
+    lengths = np.array([sum(sizes[i] for i in unit) for unit in units])
+    # A igual relevancia se prefieren los mensajes recientes (posición del último mensaje
+    # de la unidad: las unidades vienen ordenadas por hilo, no por tiempo)
+    base += 0.5 * np.array([max(unit) for unit in units], dtype=np.float32) / max(1, len(messages) - 1)
+
+    matrix = _embedding_matrix(messages)
+    if matrix is not None and grouped:
+        # Una fila por unidad: matrix[best] debe indexarse por unidad, no por mensaje
+        matrix = np.stack([matrix[unit].sum(axis=0) for unit in units])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms
+    max_similarity = np.zeros(len(units), dtype=np.float32)
+    available = np.ones(len(units), dtype=bool)
+    remaining = max_chars - 80  # Espacio para la nota de mensajes omitidos
+    selected = []
+
+    while True:
+        available &= lengths <= remaining
+        if not available.any():
+            break
+        utility = np.where(available, base - NOVELTY_WEIGHT * max_similarity, -np.inf)
+        best = int(np.argmax(utility))
+        selected.extend(units[best])
+        available[best] = False
+        remaining -= lengths[best]
+        if matrix is not None:
+            max_similarity = np.maximum(max_similarity, matrix @ matrix[best])
+
+    return sorted(selected)
+
+def pack_messages(messages: list, max_chars: int, mode: str = None, encoding: str = None) -> str:
+    """
+    Contexto de mensajes dentro de max_chars.
+
+    Si todo cabe, se incluyen todos en orden cronológico. Si no, en modo "ranked"
+    se seleccionan los más relevantes y se reordenan cronológicamente; en modo
+    "chronological" se conservan los primeros hasta el límite.
+
+    Args:
+        messages: Mensajes en orden cronológico
+        max_chars: Tamaño máximo del contexto
+        mode: CONTEXT_PACKING por defecto
+        encoding: CONTEXT_ENCODING por defecto ("compact" o "verbose")
+    """
+    mode = mode or CONTEXT_PACKING
+    encoding = encoding or CONTEXT_ENCODING
+
+    if encoding == "compact":
+        # El alias real se asigna al renderizar; "R00" acota su largo
+        sizes = [len(_compact_line(msg, "R00")) for msg in messages]
+        days = {_local_day(msg) for msg in messages}
+        reserve = len(_compact_header(_sender_aliases(messages))) + 15 * len(days)
+        render = lambda selected: render_compact([messages[i] for i in selected])
+    else:
+        texts = [format_message(msg) for msg in messages]
+        sizes = [len(t) for t in texts]
+        reserve = 0
+        render = lambda selected: "".join(texts[i] for i in selected)
+
+    if sum(sizes) + reserve <= max_chars:
+        return render(range(len(messages)))
+
+    if mode == "ranked":
+        units = None
+        if CONTEXT_THREADING:
+            # Hilos completos (partidos si son muy largos) para no separar preguntas de respuestas
+            units = split_units(assign_threads(messages), sizes, THREAD_UNIT_MAX_CHARS)
+        selected = select_messages(messages, max_chars - reserve, sizes, units)
+        omitted = len(messages) - len(selected)
+        return render(selected) + (
+            f"\n... ({omitted} mensajes de menor relevancia omitidos por límite de longitud)" if omitted else ""
+        )
+
+    selected = []
+    current_length = reserve
+    for i, size in enumerate(sizes):
+        if current_length + size > max_chars:
+            break
+        selected.append(i)
+        current_length += size
+    return render(selected) + OMITTED_NOTE
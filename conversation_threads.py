@@ -0,0 +1,198 @@
+"""
+Reconstrucción de Hilos de Conversación
+Minera Centinela - GSdSO
+Agrupa los mensajes de cada grupo de WhatsApp en hilos (pregunta → respuestas)
+para que la selección de contexto y los resúmenes por partes no corten una conversación
+"""
+
+import hashlib
+import os
+import re
+from datetime import datetime
+
+# Activar/desactivar el uso de hilos como unidad de selección y de corte
+CONTEXT_THREADING = os.environ.get("CONTEXT_THREADING", "true").lower() == "true"
+# Un mensaje no se une a un hilo cuyo último mensaje sea más antiguo que esto
+THREAD_GAP_MINUTES = float(os.environ.get("THREAD_GAP_MINUTES", "30"))
+# Puntaje mínimo para unirse a un hilo abierto (si no, se abre uno nuevo)
+THREAD_JOIN_THRESHOLD = float(os.environ.get("THREAD_JOIN_THRESHOLD", "0.55"))
+THREAD_MAX_MESSAGES = int(os.environ.get("THREAD_MAX_MESSAGES", "60"))
+# Columna opcional con el whatsapp_message_id del mensaje citado (respuesta con cita)
+THREAD_QUOTED_FIELD = os.environ.get("THREAD_QUOTED_FIELD", "respuesta_a")
+
+# Pesos de las señales
+RECENCY_WEIGHT = 0.5        # 1.0 justo después del último mensaje, 0.0 al cumplir THREAD_GAP_MINUTES
+ALTERNATION_WEIGHT = 0.3    # Otro participante responde, o el mismo remitente continúa enseguida
+SIMILARITY_WEIGHT = 0.6     # Similitud coseno con el centroide del hilo
+NEUTRAL_SIMILARITY = 0.3    # Similitud supuesta cuando falta el embedding
+MENTION_WEIGHT = 1.0        # @mención a un participante del hilo
+
+MENTION_PATTERN = re.compile(r"@(\w+)")
+
+def _parse_time(value) -> datetime:
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+def _first_name(sender: str) -> str:
+    return (sender or "").split(" ")[0].lower()
+
+def assign_threads(messages: list, matrix=None) -> list:
+    """
+    Asigna cada mensaje a un hilo de su grupo.
+
+    Señales: respuesta con cita (THREAD_QUOTED_FIELD), @mención a un participante,
+    cercanía en el tiempo, alternancia de remitentes y similitud de embeddings.
+
+    Args:
+        messages: Mensajes en orden cronológico
+        matrix: Matriz de embeddings normalizada (context_packing._embedding_matrix);
+                se calcula si no se entrega
+
+    Returns:
+        Número de hilo por mensaje (los hilos se numeran por orden de inicio)
+    """
+    if matrix is None:
+        from context_packing import _embedding_matrix
+        matrix = _embedding_matrix(messages)
+
+    assignment = [None] * len(messages)
+    open_threads = {}       # grupo_id → hilos abiertos
+    by_whatsapp_id = {}     # whatsapp_message_id → hilo
+    max_gap = THREAD_GAP_MINUTES * 60
+    count = 0
+
+    for i, msg in enumerate(messages):
+        grupo_id = msg.get('grupo_id')
+        sender = msg.get('remitente') or 'Desconocido'
+        when = _parse_time(msg.get('fecha_hora'))
+        vector = matrix[i] if matrix is not None and matrix[i].any() else None
+        candidates = open_threads.setdefault(grupo_id, [])
+
+        # Cerrar hilos vencidos o llenos
+        candidates[:] = [
+            t for t in candidates
+            if len(t["indices"]) < THREAD_MAX_MESSAGES
+            and when is not None and t["last_time"] is not None
+            and (when - t["last_time"]).total_seconds() <= max_gap
+        ]
+
+        chosen = by_whatsapp_id.get(msg.get(THREAD_QUOTED_FIELD))
+        if chosen is None:
+            mentions = {m.lower() for m in MENTION_PATTERN.findall(msg.get('contenido_texto') or '')}
+            best_score = THREAD_JOIN_THRESHOLD
+            for thread in candidates:
+                gap = (when - thread["last_time"]).total_seconds()
+                score = RECENCY_WEIGHT * (1 - gap / max_gap)
+                if sender != thread["last_sender"] or gap <= 120:
+                    score += ALTERNATION_WEIGHT
+                if vector is not None and thread["centroid"] is not None:
+                    norm = float((thread["centroid"] ** 2).sum()) ** 0.5 or 1.0
+                    score += SIMILARITY_WEIGHT * max(0.0, float(thread["centroid"] @ vector) / norm)
+                else:
+                    score += SIMILARITY_WEIGHT * NEUTRAL_SIMILARITY
+                if mentions & thread["first_names"]:
+                    score += MENTION_WEIGHT
+                if score > best_score:
+                    chosen, best_score = thread, score
+
+        if chosen is None:
+            chosen = {"number": count, "indices": [], "centroid": None, "first_names": set()}
+            count += 1
+            candidates.append(chosen)
+
+        chosen["indices"].append(i)
+        chosen["last_time"] = when
+        chosen["last_sender"] = sender
+        chosen["first_names"].add(_first_name(sender))
+        if vector is not None:
+            chosen["centroid"] = vector.copy() if chosen["centroid"] is None else chosen["centroid"] + vector
+        if msg.get('whatsapp_message_id'):
+            by_whatsapp_id[msg['whatsapp_message_id']] = chosen
+        assignment[i] = chosen["number"]
+
+    return assignment
+
+def build_threads(messages: list, matrix=None) -> list:
+    """
+    Hilos de conversación de una ventana de mensajes.
+
+    Returns:
+        Lista de dicts {thread_id, grupo_id, inicio, fin, remitentes, messages},
+        ordenada por inicio. thread_id es estable mientras el hilo no cambie,
+        por lo que sirve como clave de caché y de ruteo.
+    """
+    grouped = {}
+    for msg, number in zip(messages, assign_threads(messages, matrix)):
+        grouped.setdefault(number, []).append(msg)
+
+    threads = []
+    for number in sorted(grouped):
+        members = grouped[number]
+        ids = ",".join(str(m.get('id')) for m in members)
+        threads.append({
+            "thread_id": hashlib.sha256(ids.encode("utf-8")).hexdigest()[:16],
+            "grupo_id": members[0].get('grupo_id'),
+            "inicio": members[0].get('fecha_hora'),
+            "fin": members[-1].get('fecha_hora'),
+            "remitentes": sorted({m.get('remitente') or 'Desconocido' for m in members}),
+            "messages": members
+        })
+    return threads
+
+def split_units(assignment: list, sizes: list, max_chars: int) -> list:
+    """
+    Unidades de índices por hilo, partiendo los hilos que superan max_chars.
+
+    Returns:
+        Lista de listas de índices (cada una en orden cronológico)
+    """
+    threads = {}
+    for i, number in enumerate(assignment):
+        threads.setdefault(number, []).append(i)
+
+    units = []
+    for number in sorted(threads):
+        unit, length = [], 0
+        for i in threads[number]:
+            if unit and length + sizes[i] > max_chars:
+                units.append(unit)
+                unit, length = [], 0
+            unit.append(i)
+            length += sizes[i]
+        units.append(unit)
+    return units
+
+def chunk_by_threads(messages: list, max_chars: int, size_fn) -> list:
+    """
+    Divide mensajes en partes de hasta max_chars sin cortar hilos (salvo hilos
+    más grandes que una parte). Las partes conservan el orden de los hilos, así
+    que agregar mensajes nuevos solo modifica las últimas partes.
+
+    Args:
+        messages: Mensajes en orden cronológico
+        max_chars: Tamaño máximo de cada parte
+        size_fn: Largo de un mensaje formateado
+
+    Returns:
+        Lista de partes (listas de mensajes en orden cronológico)
+    """
+    sizes = [size_fn(msg) for msg in messages]
+    if CONTEXT_THREADING:
+        units = split_units(assign_threads(messages), sizes, max_chars)
+    else:
+        units = [[i] for i in range(len(messages))]
+
+    chunks, current, length = [], [], 0
+    for unit in units:
+        unit_length = sum(sizes[i] for i in unit)
+        if current and length + unit_length > max_chars:
+            chunks.append(sorted(current))
+            current, length = [], 0
+        current.extend(unit)
+        length += unit_length
+    if current:
+        chunks.append(sorted(current))
+
+    return [[messages[i] for i in chunk] for chunk in chunks]
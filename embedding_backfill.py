@@ -0,0 +1,276 @@
+"""
+Completado de Embeddings Pendientes
+Minera Centinela - GSdSO
+Busca mensajes sin embedding, los vectoriza en lotes grandes con text-embedding-3-small
+(concurrencia y límite de requests/tokens por minuto) y los actualiza en bloque, para que
+ninguna ventana del reporte pierda mensajes por no tener vector todavía
+"""
+
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+from supabase import create_client
+from openai import OpenAI
+
+from budget import estimate_tokens
+from tracing import span
+import replay
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+# Completar embeddings de la ventana antes de generar el reporte
+EMBEDDING_BACKFILL = os.environ.get("EMBEDDING_BACKFILL", "true").lower() == "true"
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+BACKFILL_BATCH_SIZE = int(os.environ.get("BACKFILL_BATCH_SIZE", "512"))          # Textos por request (máx. 2048)
+BACKFILL_BATCH_TOKENS = int(os.environ.get("BACKFILL_BATCH_TOKENS", "200000"))   # Tokens por request (máx. 300k)
+BACKFILL_CONCURRENCY = int(os.environ.get("BACKFILL_CONCURRENCY", "4"))
+BACKFILL_MAX_RPM = int(os.environ.get("BACKFILL_MAX_RPM", "500"))                # Límite de la cuenta OpenAI
+BACKFILL_MAX_TPM = int(os.environ.get("BACKFILL_MAX_TPM", "1000000"))
+BACKFILL_MAX_ROWS = int(os.environ.get("BACKFILL_MAX_ROWS", "20000"))            # Filas por ejecución
+BACKFILL_RETRIES = int(os.environ.get("BACKFILL_RETRIES", "4"))
+# Modo worker (python embedding_backfill.py): horizonte hacia atrás e intervalo entre pasadas (0 = una sola)
+BACKFILL_LOOKBACK_HOURS = int(os.environ.get("BACKFILL_LOOKBACK_HOURS", "72"))
+BACKFILL_INTERVAL_SECONDS = int(os.environ.get("BACKFILL_INTERVAL_SECONDS", "0"))
+
+BACKFILL_PAGE_SIZE = 1000     # max-rows por defecto de PostgREST
+MAX_INPUT_CHARS = 24000       # ~8k tokens, límite de entrada del modelo de embeddings
+
+class RateLimiter:
+    """
+    Límite de requests y tokens por minuto compartido entre hilos (token bucket).
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        """Espera hasta poder enviar un request de `tokens` tokens."""
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._updated
+                self._updated = now
+                self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+                self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max((1 - self._requests) * 60 / self.rpm, (tokens - self._tokens) * 60 / self.tpm)
+            time.sleep(max(wait, 0.01))
+
+def embedding_text(row: dict) -> str:
+    """
+    Texto a vectorizar: el contenido del mensaje o, si es solo un adjunto, una
+    descripción con el nombre del archivo. None si no hay nada que vectorizar.
+    """
+    text = (row.get('contenido_texto') or "").strip()
+    if text:
+        return text[:MAX_INPUT_CHARS]
+    url = row.get('url_storage')
+    if url:
+        name = url.rstrip("/").rsplit("/", 1)[-1].split("?", 1)[0]
+        return f"[{'Imagen' if row.get('es_imagen') else 'Adjunto'}] {name}"
+    return "[Imagen]" if row.get('es_imagen') else None
+
+def _vector_text(vector: list) -> str:
+    return "[" + ",".join(repr(float(v)) for v in vector) + "]"
+
+# ----------------------------------------------------
+# CONSULTA Y ESCRITURA
+# ----------------------------------------------------
+
+def find_pending(supabase, since: str, until: str = None, max_rows: int = None) -> list:
+    """
+    Mensajes sin embedding (y no eliminados) de una ventana, en orden cronológico.
+    """
+    max_rows = max_rows or BACKFILL_MAX_ROWS
+    rows = []
+    while len(rows) < max_rows:
+        query = supabase.from_('mensajes_analisis').select(
+            'id, fecha_hora, contenido_texto, es_imagen, url_storage'
+        ).is_('embedding', 'null').is_('deleted_at', 'null').gte('fecha_hora', since)
+        if until:
+            query = query.lte('fecha_hora', until)
+        page_size = min(BACKFILL_PAGE_SIZE, max_rows - len(rows))
+        page = query.order('fecha_hora', desc=False).order('id', desc=False).range(
+            len(rows), len(rows) + page_size - 1
+        ).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            break
+    return rows
+
+_bulk_update_available = True
+
+def write_embeddings(supabase, updates: list) -> int:
+    """
+    Actualiza en bloque los embeddings (función SQL update_embeddings en
+    setup_embedding_backfill.sql); sin la función, fila por fila.
+
+    Args:
+        updates: Lista de dicts {id, embedding}
+
+    Returns:
+        Filas actualizadas
+    """
+    global _bulk_update_available
+    payload = [{"id": item["id"], "embedding": _vector_text(item["embedding"])} for item in updates]
+
+    if _bulk_update_available:
+        try:
+            result = supabase.rpc('update_embeddings', {'updates': payload}).execute().data
+            return result if isinstance(result, int) else len(payload)
+        except Exception as e:
+            error_msg = str(e).lower()
+            if 'update_embeddings' not in error_msg and 'does not exist' not in error_msg \
+                    and 'could not find' not in error_msg:
+                raise
+            _bulk_update_available = False
+            print("   ⚠️ Función SQL 'update_embeddings' no encontrada en Supabase: actualización fila por fila")
+            print("   📝 Ejecuta el archivo 'setup_embedding_backfill.sql' en SQL Editor")
+
+    for item in payload:
+        supabase.from_('mensajes_analisis').update(
+            {'embedding': item['embedding']}
+        ).eq('id', item['id']).is_('embedding', 'null').execute()
+    return len(payload)
+
+# ----------------------------------------------------
+# VECTORIZACIÓN
+# ----------------------------------------------------
+
+def _batches(items: list) -> list:
+    """Lotes que respetan el máximo de textos y de tokens por request."""
+    batches, current, current_tokens = [], [], 0
+    for item in items:
+        if current and (len(current) >= BACKFILL_BATCH_SIZE
+                        or current_tokens + item["tokens"] > BACKFILL_BATCH_TOKENS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += item["tokens"]
+    if current:
+        batches.append(current)
+    return batches
+
+def _process_batch(supabase, openai_client, limiter: RateLimiter, batch: list) -> int:
+    """Vectoriza un lote (con reintentos ante límites de tasa o errores transitorios) y lo escribe."""
+    tokens = sum(item["tokens"] for item in batch)
+    with span("embedding_backfill.batch", textos=len(batch), tokens=tokens) as s:
+        for attempt in range(BACKFILL_RETRIES + 1):
+            limiter.acquire(tokens)
+            try:
+                vectors = replay.create_embedding(
+                    openai_client, input=[item["text"] for item in batch], model=EMBEDDING_MODEL
+                )
+                break
+            except Exception as e:
+                s.add(retries=1)
+                if attempt == BACKFILL_RETRIES:
+                    s.fail(e)
+                    raise
+                print(f"   ⚠️ Lote de {len(batch)} textos: {e.__class__.__name__}, reintento {attempt + 1}")
+                time.sleep(min(30, 2 ** attempt))
+
+        written = write_embeddings(supabase, [
+            {"id": item["id"], "embedding": vector} for item, vector in zip(batch, vectors)
+        ])
+        s.add(rows=written)
+        return written
+
+def backfill_embeddings(supabase, openai_client, since: str, until: str = None, max_rows: int = None) -> dict:
+    """
+    Completa los embeddings faltantes de una ventana.
+
+    Args:
+        supabase: Cliente de Supabase
+        openai_client: Cliente de OpenAI
+        since: Inicio de la ventana (ISO)
+        until: Fin de la ventana (ISO, opcional)
+        max_rows: Máximo de filas a completar (BACKFILL_MAX_ROWS por defecto)
+
+    Returns:
+        Dict con contadores {pendientes, actualizados, omitidos, lotes, errores}
+    """
+    stats = {"pendientes": 0, "actualizados": 0, "omitidos": 0, "lotes": 0, "errores": 0}
+
+    with span("embedding_backfill") as s:
+        rows = find_pending(supabase, since, until, max_rows)
+        stats["pendientes"] = len(rows)
+        if not rows:
+            print("   🧬 Sin mensajes pendientes de embedding")
+            return stats
+
+        items = []
+        for row in rows:
+            text = embedding_text(row)
+            if text is None:
+                stats["omitidos"] += 1
+                continue
+            items.append({"id": row["id"], "text": text, "tokens": estimate_tokens(text)})
+
+        batches = _batches(items)
+        stats["lotes"] = len(batches)
+        print(f"   🧬 {len(items)} mensajes sin embedding → {len(batches)} lotes "
+              f"(hasta {min(BACKFILL_CONCURRENCY, len(batches))} en paralelo)")
+
+        limiter = RateLimiter(BACKFILL_MAX_RPM, BACKFILL_MAX_TPM)
+        with ThreadPoolExecutor(max_workers=max(1, min(BACKFILL_CONCURRENCY, len(batches)))) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, _process_batch,
+                                supabase, openai_client, limiter, batch)
+                for batch in batches
+            ]
+            for future in as_completed(futures):
+                try:
+                    stats["actualizados"] += future.result()
+                except Exception as e:
+                    stats["errores"] += 1
+                    print(f"   ❌ Lote de embeddings fallido: {e}")
+
+        s.add(rows=stats["actualizados"])
+        s.set(pendientes=stats["pendientes"], errores=stats["errores"])
+
+    print(f"   ✅ Embeddings completados: {stats['actualizados']}/{stats['pendientes']} "
+          f"(omitidos sin texto: {stats['omitidos']}, lotes fallidos: {stats['errores']})")
+    return stats
+
+# ----------------------------------------------------
+# MODO WORKER
+# ----------------------------------------------------
+
+def run_worker():
+    """
+    Completa los embeddings de las últimas BACKFILL_LOOKBACK_HOURS horas; con
+    BACKFILL_INTERVAL_SECONDS > 0 repite indefinidamente (servicio worker en Railway).
+    """
+    if not (SUPABASE_URL and SUPABASE_SERVICE_KEY and OPENAI_API_KEY):
+        print("❌ Faltan SUPABASE_URL, SUPABASE_SERVICE_KEY u OPENAI_API_KEY")
+        return
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+
+    while True:
+        since = (datetime.now(timezone.utc) - timedelta(hours=BACKFILL_LOOKBACK_HOURS)).isoformat()
+        print(f"\n🧬 Completando embeddings desde {since}")
+        backfill_embeddings(supabase, openai_client, since)
+        if BACKFILL_INTERVAL_SECONDS <= 0:
+            break
+        time.sleep(BACKFILL_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    run_worker()
@@ -0,0 +1,59 @@
+"""
+Representación Cuantizada de Embeddings
+Minera Centinela - GSdSO
+Codifica los vectores en int8 con escala por vector (o float16) como texto base64 compacto,
+y los decodifica directo a arreglos NumPy para las etapas que usan similitud en el cliente
+"""
+
+import base64
+import os
+
+import numpy as np
+
+# "full": columna embedding (JSON de 1.536 floats); "quantized": columna embedding_q
+# (setup_quantized_embeddings.sql), entregada con el alias embedding
+EMBEDDING_TRANSFER = os.environ.get("EMBEDDING_TRANSFER", "full").lower()
+
+# Prefijos del formato de texto: "i8:<escala>:<base64>" y "f16:<base64>"
+INT8_PREFIX = "i8:"
+FLOAT16_PREFIX = "f16:"
+
+def embedding_column() -> str:
+    """Columna del select de PostgREST que entrega el embedding según EMBEDDING_TRANSFER."""
+    return "embedding:embedding_q" if EMBEDDING_TRANSFER == "quantized" else "embedding"
+
+def encode(vector, kind: str = "int8") -> str:
+    """
+    Codifica un vector.
+
+    Args:
+        vector: Lista o arreglo de floats
+        kind: "int8" (escala por vector = max|v| / 127) o "float16"
+
+    Returns:
+        Texto "i8:<escala>:<base64>" o "f16:<base64>"
+    """
+    values = np.asarray(vector, dtype=np.float32)
+    if kind == "float16":
+        return FLOAT16_PREFIX + base64.b64encode(values.astype("<f2").tobytes()).decode("ascii")
+
+    scale = float(np.abs(values).max()) / 127 if values.size else 0.0
+    quantized = np.round(values / scale) if scale else np.zeros_like(values)
+    payload = base64.b64encode(quantized.astype(np.int8).tobytes()).decode("ascii")
+    return f"{INT8_PREFIX}{scale:.9g}:{payload}"
+
+def decode(embedding) -> np.ndarray:
+    """
+    Vector float32 desde cualquiera de los formatos: cuantizado (i8/f16), texto de
+    PostgREST "[0.1,...]" o lista. None si no hay embedding.
+    """
+    if embedding is None:
+        return None
+    if isinstance(embedding, str):
+        if embedding.startswith(INT8_PREFIX):
+            scale, payload = embedding[len(INT8_PREFIX):].split(":", 1)
+            return np.frombuffer(base64.b64decode(payload), dtype=np.int8).astype(np.float32) * np.float32(scale)
+        if embedding.startswith(FLOAT16_PREFIX):
+            return np.frombuffer(base64.b64decode(embedding[len(FLOAT16_PREFIX):]), dtype="<f2").astype(np.float32)
+        return np.fromstring(embedding.strip("[]"), sep=",", dtype=np.float32)
+    return np.asarray(embedding, dtype=np.float32)
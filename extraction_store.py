@@ -0,0 +1,224 @@
+"""
+Persistencia de Resultados de Extracción en Supabase
+Minera Centinela - GSdSO
+Escribe las filas extraídas por las pasadas (QP, demoras, actividades, seguridad, KPIs)
+en tablas dedicadas con procedencia (run_id, mensajes, grupo), usando upserts por lotes
+"""
+
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+
+from tag_index import extract_tags
+from tracing import current_span
+
+# Activar/desactivar la persistencia (tablas creadas con setup_extraction_tables.sql)
+PERSIST_EXTRACTIONS = os.environ.get("PERSIST_EXTRACTIONS", "true").lower() == "true"
+EXTRACTION_BATCH_SIZE = int(os.environ.get("EXTRACTION_BATCH_SIZE", "500"))
+MAX_PROVENANCE_IDS = 50  # Mensajes de origen guardados por fila
+
+# Tabla destino → (pasada, claves JSON de la pasada, columnas tipadas {columna: ruta en la fila},
+# columnas que identifican la fila entre ejecuciones). El resto de la fila queda completa en
+# la columna jsonb "datos".
+EXTRACTION_TABLES = {
+    "extraccion_quiebres_plan": ("pass.demoras", ["quiebres_plan"], {
+        "qp_numero": "qp_numero", "fecha": "fecha", "area": "area", "equipo": "equipo",
+        "demora_horas": "demora_horas", "razon": "razon"
+    }, ("qp_numero", "fecha", "area", "equipo")),
+    "extraccion_demoras": ("pass.demoras", ["demoras"], {
+        "actividad": "actividad", "fecha": "fecha", "demora_horas": "demora_horas",
+        "causa": "causa", "responsable": "responsable"
+    }, ("actividad", "fecha", "causa", "responsable")),
+    "extraccion_actividades": ("pass.actividades", ["actividades"], {
+        "tipo": "tipo", "descripcion": "descripcion", "equipo": "equipo.tag", "area": "ubicacion.area",
+        "empresa": "ejecutor.empresa", "demora_horas": "tiempos.demora_horas", "estado": "estado"
+    }, ("tipo", "equipo", "area", "empresa")),
+    "extraccion_incidentes": ("pass.seguridad", ["incidentes"], {
+        "fecha": "fecha", "tipo": "tipo", "descripcion": "descripcion", "empresa": "empresa",
+        "dias_perdidos": "dias_perdidos"
+    }, ("fecha", "tipo", "empresa", "descripcion")),
+    "extraccion_hallazgos": ("pass.seguridad", ["hallazgos"], {
+        "fecha": "fecha", "tipo": "tipo", "descripcion": "descripcion", "ubicacion": "ubicacion",
+        "severidad": "severidad", "estado": "estado"
+    }, ("fecha", "tipo", "ubicacion", "descripcion")),
+    "extraccion_kpis": ("pass.produccion", ["produccion", "parametros_proceso", "disponibilidad", "consumos"], {
+        "equipo": "equipo", "parametro": "parametro", "valor": "valor", "unidad": "unidad", "fecha": "fecha"
+    }, ("equipo", "parametro", "valor", "unidad", "fecha")),
+}
+
+# Columnas numéricas (el resto se guarda como texto)
+NUMERIC_COLUMNS = ("demora_horas", "dias_perdidos")
+
+def _get_path(row: dict, path: str):
+    value = row
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def _to_number(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    match = re.search(r"-?\d+(?:[.,]\d+)?", str(value))
+    return float(match.group().replace(",", ".")) if match else None
+
+def _to_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return value.get("tag") or value.get("nombre") or json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+def build_provenance_index(messages: list) -> dict:
+    """
+    Índice TAG → [(id, grupo_id)] de los mensajes de la ventana.
+
+    Las pasadas no devuelven ids de mensajes; la procedencia de cada fila se
+    reconstruye a partir de los TAGs que menciona.
+    """
+    index = {}
+    for msg in messages:
+        for tag in extract_tags(msg.get("contenido_texto")):
+            index.setdefault(tag, []).append((msg.get("id"), msg.get("grupo_id")))
+    return index
+
+def _provenance(row: dict, index: dict) -> tuple:
+    ids, grupos = set(), Counter()
+    for tag in extract_tags(json.dumps(row, ensure_ascii=False)):
+        for mensaje_id, grupo_id in index.get(tag, []):
+            ids.add(mensaje_id)
+            if grupo_id is not None:
+                grupos[grupo_id] += 1
+    grupo_principal = grupos.most_common(1)[0][0] if grupos else None
+    return sorted(ids)[:MAX_PROVENANCE_IDS], sorted(grupos), grupo_principal
+
+def _key_text(value) -> str:
+    text = re.sub(r"\s+", " ", _to_text(value) or "").strip().strip("`").lower()
+    return "" if text in ("no reportado", "null", "none", "n/a", "-") else text
+
+def _row_key(table: str, categoria: str, row: dict, columns: dict, key_columns: tuple,
+             mensaje_ids: list) -> str:
+    """
+    Clave de upsert: la misma fila extraída por ejecuciones con ventanas superpuestas
+    actualiza el registro existente en vez de duplicarlo.
+
+    Se usan las columnas de identidad de la tabla (normalizadas) y los TAGs de la fila.
+    Una fila sin ninguno de esos datos se identifica por su primer mensaje de origen.
+    """
+    identity = [_key_text(_get_path(row, columns[column])) for column in key_columns]
+    tags = sorted(extract_tags(json.dumps(row, ensure_ascii=False, default=str)))
+    if not any(identity) and not tags:
+        identity.append(str(mensaje_ids[0]) if mensaje_ids else "")
+    payload = json.dumps([table, categoria, identity, tags], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def _unique_keys(rows: list) -> list:
+    """
+    Garantiza un row_key distinto por fila dentro de la ejecución (el upsert del lote
+    falla con claves repetidas). Solo se descartan las filas idénticas que el modelo
+    repite; las demás que coinciden en la clave reciben un ordinal.
+    """
+    seen = {}
+    unique = []
+    for row in rows:
+        same_key = seen.setdefault(row["row_key"], [])
+        if any(other["datos"] == row["datos"] for other in same_key):
+            continue
+        same_key.append(row)
+        if len(same_key) > 1:
+            payload = f"{row['row_key']}#{len(same_key)}"
+            row["row_key"] = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+        unique.append(row)
+    return unique
+
+def build_extraction_rows(analyses: dict, messages: list, run_id: str, periodo_texto: str) -> dict:
+    """
+    Convierte la salida de las pasadas en filas por tabla destino.
+
+    Args:
+        analyses: Dict {"pass.demoras": {...}, "pass.actividades": {...}, ...}
+        messages: Mensajes de la ventana analizada (para la procedencia)
+        run_id: Identificador de la ejecución
+        periodo_texto: Descripción del período
+
+    Returns:
+        Dict {tabla: [filas]}
+    """
+    index = build_provenance_index(messages)
+    tables = {}
+
+    for table, (stage, keys, columns, key_columns) in EXTRACTION_TABLES.items():
+        result = analyses.get(stage)
+        rows = []
+        for categoria in keys:
+            items = result.get(categoria) if isinstance(result, dict) else None
+            for item in items if isinstance(items, list) else []:
+                if not isinstance(item, dict):
+                    continue
+                mensaje_ids, grupo_ids, grupo_id = _provenance(item, index)
+                row = {
+                    "row_key": _row_key(table, categoria, item, columns, key_columns, mensaje_ids),
+                    "run_id": run_id,
+                    "periodo": periodo_texto,
+                    "categoria": categoria,
+                    "mensaje_ids": mensaje_ids,
+                    "grupo_ids": grupo_ids,
+                    "grupo_id": grupo_id,
+                    "datos": item
+                }
+                for column, path in columns.items():
+                    value = _get_path(item, path)
+                    row[column] = _to_number(value) if column in NUMERIC_COLUMNS else _to_text(value)
+                rows.append(row)
+        if rows:
+            tables[table] = _unique_keys(rows)
+
+    return tables
+
+def persist_extractions(analyses: dict, messages: list, run_id: str, periodo_texto: str,
+                        client) -> dict:
+    """
+    Escribe las filas extraídas en Supabase con upserts por lotes (on_conflict=row_key).
+
+    Una tabla que falla no detiene las demás: el error se informa y se cuenta en
+    el span actual (errors).
+
+    Args:
+        client: Cliente Supabase de la aplicación (app.supabase)
+
+    Returns:
+        Dict {tabla: filas escritas}; vacío si la persistencia está desactivada
+    """
+    if not PERSIST_EXTRACTIONS or client is None:
+        return {}
+
+    tables = build_extraction_rows(analyses, messages, run_id, periodo_texto)
+    written = {}
+    failed = []
+
+    for table, rows in tables.items():
+        try:
+            for i in range(0, len(rows), EXTRACTION_BATCH_SIZE):
+                batch = rows[i:i + EXTRACTION_BATCH_SIZE]
+                client.table(table).upsert(batch, on_conflict="row_key").execute()
+                written[table] = written.get(table, 0) + len(batch)
+        except Exception as e:
+            failed.append(table)
+            if 'does not exist' in str(e).lower() or 'could not find' in str(e).lower():
+                print(f"   ⚠️ Tabla '{table}' no encontrada en Supabase")
+                print("   📝 Ejecuta el archivo 'setup_extraction_tables.sql' en SQL Editor")
+            else:
+                print(f"   ⚠️ Error persistiendo '{table}': {e}")
+            continue
+
+    if failed:
+        s = current_span()
+        if s:
+            s.add(errors=len(failed))
+            s.set(failed_tables=failed)
+    if written:
+        print("   🗄️ Extracción persistida: " + ", ".join(f"{t}={n}" for t, n in written.items()))
+    return written
@@ -0,0 +1,279 @@
+"""
+Resumen Jerárquico (Tree-Reduce) para Ventanas Semanales y Mensuales
+Minera Centinela - GSdSO
+Grupo/día → semana → contexto final, con cada nivel en paralelo y en caché
+"""
+
+import contextvars
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from budget import PRIORITY_HIGH
+from context_packing import format_message
+from conversation_threads import chunk_by_threads
+from grupos_config import get_grupo_info
+from llm_gateway import create_claude_message, resolve_model
+from tracing import span
+import replay
+
+# "auto": se activa cuando la ventana supera un día y no cabe en el contexto
+# "true": siempre que haya más de un día; "false": desactivado
+HIERARCHICAL_SUMMARY = os.environ.get("HIERARCHICAL_SUMMARY", "auto").lower()
+HIERARCHY_MAX_WORKERS = int(os.environ.get("HIERARCHY_MAX_WORKERS", "8"))
+# Caché persistente de resúmenes (SQLite). Sin ruta, la caché vive solo durante el proceso.
+SUMMARY_CACHE_PATH = os.environ.get("SUMMARY_CACHE_PATH")
+
+LEAF_INPUT_MAX_CHARS = 40000   # Conversación de un grupo en un día
+LEAF_SUMMARY_MAX_WORDS = 350
+LEAF_MAX_TOKENS = 1200
+WEEK_MAX_TOKENS = 3000
+CHARS_PER_WORD = 6.5
+
+PROMPT_RESUMEN_GRUPO_DIA = """Eres un analista de operaciones mineras de Minera Centinela.
+
+Resume las conversaciones del grupo **{grupo}** del día **{fecha}** en una bitácora técnica condensada.
+Esta bitácora será la ÚNICA fuente para el análisis posterior de demoras, actividades, seguridad y KPIs.
+
+**CONSERVA SIEMPRE:**
+- TAGs de equipos exactos, áreas y ubicaciones
+- Hora (HH:MM) y remitente de cada hecho
+- Quiebres de plan (QP #), demoras con horas y causa
+- Incidentes, hallazgos, permisos (SPCI) y compromisos
+- Valores numéricos con unidad (caudales, presiones, temperaturas, HH)
+- Archivos adjuntos mencionados
+- Empresa y estado de cada actividad
+
+**ELIMINA:** saludos, confirmaciones ("ok", "recibido"), repeticiones.
+
+**FORMATO:** lista de viñetas "- HH:MM Remitente: hecho". Máximo {max_palabras} palabras.
+
+Conversaciones:
+{conversaciones}
+
+Responde SOLO con la bitácora."""
+
+PROMPT_RESUMEN_SEMANA = """Eres un analista de operaciones mineras de Minera Centinela.
+
+Consolida las bitácoras diarias de la semana **{semana}** en una bitácora semanal.
+Será la ÚNICA fuente para el análisis posterior de demoras, actividades, seguridad y KPIs.
+
+**REGLAS:**
+- Conserva TODOS los QP, incidentes, hallazgos, demoras (con horas) y valores KPI con unidad
+- Conserva TAGs, fechas (DD/MM), remitentes y empresas
+- Fusiona eventos repetidos indicando frecuencia (ej: "falla recurrente `P-101`: 3 días, 7.5 h acumuladas")
+- Organiza por grupo/empresa y luego por día
+- NO inventes información que no esté en las bitácoras
+
+Máximo {max_palabras} palabras.
+
+Bitácoras diarias:
+{bitacoras}
+
+Responde SOLO con la bitácora semanal."""
+
+_cache_lock = threading.Lock()
+_memory_cache = {}
+
+# ----------------------------------------------------
+# CACHÉ
+# ----------------------------------------------------
+
+def _cache_get(key: str) -> str:
+    with _cache_lock:
+        if key in _memory_cache:
+            return _memory_cache[key]
+        if not SUMMARY_CACHE_PATH:
+            return None
+        conn = sqlite3.connect(SUMMARY_CACHE_PATH)
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS resumenes (key TEXT PRIMARY KEY, texto TEXT, creado TEXT)")
+            row = conn.execute("SELECT texto FROM resumenes WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        if row:
+            _memory_cache[key] = row[0]
+            return row[0]
+    return None
+
+def _cache_put(key: str, text: str):
+    with _cache_lock:
+        _memory_cache[key] = text
+        if not SUMMARY_CACHE_PATH:
+            return
+        conn = sqlite3.connect(SUMMARY_CACHE_PATH)
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS resumenes (key TEXT PRIMARY KEY, texto TEXT, creado TEXT)")
+            conn.execute("INSERT OR REPLACE INTO resumenes VALUES (?, ?, ?)",
+                         (key, text, datetime.now().isoformat(timespec="seconds")))
+            conn.commit()
+        finally:
+            conn.close()
+
+def _summarize(client, stage: str, prompt: str, max_tokens: int) -> tuple:
+    """
+    Ejecuta un resumen pasando por la caché.
+
+    La caché no se usa al grabar o reproducir: todas las llamadas deben quedar
+    en el bundle para que el replay sea idéntico.
+
+    Returns:
+        (texto o None si el presupuesto omitió la llamada, True si vino de caché)
+    """
+    use_cache = not (replay.is_recording() or replay.is_replaying())
+    key = replay.request_key("summary", model=resolve_model(stage), prompt=prompt, max_tokens=max_tokens)
+
+    if use_cache:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached, True
+
+    response = create_claude_message(
+        client, stage=stage, prompt=prompt, max_tokens=max_tokens,
+        temperature=0.1, priority=PRIORITY_HIGH
+    )
+    if response is None:
+        return None, False
+
+    text = response.content[0].text.strip()
+    if use_cache and text:
+        _cache_put(key, text)
+    return text, False
+
+def _parallel(tasks: list) -> list:
+    """Ejecuta (función, args) en paralelo conservando el span padre en cada hilo."""
+    if not tasks:
+        return []
+    with ThreadPoolExecutor(max_workers=min(HIERARCHY_MAX_WORKERS, len(tasks))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, fn, *args) for fn, args in tasks]
+        return [future.result() for future in futures]
+
+# ----------------------------------------------------
+# NIVELES DEL ÁRBOL
+# ----------------------------------------------------
+
+def _group_label(grupo_id) -> str:
+    info = get_grupo_info(grupo_id)
+    return f"{info['empresa']} (grupo {grupo_id})" if info else f"Grupo {grupo_id}"
+
+def _week_label(day: str) -> str:
+    """Semana ISO del día ("2025-S49"); los mensajes sin fecha_hora van a "sin fecha"."""
+    try:
+        year, week, _ = datetime.strptime(day, "%Y-%m-%d").isocalendar()
+    except (TypeError, ValueError):
+        return "sin fecha"
+    return f"{year}-S{week:02d}"
+
+def _leaf(client, formatter, grupo_id, day: str, part: str, chunk: list) -> dict:
+    with span("summary.day", grupo_id=grupo_id, fecha=day, parte=part) as s:
+        conversaciones = formatter(chunk, max_chars=LEAF_INPUT_MAX_CHARS)
+        prompt = PROMPT_RESUMEN_GRUPO_DIA.format(
+            grupo=_group_label(grupo_id),
+            fecha=f"{day}{part}",
+            max_palabras=LEAF_SUMMARY_MAX_WORDS,
+            conversaciones=conversaciones
+        )
+        try:
+            text, cached = _summarize(client, "summary.day", prompt, LEAF_MAX_TOKENS)
+        except Exception as e:
+            print(f"   ⚠️ Resumen {day} grupo {grupo_id}: {e}")
+            s.fail(e)
+            text, cached = None, False
+
+        if not text:
+            # Sin resumen: se conserva el inicio de la conversación cruda
+            text = formatter(chunk, max_chars=int(LEAF_SUMMARY_MAX_WORDS * CHARS_PER_WORD))
+        s.add(rows=len(chunk), cache_hits=int(cached))
+        return {"grupo_id": grupo_id, "day": day, "part": part, "text": text}
+
+def _week(client, week: str, leaves: list, budget_chars: int) -> str:
+    bitacoras = "\n\n".join(
+        f"#### {leaf['day']} - {_group_label(leaf['grupo_id'])}{leaf['part']}\n{leaf['text']}" for leaf in leaves
+    )
+    # Si la semana ya cabe en su parte del contexto, no se reduce (sin pérdida de detalle)
+    if len(bitacoras) <= budget_chars:
+        return bitacoras
+
+    with span("summary.week", semana=week) as s:
+        prompt = PROMPT_RESUMEN_SEMANA.format(
+            semana=week,
+            max_palabras=max(300, int(budget_chars / CHARS_PER_WORD)),
+            bitacoras=bitacoras
+        )
+        try:
+            text, cached = _summarize(client, "summary.week", prompt, WEEK_MAX_TOKENS)
+        except Exception as e:
+            print(f"   ⚠️ Resumen semana {week}: {e}")
+            s.fail(e)
+            text, cached = None, False
+        s.add(rows=len(leaves), cache_hits=int(cached))
+        return text or bitacoras[:budget_chars]
+
+def should_use_hierarchy(messages: list, max_chars: int, formatter) -> bool:
+    """
+    Decide si la ventana requiere resumen jerárquico.
+
+    Returns:
+        True si los mensajes abarcan más de un día y (en modo "auto") no caben en max_chars
+    """
+    if HIERARCHICAL_SUMMARY == "false" or not messages:
+        return False
+    days = {str(msg.get('fecha_hora', ''))[:10] for msg in messages}
+    if len(days) < 2:
+        return False
+    if HIERARCHICAL_SUMMARY == "true":
+        return True
+    return len(formatter(messages, max_chars=10**9)) > max_chars
+
+def build_hierarchical_context(messages: list, max_chars: int, client, formatter) -> str:
+    """
+    Construye el contexto de las pasadas a partir del árbol de resúmenes.
+
+    Nivel 1: bitácora por grupo y día (en paralelo, en caché: los días ya cerrados
+             no se vuelven a resumir en ejecuciones posteriores). Un grupo/día que
+             no cabe en LEAF_INPUT_MAX_CHARS se divide en partes por hilos de
+             conversación en vez de truncarse
+    Nivel 2: bitácora semanal, solo si los días de la semana no caben en su parte
+             del contexto (en paralelo por semana)
+
+    Args:
+        messages: Mensajes de la ventana (orden cronológico)
+        max_chars: Tamaño máximo del contexto final
+        client: Cliente de Claude
+        formatter: format_messages_for_context(messages, max_chars)
+
+    Returns:
+        Contexto en texto con una sección por semana
+    """
+    chunks = defaultdict(list)
+    for msg in messages:
+        chunks[(str(msg.get('fecha_hora', ''))[:10], msg.get('grupo_id'))].append(msg)
+
+    tasks = []
+    for (day, grupo_id), chunk in sorted(chunks.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        parts = chunk_by_threads(chunk, LEAF_INPUT_MAX_CHARS, lambda msg: len(format_message(msg)))
+        for n, part in enumerate(parts, 1):
+            # Sin el total de partes: la etiqueta entra en la clave de caché y una parte
+            # nueva en el día no debe invalidar las anteriores
+            label = f" (parte {n})" if n > 1 else ""
+            tasks.append((_leaf, (client, formatter, grupo_id, day, label, part)))
+
+    print(f"   🌳 Resumen jerárquico: {len(tasks)} bitácoras grupo/día")
+    leaves = _parallel(tasks)
+
+    weeks = defaultdict(list)
+    for leaf in leaves:
+        weeks[_week_label(leaf["day"])].append(leaf)
+
+    budget_chars = max_chars // len(weeks) - 100
+    reduced = _parallel([
+        (_week, (client, week, week_leaves, budget_chars)) for week, week_leaves in sorted(weeks.items())
+    ])
+
+    context = "\n\n".join(
+        f"### Semana {week}\n{text}" for week, text in zip(sorted(weeks), reduced)
+    )
+    return context[:max_chars]
@@ -0,0 +1,135 @@
+"""
+Actualización Incremental del Reporte Durante el Día
+Minera Centinela - GSdSO
+Guarda el estado estructurado de la última ejecución (extracción de las pasadas y
+watermark de mensajes) para que una actualización analice solo los mensajes nuevos
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+
+# Activar el modo actualización: si hay estado del mismo día y ventana, solo se procesa el delta
+INCREMENTAL_REFRESH = os.environ.get("INCREMENTAL_REFRESH", "false").lower() == "true"
+# Archivo JSON del estado (volumen persistente en Railway). Sin ruta no hay actualización incremental.
+REFRESH_STATE_PATH = os.environ.get("REFRESH_STATE_PATH")
+# Margen hacia atrás desde el watermark: mensajes con embedding tardío o timestamp atrasado
+REFRESH_OVERLAP_MINUTES = int(os.environ.get("REFRESH_OVERLAP_MINUTES", "60"))
+
+# Versión del formato del estado: al cambiarla la siguiente ejecución es completa
+STATE_VERSION = "1"
+
+def is_enabled() -> bool:
+    return INCREMENTAL_REFRESH and bool(REFRESH_STATE_PATH)
+
+def load_state(window_key: str, today: str, path: str = None) -> dict:
+    """
+    Estado de la ejecución anterior, si corresponde al mismo día y a la misma ventana.
+
+    Args:
+        window_key: Identificador de la ventana configurada (ej: "24h")
+        today: Fecha del reporte (YYYY-MM-DD)
+
+    Returns:
+        Dict del estado o None (la ejecución debe ser completa)
+    """
+    path = path or REFRESH_STATE_PATH
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"   ⚠️ Estado de actualización ilegible ({e}); se genera el reporte completo")
+        return None
+
+    if state.get("version") != STATE_VERSION or state.get("window_key") != window_key:
+        return None
+    if state.get("fecha") != today:
+        return None
+    return state
+
+def save_state(state: dict, path: str = None):
+    """Escribe el estado de forma atómica (archivo temporal + rename)."""
+    path = path or REFRESH_STATE_PATH
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    print(f"   💾 Estado para actualización incremental: {len(state['mensaje_ids'])} mensajes procesados")
+
+def build_state(previous: dict, run_id: str, window_key: str, today: str, window_start: str,
+                periodo_texto: str, analyses: dict, messages: list, report_path: str = None) -> dict:
+    """
+    Estado tras una ejecución completa (previous=None) o una actualización.
+
+    Args:
+        previous: Estado anterior (None en una ejecución completa)
+        run_id: Ejecución que originó el reporte (se conserva en las actualizaciones)
+        analyses: Extracción acumulada de las pasadas
+        messages: Mensajes procesados en esta ejecución
+    """
+    processed = set(previous["mensaje_ids"]) if previous else set()
+    processed.update(msg['id'] for msg in messages if msg.get('id') is not None)
+
+    watermark = previous["watermark"] if previous else None
+    for msg in messages:
+        if watermark is None or str(msg.get('fecha_hora')) > watermark:
+            watermark = str(msg.get('fecha_hora'))
+
+    return {
+        "version": STATE_VERSION,
+        "run_id": previous["run_id"] if previous else run_id,
+        "window_key": window_key,
+        "fecha": today,
+        "window_start": previous["window_start"] if previous else window_start,
+        "periodo_texto": previous["periodo_texto"] if previous else periodo_texto,
+        "watermark": watermark,
+        "mensaje_ids": sorted(processed),
+        "analyses": analyses,
+        "report_path": report_path,
+        "actualizaciones": (previous.get("actualizaciones", 0) + 1) if previous else 0,
+        "generado": datetime.now().isoformat(timespec="seconds")
+    }
+
+def fetch_since(state: dict) -> str:
+    """Inicio de la consulta del delta: watermark menos el margen de solapamiento."""
+    watermark = datetime.fromisoformat(state["watermark"].replace("Z", "+00:00"))
+    return (watermark - timedelta(minutes=REFRESH_OVERLAP_MINUTES)).isoformat()
+
+def new_messages(state: dict, messages: list) -> list:
+    """Mensajes del delta que no fueron procesados en ejecuciones anteriores."""
+    processed = set(state["mensaje_ids"])
+    return [msg for msg in messages if msg.get('id') not in processed]
+
+def processed_count(state: dict, messages: list) -> int:
+    """Mensajes cubiertos por el reporte actualizado: los del estado más los del delta."""
+    processed = set(state["mensaje_ids"]) if state else set()
+    processed.update(msg['id'] for msg in messages if msg.get('id') is not None)
+    return len(processed)
+
+def _canonical(item) -> str:
+    return json.dumps(item, sort_keys=True, ensure_ascii=False, default=str)
+
+def merge_analyses(previous: dict, delta: dict) -> dict:
+    """
+    Une la extracción acumulada con la del delta, pasada por pasada.
+
+    Las listas se concatenan sin repetir filas idénticas; otros valores se toman
+    del delta si vienen informados.
+    """
+    merged = {}
+    for stage in sorted(set(previous or {}) | set(delta or {})):
+        old = (previous or {}).get(stage) or {}
+        new = (delta or {}).get(stage) or {}
+        result = dict(old)
+        for key, value in new.items():
+            if isinstance(value, list) and isinstance(old.get(key), list):
+                seen = {_canonical(item) for item in old[key]}
+                result[key] = old[key] + [item for item in value if _canonical(item) not in seen]
+            elif value not in (None, "", [], {}):
+                result[key] = value
+        merged[stage] = result
+    return merged
@@ -0,0 +1,135 @@
+"""
+Punto Único de Llamadas a Claude
+Minera Centinela - GSdSO
+Enruta el modelo por etapa, aplica presupuesto y registra consumo y trazas
+"""
+
+import json
+import os
+import time
+
+from budget import get_budget, PRIORITY_REQUIRED
+from tracing import current_span
+import replay
+
+DEFAULT_CLAUDE_MODEL = "claude-sonnet-4-20250514"
+FAST_CLAUDE_MODEL = "claude-haiku-4-5-20251001"
+
+# Tabla de enrutamiento de modelos por etapa.
+# Se busca primero la etapa exacta ("pass.seguridad"), luego su prefijo ("pass")
+# y finalmente "default". "escalation" es el modelo al que se escala cuando la
+# salida del modelo rápido no pasa la validación.
+MODEL_ROUTES = {
+    "default": DEFAULT_CLAUDE_MODEL,
+    "pass": FAST_CLAUDE_MODEL,          # Extracción estructurada (temperatura 0.1)
+    "summary": FAST_CLAUDE_MODEL,       # Bitácoras grupo/día y semanales (hierarchical_summary.py)
+    "synthesis": DEFAULT_CLAUDE_MODEL,
+    "report_standard": DEFAULT_CLAUDE_MODEL,
+    "escalation": DEFAULT_CLAUDE_MODEL,
+}
+
+# Sobrescritura por variable de entorno, ej:
+# CLAUDE_MODEL_ROUTES='{"pass": "claude-sonnet-4-20250514", "pass.seguridad": "claude-sonnet-4-20250514"}'
+_routes_override = os.environ.get("CLAUDE_MODEL_ROUTES")
+if _routes_override:
+    try:
+        MODEL_ROUTES.update(json.loads(_routes_override))
+    except ValueError as e:
+        print(f"⚠️ CLAUDE_MODEL_ROUTES inválido, usando tabla por defecto: {e}")
+
+def resolve_model(stage: str) -> str:
+    """
+    Modelo asignado a una etapa según MODEL_ROUTES.
+    """
+    if stage in MODEL_ROUTES:
+        return MODEL_ROUTES[stage]
+    prefix = stage.split(".", 1)[0]
+    return MODEL_ROUTES.get(prefix, MODEL_ROUTES["default"])
+
+def escalation_model() -> str:
+    """Modelo al que se escala cuando la salida de una etapa no es válida."""
+    return MODEL_ROUTES.get("escalation", MODEL_ROUTES["default"])
+
+def create_claude_message(client, stage: str, prompt: str, max_tokens: int,
+                          temperature: float = None, model: str = None,
+                          priority: int = PRIORITY_REQUIRED):
+    """
+    Ejecuta claude_client.messages.create respetando el presupuesto de la ejecución.
+
+    Args:
+        client: Cliente anthropic.Anthropic
+        stage: Nombre de la etapa (para presupuesto y trazas)
+        prompt: Prompt de usuario
+        max_tokens: Tokens máximos de salida solicitados
+        temperature: Temperatura (None = default de la API)
+        model: Modelo solicitado (None = según MODEL_ROUTES)
+        priority: PRIORITY_REQUIRED, PRIORITY_HIGH o PRIORITY_LOW (ver budget.py)
+
+    En modo replay la respuesta se toma del bundle grabado (sin red).
+
+    Returns:
+        Respuesta de la API, o None si el presupuesto obligó a omitir la llamada
+    """
+    model = model or resolve_model(stage)
+    budget = get_budget()
+    decision = budget.plan(stage, prompt, max_tokens, model, priority)
+    s = current_span()
+
+    if decision.skip:
+        if s:
+            s.set(skipped=True, degradation=decision.degradation)
+        return None
+
+    params = {
+        "model": decision.model,
+        "max_tokens": decision.max_tokens,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    if temperature is not None:
+        params["temperature"] = temperature
+
+    key = replay.request_key("claude", **params)
+    start = time.perf_counter()
+    try:
+        if replay.is_replaying():
+            response = replay.replay_claude(key)
+        else:
+            response = client.messages.create(**params)
+            replay.record_claude(key, response)
+    except Exception:
+        budget.release(decision)
+        raise
+    latency_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    entry = budget.record(stage, decision.model, response, latency_ms=latency_ms, decision=decision)
+    if s:
+        s.record_usage(response)
+        s.set(model=decision.model, cost_usd=entry["cost_usd"], latency_ms=latency_ms)
+        if decision.degradation:
+            s.set(degradation=decision.degradation)
+
+    return response
+
+def create_openai_chat(client, stage: str, messages: list, model: str = "gpt-4o",
+                       max_tokens: int = 6000, temperature: float = 0.3):
+    """
+    Ejecuta openai chat.completions.create (fallback GPT-4) pasando por grabación/replay.
+    """
+    params = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    }
+    key = replay.request_key("openai_chat", **params)
+
+    if replay.is_replaying():
+        return replay.replay_openai_chat(key)
+
+    response = client.chat.completions.create(**params)
+    replay.record_openai_chat(key, response)
+
+    s = current_span()
+    if s:
+        s.set(model=model)
+    return response
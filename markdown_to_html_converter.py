@@ -5,10 +5,12 @@ Mantiene el contenido técnico, mejora la presentación visual
 """
 
 import re
-from datetime import datetime, timedelta
+from datetime import timedelta
 import markdown
 from bs4 import BeautifulSoup
 
+import replay
+
 def get_chile_time():
     """
     Obtiene la hora actual en zona horaria de Chile (UTC-3 o UTC-4 según DST).
@@ -16,8 +18,9 @@ def get_chile_time():
     Durante DST (verano): UTC-4
     
     Para simplificar, usamos UTC-3 como estándar de Chile continental.
+    En modo grabación/replay se usa la hora fija de la ejecución.
     """
-    utc_now = datetime.utcnow()
+    utc_now = replay.utcnow()
     chile_offset = timedelta(hours=-3)  # Chile Standard Time
     chile_time = utc_now + chile_offset
     return chile_time
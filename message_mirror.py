@@ -0,0 +1,339 @@
+"""
+Espejo Local Incremental de mensajes_analisis
+Minera Centinela - GSdSO
+Sincroniza solo filas nuevas (watermark fecha_hora/id) y sirve las ventanas desde SQLite
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+import tag_index
+from embedding_codec import embedding_column
+
+# Ruta de la base SQLite local. Si no está definida, el espejo está desactivado.
+LOCAL_MIRROR_PATH = os.environ.get("LOCAL_MIRROR_PATH")
+MIRROR_INITIAL_DAYS = int(os.environ.get("MIRROR_INITIAL_DAYS", "35"))   # Historia en la primera sincronización
+MIRROR_REFRESH_DAYS = int(os.environ.get("MIRROR_REFRESH_DAYS", "7"))    # Horizonte para ediciones y embeddings tardíos
+MIRROR_PAGE_SIZE = int(os.environ.get("MIRROR_PAGE_SIZE", "1000"))       # max-rows por defecto de PostgREST
+
+MIRROR_COLUMNS = [
+    "id", "grupo_id", "fecha_hora", "remitente", "contenido_texto", "es_imagen",
+    "url_storage", "embedding", "whatsapp_message_id", "deleted_at"
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mensajes (
+    id INTEGER PRIMARY KEY,
+    grupo_id INTEGER,
+    fecha_hora TEXT,
+    fecha_utc TEXT NOT NULL,
+    remitente TEXT,
+    contenido_texto TEXT,
+    es_imagen INTEGER,
+    url_storage TEXT,
+    embedding TEXT,
+    whatsapp_message_id TEXT,
+    deleted_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_mensajes_fecha_utc ON mensajes (fecha_utc, id);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_lock = threading.Lock()
+
+def is_enabled() -> bool:
+    return bool(LOCAL_MIRROR_PATH)
+
+def normalize_timestamp(value: str) -> str:
+    """
+    Normaliza un timestamp ISO a UTC sin zona con microsegundos, para que las
+    comparaciones de texto en SQLite respeten el orden cronológico.
+    Los timestamps sin zona se interpretan como UTC (igual que PostgreSQL en Supabase).
+    """
+    if not value:
+        return value
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+def _connect(path: str = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or LOCAL_MIRROR_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    return conn
+
+def _get_state(conn, key: str) -> str:
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+def _set_state(conn, key: str, value):
+    conn.execute(
+        "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, None if value is None else str(value))
+    )
+
+def _upsert_rows(conn, rows: list):
+    records = [
+        {
+            **{column: row.get(column) for column in MIRROR_COLUMNS},
+            "es_imagen": 1 if row.get("es_imagen") else 0,
+            "embedding": _embedding_to_text(row.get("embedding")),
+            "fecha_utc": normalize_timestamp(row["fecha_hora"])
+        }
+        for row in rows
+    ]
+    conn.executemany(
+        """
+        INSERT INTO mensajes (id, grupo_id, fecha_hora, fecha_utc, remitente, contenido_texto,
+                              es_imagen, url_storage, embedding, whatsapp_message_id, deleted_at)
+        VALUES (:id, :grupo_id, :fecha_hora, :fecha_utc, :remitente, :contenido_texto,
+                :es_imagen, :url_storage, :embedding, :whatsapp_message_id, :deleted_at)
+        ON CONFLICT(id) DO UPDATE SET
+            grupo_id = excluded.grupo_id,
+            fecha_hora = excluded.fecha_hora,
+            fecha_utc = excluded.fecha_utc,
+            remitente = excluded.remitente,
+            contenido_texto = excluded.contenido_texto,
+            es_imagen = excluded.es_imagen,
+            url_storage = excluded.url_storage,
+            embedding = COALESCE(excluded.embedding, mensajes.embedding),
+            whatsapp_message_id = excluded.whatsapp_message_id,
+            deleted_at = excluded.deleted_at
+        """,
+        records
+    )
+    # Índice TAG → mensajes en la misma transacción que la ingesta
+    tag_index.index_messages(conn, records)
+
+def _embedding_to_text(embedding):
+    """PostgREST entrega vector como string; se acepta también una lista."""
+    if embedding is None or isinstance(embedding, str):
+        return embedding
+    return "[" + ",".join(str(v) for v in embedding) + "]"
+
+def _pages(fetch_page):
+    """
+    Recorre una consulta paginada por offset (max-rows de PostgREST).
+
+    Args:
+        fetch_page: Función (inicio, fin) -> filas de ese rango; la consulta debe tener orden estable
+    """
+    offset = 0
+    while True:
+        page = fetch_page(offset, offset + MIRROR_PAGE_SIZE - 1) or []
+        if page:
+            yield page
+        if len(page) < MIRROR_PAGE_SIZE:
+            break
+        offset += MIRROR_PAGE_SIZE
+
+def _row_to_message(row: sqlite3.Row) -> dict:
+    message = {column: row[column] for column in MIRROR_COLUMNS if column != "deleted_at" and column in row.keys()}
+    message["es_imagen"] = bool(message["es_imagen"])
+    return message
+
+# ----------------------------------------------------
+# SINCRONIZACIÓN
+# ----------------------------------------------------
+
+def sync(supabase, path: str = None) -> dict:
+    """
+    Sincroniza el espejo local con Supabase en cuatro pasos:
+        1. Filas nuevas desde el watermark (fecha_hora, id)
+        2. Tombstones: filas marcadas con deleted_at desde la última sincronización
+        3. Ediciones y rezagadas: filas recientes cuyo contenido cambió en Supabase o que
+           se insertaron con un fecha_hora anterior al watermark
+        4. Embeddings tardíos: filas recientes que estaban sin embedding
+
+    Returns:
+        Dict con contadores {nuevos, eliminados, editados, rezagados, embeddings}
+    """
+    stats = {"nuevos": 0, "eliminados": 0, "editados": 0, "rezagados": 0, "embeddings": 0}
+
+    with _lock:
+        conn = _connect(path)
+        try:
+            tag_index.ensure_index(conn)
+            synced_at = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+            # 1. Filas nuevas (paginación por offset sobre orden estable fecha_hora, id)
+            watermark_fecha = _get_state(conn, "watermark_fecha")
+            watermark_id = int(_get_state(conn, "watermark_id") or 0)
+            since = watermark_fecha or (datetime.utcnow() - timedelta(days=MIRROR_INITIAL_DAYS)).isoformat()
+
+            offset = 0
+            while True:
+                page = supabase.from_('mensajes_analisis').select(
+                    ", ".join(embedding_column() if column == "embedding" else column for column in MIRROR_COLUMNS)
+                ).gte('fecha_hora', since).order('fecha_hora', desc=False).order('id', desc=False).range(
+                    offset, offset + MIRROR_PAGE_SIZE - 1
+                ).execute().data or []
+
+                if not page:
+                    break
+
+                fresh = [
+                    row for row in page
+                    if not watermark_fecha
+                    or normalize_timestamp(row['fecha_hora']) > watermark_fecha
+                    or (normalize_timestamp(row['fecha_hora']) == watermark_fecha and row['id'] > watermark_id)
+                ]
+                _upsert_rows(conn, fresh)
+                stats["nuevos"] += len(fresh)
+
+                last = page[-1]
+                _set_state(conn, "watermark_fecha", normalize_timestamp(last['fecha_hora']))
+                _set_state(conn, "watermark_id", last['id'])
+                conn.commit()
+
+                if len(page) < MIRROR_PAGE_SIZE:
+                    break
+                offset += MIRROR_PAGE_SIZE
+
+            # 2. Tombstones desde la última sincronización
+            last_sync = _get_state(conn, "last_sync")
+            if last_sync:
+                for deleted in _pages(lambda first, last: supabase.from_('mensajes_analisis').select(
+                    'id, deleted_at'
+                ).gte('deleted_at', last_sync).order('deleted_at', desc=False).order('id', desc=False).range(
+                    first, last
+                ).execute().data):
+                    conn.executemany(
+                        "UPDATE mensajes SET deleted_at = :deleted_at WHERE id = :id",
+                        deleted
+                    )
+                    stats["eliminados"] += len(deleted)
+
+            # 3. Ediciones de texto/adjuntos y filas que faltan en el espejo (dentro del horizonte de refresco)
+            refresh_from = (datetime.utcnow() - timedelta(days=MIRROR_REFRESH_DAYS)).strftime("%Y-%m-%dT%H:%M:%S.%f")
+            edit_columns = [column for column in MIRROR_COLUMNS if column != "embedding"]
+            for page in _pages(lambda first, last: supabase.from_('mensajes_analisis').select(
+                ", ".join(edit_columns)
+            ).gte('fecha_hora', refresh_from).order('fecha_hora', desc=False).order('id', desc=False).range(
+                first, last
+            ).execute().data):
+                local = {
+                    row["id"]: row for row in conn.execute(
+                        f"SELECT {', '.join(edit_columns)} FROM mensajes WHERE id IN ({', '.join('?' * len(page))})",
+                        [row['id'] for row in page]
+                    )
+                }
+                missing = [row for row in page if row['id'] not in local]
+                edited = [
+                    row for row in page
+                    if row['id'] in local and any(
+                        (1 if row.get(column) else 0) != local[row['id']][column] if column == "es_imagen"
+                        else row.get(column) != local[row['id']][column]
+                        for column in edit_columns
+                    )
+                ]
+                # El embedding no se selecciona: el upsert conserva el local (COALESCE) y las
+                # filas rezagadas quedan sin embedding hasta el paso 4
+                _upsert_rows(conn, edited + missing)
+                stats["editados"] += len(edited)
+                stats["rezagados"] += len(missing)
+
+            # 4. Embeddings que llegaron después de sincronizar la fila
+            pending_ids = [
+                row["id"] for row in conn.execute(
+                    "SELECT id FROM mensajes WHERE embedding IS NULL AND deleted_at IS NULL AND fecha_utc >= ?",
+                    (refresh_from,)
+                )
+            ]
+            for i in range(0, len(pending_ids), 200):
+                chunk = pending_ids[i:i + 200]
+                updated = supabase.from_('mensajes_analisis').select(
+                    f'id, {embedding_column()}'
+                ).in_('id', chunk).not_.is_('embedding', 'null').execute().data or []
+                conn.executemany(
+                    "UPDATE mensajes SET embedding = ? WHERE id = ?",
+                    [(_embedding_to_text(row['embedding']), row['id']) for row in updated]
+                )
+                stats["embeddings"] += len(updated)
+
+            _set_state(conn, "last_sync", synced_at)
+            conn.commit()
+        finally:
+            conn.close()
+
+    print(f"   🪞 Espejo local sincronizado: +{stats['nuevos']} nuevos, "
+          f"{stats['eliminados']} eliminados, {stats['editados']} editados, {stats['rezagados']} rezagados, "
+          f"{stats['embeddings']} embeddings tardíos")
+    return stats
+
+# ----------------------------------------------------
+# CONSULTA LOCAL
+# ----------------------------------------------------
+
+def get_messages(start: str, end: str = None, limit: int = None, path: str = None,
+                 embeddings: bool = True) -> list:
+    """
+    Mensajes de una ventana servidos desde el espejo local, con los mismos filtros
+    que la consulta remota (sin eliminados, con embedding, orden cronológico).
+
+    Args:
+        start: Inicio de la ventana (ISO)
+        end: Fin de la ventana (ISO, opcional)
+        limit: Máximo de mensajes (opcional)
+        embeddings: Incluir el embedding de cada mensaje
+    """
+    columns = "*" if embeddings else ", ".join(c for c in MIRROR_COLUMNS if c not in ("embedding", "deleted_at"))
+    query = f"SELECT {columns} FROM mensajes WHERE deleted_at IS NULL AND embedding IS NOT NULL AND fecha_utc >= ?"
+    params = [normalize_timestamp(start)]
+
+    if end:
+        query += " AND fecha_utc <= ?"
+        params.append(normalize_timestamp(end))
+
+    query += " ORDER BY fecha_utc, id"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    conn = _connect(path)
+    try:
+        return [_row_to_message(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+def get_group_stats(start: str, end: str = None, path: str = None) -> list:
+    """
+    Estadísticas por grupo de una ventana, con el mismo formato que la función
+    SQL get_group_stats (setup_group_stats.sql).
+
+    Returns:
+        Lista de dicts {grupo_id, mensajes, primer_mensaje, ultimo_mensaje, remitentes, adjuntos, imagenes}
+        (primer_mensaje/ultimo_mensaje con el fecha_hora original, como la función remota)
+    """
+    window = "deleted_at IS NULL AND embedding IS NOT NULL AND fecha_utc >= ?"
+    params = [normalize_timestamp(start)]
+
+    if end:
+        window += " AND fecha_utc <= ?"
+        params.append(normalize_timestamp(end))
+
+    query = f"""
+        WITH ventana AS (SELECT * FROM mensajes WHERE {window})
+        SELECT grupo_id, COUNT(*) AS mensajes,
+               (SELECT v.fecha_hora FROM ventana v WHERE v.grupo_id IS g.grupo_id
+                ORDER BY v.fecha_utc, v.id LIMIT 1) AS primer_mensaje,
+               (SELECT v.fecha_hora FROM ventana v WHERE v.grupo_id IS g.grupo_id
+                ORDER BY v.fecha_utc DESC, v.id DESC LIMIT 1) AS ultimo_mensaje,
+               COUNT(DISTINCT remitente) AS remitentes,
+               SUM(COALESCE(url_storage, '') <> '') AS adjuntos, SUM(COALESCE(es_imagen, 0)) AS imagenes
+        FROM ventana g
+        GROUP BY grupo_id ORDER BY grupo_id
+    """
+
+    conn = _connect(path)
+    try:
+        return [dict(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
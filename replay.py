@@ -0,0 +1,243 @@
+"""
+Grabación y Reproducción de Ejecuciones del Reporte
+Minera Centinela - GSdSO
+Captura mensajes, llamadas a LLM y embeddings en un bundle para reproducir sin red
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+# Modos (excluyentes): grabar la ejecución actual o reproducir un bundle existente
+REPORT_RECORD_PATH = os.environ.get("REPORT_RECORD_PATH")  # ej: /tmp/run_2025-12-09.json.gz
+REPORT_REPLAY_PATH = os.environ.get("REPORT_REPLAY_PATH")
+# Incluir la columna embedding de los mensajes (es la mayor parte del bundle)
+REPLAY_BUNDLE_EMBEDDINGS = os.environ.get("REPLAY_BUNDLE_EMBEDDINGS", "true").lower() == "true"
+
+BUNDLE_VERSION = 1
+
+_lock = threading.Lock()
+_state = {
+    "mode": None,          # None | "record" | "replay"
+    "path": None,
+    "clock": None,         # Instante fijo de la ejecución (ISO con offset UTC del host que grabó)
+    "messages": None,
+    "llm": {},             # hash de request -> [respuestas]
+    "embeddings": {},      # hash de request -> [vectores]
+    "values": {},          # nombre -> valor calculado con estado local (ej: tendencias)
+    "cursors": {}
+}
+
+def start(record_path: str = None, replay_path: str = None) -> str:
+    """
+    Activa el modo grabación o reproducción para la ejecución actual.
+
+    Returns:
+        Modo activo ("record", "replay") o None
+    """
+    record_path = record_path or REPORT_RECORD_PATH
+    replay_path = replay_path or REPORT_REPLAY_PATH
+
+    with _lock:
+        _state.update(mode=None, path=None, clock=None, messages=None, llm={}, embeddings={}, values={}, cursors={})
+
+        if replay_path:
+            with gzip.open(replay_path, "rt", encoding="utf-8") as f:
+                bundle = json.load(f)
+            _state.update(
+                mode="replay",
+                path=replay_path,
+                clock=bundle["clock"],
+                messages=bundle["messages"],
+                llm=bundle.get("llm", {}),
+                embeddings=bundle.get("embeddings", {}),
+                values=bundle.get("values", {})
+            )
+            print(f"▶️ Modo replay: {replay_path} ({len(bundle['messages'])} mensajes, "
+                  f"{sum(len(v) for v in _state['llm'].values())} llamadas LLM)")
+        elif record_path:
+            _state.update(mode="record", path=record_path,
+                          clock=datetime.now(timezone.utc).astimezone().isoformat(timespec="seconds"))
+            print(f"⏺️ Modo grabación: {record_path}")
+
+    return _state["mode"]
+
+def is_replaying() -> bool:
+    return _state["mode"] == "replay"
+
+def is_recording() -> bool:
+    return _state["mode"] == "record"
+
+def _clock() -> datetime:
+    """
+    Instante grabado con su offset. Los bundles anteriores guardaban la hora local
+    sin offset; se interpretan en la zona horaria del host actual.
+    """
+    clock = datetime.fromisoformat(_state["clock"])
+    return clock if clock.tzinfo else clock.astimezone()
+
+def now() -> datetime:
+    """
+    Hora local de la ejecución (naive, como datetime.now()). En grabación/replay
+    queda fija para que los artefactos (encabezados, nombres de archivo, fecha de
+    generación) sean reproducibles: es la hora local del host que grabó.
+    """
+    if _state["clock"]:
+        return _clock().replace(tzinfo=None)
+    return datetime.now()
+
+def utcnow() -> datetime:
+    """
+    Hora UTC de la ejecución (naive, como datetime.utcnow()), derivada del instante
+    grabado y no de la hora local: coincide con una ejecución normal en cualquier zona.
+    """
+    if _state["clock"]:
+        return _clock().astimezone(timezone.utc).replace(tzinfo=None)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def request_key(kind: str, **params) -> str:
+    """Hash estable de un request (modelo, parámetros y prompt)."""
+    payload = json.dumps({"kind": kind, **params}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+# ----------------------------------------------------
+# MENSAJES
+# ----------------------------------------------------
+
+def record_messages(messages: list):
+    if is_recording():
+        if not REPLAY_BUNDLE_EMBEDDINGS:
+            messages = [{k: v for k, v in msg.items() if k != "embedding"} for msg in messages]
+        with _lock:
+            _state["messages"] = messages
+
+def replay_messages() -> list:
+    return list(_state["messages"] or [])
+
+# ----------------------------------------------------
+# LLM Y EMBEDDINGS
+# ----------------------------------------------------
+
+def _next(store: str, key: str):
+    with _lock:
+        entries = _state[store].get(key)
+        if not entries:
+            raise KeyError(f"Request {key} no está en el bundle {_state['path']}")
+        cursor = _state["cursors"].get((store, key), 0)
+        _state["cursors"][(store, key)] = cursor + 1
+        return entries[min(cursor, len(entries) - 1)]
+
+def _append(store: str, key: str, value):
+    with _lock:
+        _state[store].setdefault(key, []).append(value)
+
+def replay_claude(key: str):
+    """Respuesta grabada con la misma forma que anthropic (content[0].text, usage, model)."""
+    data = _next("llm", key)
+    return SimpleNamespace(
+        content=[SimpleNamespace(type="text", text=data["text"])],
+        model=data["model"],
+        stop_reason=data.get("stop_reason"),
+        usage=SimpleNamespace(input_tokens=data["input_tokens"], output_tokens=data["output_tokens"])
+    )
+
+def record_claude(key: str, response):
+    if not is_recording():
+        return
+    usage = getattr(response, "usage", None)
+    _append("llm", key, {
+        "text": response.content[0].text,
+        "model": getattr(response, "model", None),
+        "stop_reason": getattr(response, "stop_reason", None),
+        "input_tokens": getattr(usage, "input_tokens", 0),
+        "output_tokens": getattr(usage, "output_tokens", 0)
+    })
+
+def replay_openai_chat(key: str):
+    """Respuesta grabada con la forma de openai chat.completions (choices[0].message.content)."""
+    data = _next("llm", key)
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=data["text"]))])
+
+def record_openai_chat(key: str, response):
+    if is_recording():
+        _append("llm", key, {"text": response.choices[0].message.content})
+
+def create_embedding(client, input, model: str = "text-embedding-3-small") -> list:
+    """
+    Genera embeddings (uno por texto) pasando por el bundle de grabación/replay.
+
+    Returns:
+        Lista de vectores en el mismo orden que input
+    """
+    key = request_key("embedding", model=model, input=input)
+
+    if is_replaying():
+        return _next("embeddings", key)
+
+    response = client.embeddings.create(input=input, model=model)
+    vectors = [item.embedding for item in response.data]
+
+    if is_recording():
+        _append("embeddings", key, vectors)
+
+    return vectors
+
+def memo(name: str, compute):
+    """
+    Valor que depende de estado local fuera del bundle (bases SQLite, historial).
+    En replay se toma del bundle; en grabación se calcula y se guarda.
+
+    Args:
+        name: Nombre único del valor en la ejecución
+        compute: Función sin argumentos que calcula el valor (serializable a JSON)
+    """
+    if is_replaying():
+        if name not in _state["values"]:
+            raise KeyError(f"Valor '{name}' no está en el bundle {_state['path']}")
+        return _state["values"][name]
+
+    value = compute()
+    if is_recording():
+        with _lock:
+            _state["values"][name] = value
+    return value
+
+# ----------------------------------------------------
+# BUNDLE
+# ----------------------------------------------------
+
+def save(path: str = None) -> str:
+    """
+    Escribe el bundle grabado (JSON comprimido con gzip, sin timestamp en el header).
+
+    Returns:
+        Path del bundle o None si no se está grabando
+    """
+    if not is_recording():
+        return None
+
+    path = path or _state["path"]
+    bundle = {
+        "version": BUNDLE_VERSION,
+        "clock": _state["clock"],
+        "messages": _state["messages"] or [],
+        "llm": _state["llm"],
+        "embeddings": _state["embeddings"],
+        "values": _state["values"]
+    }
+
+    payload = json.dumps(bundle, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    with open(path, "wb") as f:
+        f.write(gzip.compress(payload.encode("utf-8"), mtime=0))
+
+    print(f"💾 Bundle grabado: {path} ({os.path.getsize(path):,} bytes)")
+    return path
+
+def stop():
+    """Desactiva grabación/reproducción (la hora vuelve a ser la real)."""
+    with _lock:
+        _state.update(mode=None, path=None, clock=None, messages=None, llm={}, embeddings={}, values={}, cursors={})
@@ -0,0 +1,213 @@
+"""
+Tablas del Reporte desde la Extracción Estructurada
+Minera Centinela - GSdSO
+Genera en local las tablas Markdown de las secciones 2, 4 y 5 a partir del JSON de las
+pasadas; la síntesis solo deja el marcador de cada tabla y escribe el análisis narrativo
+"""
+
+import re
+
+NO_REPORTADO = "No reportado"
+
+# Fin del cuerpo de una subsección (siguiente encabezado o separador) y tablas Markdown dentro de él
+SUBSECTION_END = re.compile(r"^(?:#{1,3} |---\s*$)", re.MULTILINE)
+MARKDOWN_TABLE = re.compile(r"(?:^\|.*(?:\n|$))+", re.MULTILINE)
+TABLE_SEPARATOR = re.compile(r"^\|\s*:?-{3,}", re.MULTILINE)
+
+# Marcador → tabla. "columnas": [(encabezado, ruta del campo o tupla de rutas a unir)].
+# Las rutas con punto recorren objetos anidados; "tags" son columnas formateadas como `código`.
+REPORT_TABLES = {
+    "[[TABLA_QP]]": {
+        "seccion": "2", "subseccion": "### 2.1", "pasada": "pass.demoras", "clave": "quiebres_plan",
+        "columnas": [
+            ("QP Número", "qp_numero"), ("Área", "area"), ("Fecha/Hora", "fecha"), ("Equipo/TAG", "equipo"),
+            ("Horas Perdidas", "demora_horas"), ("Causa Raíz Específica", "razon"),
+            ("Impacto Cuantificado", "impacto"), ("Responsable", "responsable"),
+            ("Reportado por", "reportado_por"), ("Estado", "estado")
+        ],
+        "tags": ["Equipo/TAG"],
+        "vacio": "No se reportaron Quiebres de Plan formalizados en el período analizado."
+    },
+    "[[TABLA_DEMORAS]]": {
+        "seccion": "2", "subseccion": "### 2.2", "pasada": "pass.demoras", "clave": "demoras",
+        "columnas": [
+            ("Actividad Completa", "actividad"), ("Demora (horas)", "demora_horas"),
+            ("Causa Raíz Detallada", "causa"), ("Impacto Cuantificado", "impacto"),
+            ("Empresa/Responsable/Usuario", "responsable"), ("Fecha/Hora", "fecha")
+        ],
+        "vacio": "No se reportaron demoras operacionales en el período analizado."
+    },
+    "[[TABLA_INCIDENTES]]": {
+        "seccion": "4", "subseccion": "### 4.1", "pasada": "pass.seguridad", "clave": "incidentes",
+        "columnas": [
+            ("Fecha/Hora Exacta", ("fecha", "hora")), ("Tipo", "tipo"),
+            ("Descripción Técnica Detallada", "descripcion"), ("Afectado", "afectado"),
+            ("Empresa del Afectado", "empresa"), ("Reportado por", "reportado_por"),
+            ("Causa Raíz", "causa_raiz"), ("Acción Correctiva", "accion_correctiva"),
+            ("Días Perdidos", "dias_perdidos"), ("Estado", "estado")
+        ],
+        "vacio": "No se reportaron incidentes en el período analizado."
+    },
+    "[[TABLA_HALLAZGOS]]": {
+        "seccion": "4", "subseccion": "### 4.2", "pasada": "pass.seguridad", "clave": "hallazgos",
+        "columnas": [
+            ("Fecha/Hora", "fecha"), ("Descripción Específica del Hallazgo", "descripcion"),
+            ("Ubicación Exacta", "ubicacion"), ("Empresa Responsable Área", "empresa"),
+            ("Detectado/Reportado por", "detectado_por"), ("Severidad", "severidad"),
+            ("Riesgo Específico", "riesgo"), ("Acción Inmediata Tomada", "accion_inmediata"),
+            ("Estado Actual", "estado")
+        ],
+        "vacio": "No se reportaron hallazgos de seguridad en el período analizado."
+    },
+    "[[TABLA_COMPROMISOS]]": {
+        "seccion": "4", "subseccion": "### 4.3", "pasada": "pass.seguridad", "clave": "compromisos",
+        "columnas": [
+            ("Compromiso", "accion"), ("Responsable", "responsable"), ("Plazo Específico", "plazo"),
+            ("Origen del Compromiso", "origen"), ("Estado", "estado")
+        ],
+        "vacio": "No se reportaron compromisos pendientes en el período analizado."
+    },
+    "[[TABLA_PRODUCCION]]": {
+        "seccion": "5", "subseccion": "### 5.1", "pasada": "pass.produccion", "clave": "produccion",
+        "columnas": [
+            ("Equipo/TAG", "equipo"), ("Parámetro", "parametro"), ("Valor Real", "valor"), ("Unidad", "unidad"),
+            ("Fecha/Turno", ("fecha", "turno")), ("Observaciones Técnicas", "observaciones")
+        ],
+        # Columnas de target y desviación SOLO si algún target está explícito en los datos
+        "columnas_con_target": [
+            ("Equipo/TAG", "equipo"), ("Parámetro", "parametro"), ("Valor Real", "valor"),
+            ("Target Reportado", "target"), ("Desviación", "desviacion"), ("Unidad", "unidad"),
+            ("Fecha/Turno", ("fecha", "turno"))
+        ],
+        "target": "target",
+        "tags": ["Equipo/TAG"],
+        "vacio": "No se reportaron datos de producción en el período analizado."
+    },
+    "[[TABLA_DISPONIBILIDAD]]": {
+        "seccion": "5", "subseccion": "### 5.2", "pasada": "pass.produccion", "clave": "disponibilidad",
+        "columnas": [
+            ("Equipo/TAG", "equipo"), ("Tiempo Operativo (h)", "tiempo_operativo_h"),
+            ("Tiempo Detenido (h)", "tiempo_detenido_h"), ("Causa Principal Detención", "causas_detencion"),
+            ("Empresa Responsable", "empresa"), ("Reportado por", "reportado_por")
+        ],
+        "tags": ["Equipo/TAG"],
+        "vacio": "No se reportaron tiempos de operación o detención de equipos en el período analizado."
+    },
+}
+
+def _get_path(row: dict, path: str):
+    value = row
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def _is_empty(value) -> bool:
+    if value is None or value == [] or value == {}:
+        return True
+    return isinstance(value, str) and value.strip().lower() in ("", "no reportado", "null", "none", "n/a", "-")
+
+def _text(value) -> str:
+    """Valor de celda en texto plano (sin formato de tabla)."""
+    if _is_empty(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, list):
+        parts = [_text(item) for item in value]
+        return "; ".join(part for part in parts if part) or None
+    if isinstance(value, dict):
+        parts = [_text(item) for item in value.values()]
+        return ", ".join(part for part in parts if part) or None
+    return re.sub(r"\s+", " ", str(value)).strip()
+
+def _cell(row: dict, field, tag: bool = False) -> str:
+    paths = field if isinstance(field, tuple) else (field,)
+    parts = [_text(_get_path(row, path)) for path in paths]
+    text = " ".join(part for part in parts if part)
+    if not text:
+        return NO_REPORTADO
+    text = text.replace("|", "\\|")
+    return f"`{text.strip('`')}`" if tag else text
+
+def render_table(marker: str, analyses: dict) -> str:
+    """
+    Tabla Markdown de un marcador a partir de la extracción de su pasada.
+
+    Args:
+        marker: Marcador de REPORT_TABLES (ej: "[[TABLA_QP]]")
+        analyses: Extracción por pasada
+
+    Returns:
+        Tabla Markdown, o el texto de "sin datos" de la tabla
+    """
+    table = REPORT_TABLES[marker]
+    rows = ((analyses or {}).get(table["pasada"]) or {}).get(table["clave"])
+    rows = [row for row in rows if isinstance(row, dict)] if isinstance(rows, list) else []
+    if not rows:
+        return table["vacio"]
+
+    columns = table["columnas"]
+    if table.get("target") and any(not _is_empty(row.get(table["target"])) for row in rows):
+        columns = table["columnas_con_target"]
+    tags = table.get("tags", [])
+
+    lines = [
+        "| " + " | ".join(header for header, _ in columns) + " |",
+        "|" + "|".join("---" for _ in columns) + "|"
+    ]
+    for row in rows:
+        lines.append("| " + " | ".join(_cell(row, field, header in tags) for header, field in columns) + " |")
+    return "\n".join(lines)
+
+def _replace_table_under(report: str, heading_end: int, rendered: str) -> tuple:
+    """
+    Reemplaza la primera tabla Markdown del cuerpo de la subsección que comienza en
+    heading_end. Returns: (reporte, True si había una tabla que reemplazar).
+    """
+    end = SUBSECTION_END.search(report, heading_end + 1)
+    body_end = end.start() if end else len(report)
+    body = report[heading_end:body_end]
+    table = next((m for m in MARKDOWN_TABLE.finditer(body) if TABLE_SEPARATOR.search(m.group())), None)
+    if not table:
+        return report, False
+    trailing = "\n" if table.group().endswith("\n") else ""
+    body = body[:table.start()] + rendered + trailing + body[table.end():]
+    return report[:heading_end] + body + report[body_end:], True
+
+def insert_tables(report: str, analyses: dict, sections: list = None) -> str:
+    """
+    Reemplaza los marcadores de tabla por las tablas generadas desde la extracción.
+    Si la síntesis omitió un marcador, la tabla reemplaza la que la síntesis haya
+    escrito bajo el encabezado de su subsección (ej: "### 2.1"), o se inserta
+    bajo el encabezado si no hay ninguna.
+
+    Args:
+        report: Reporte (o sección) en Markdown
+        analyses: Extracción por pasada
+        sections: Secciones a completar (por defecto todas)
+    """
+    if not report:
+        return report
+
+    for marker, table in REPORT_TABLES.items():
+        if sections is not None and table["seccion"] not in sections:
+            continue
+        rendered = render_table(marker, analyses)
+        if marker in report:
+            report = report.replace(marker, rendered)
+            continue
+
+        heading = re.search(rf"^{re.escape(table['subseccion'])}\b.*$", report, flags=re.MULTILINE)
+        if heading:
+            report, replaced = _replace_table_under(report, heading.end(), rendered)
+            if replaced:
+                print(f"   ⚠️ Tabla {marker} sin marcador: se reemplazó la tabla escrita por la síntesis en "
+                      f"{table['subseccion']}")
+                continue
+            rest = report[heading.end():].lstrip("\n")
+            report = f"{report[:heading.end()]}\n\n{rendered}\n\n{rest}"
+        else:
+            print(f"   ⚠️ Tabla {marker} sin marcador ni subsección {table['subseccion']} en el reporte")
+    return report
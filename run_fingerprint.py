@@ -0,0 +1,150 @@
+"""
+Huella de Ejecución para Evitar Regenerar Reportes sin Cambios
+Minera Centinela - GSdSO
+Hash del conjunto de mensajes (ids, contenido y estado), prompts, código, modelos y configuración.
+Si una ejecución anterior con la misma huella terminó bien, se reutilizan sus artefactos
+"""
+
+import glob
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import advanced_analysis
+import hierarchical_summary
+from llm_gateway import MODEL_ROUTES
+
+# Activar/desactivar la reutilización de ejecuciones con la misma huella
+SKIP_UNCHANGED_RUNS = os.environ.get("SKIP_UNCHANGED_RUNS", "true").lower() == "true"
+# Carpeta del bucket de reportes donde se registra cada ejecución exitosa
+FINGERPRINT_FOLDER = "ejecuciones"
+
+def _text_hash(value) -> str:
+    return hashlib.sha1(str(value or "").encode("utf-8")).hexdigest()[:16]
+
+def prompt_version() -> str:
+    """Hash de todos los prompts que intervienen en el reporte."""
+    prompts = {
+        f"{module.__name__}.{name}": value
+        for module in (advanced_analysis, hierarchical_summary)
+        for name, value in sorted(vars(module).items())
+        if name.startswith("PROMPT_") and isinstance(value, str)
+    }
+    return _text_hash(json.dumps(prompts, sort_keys=True, ensure_ascii=False))
+
+def code_version() -> str:
+    """
+    Hash del código fuente del pipeline (todos los .py del proyecto). Cubre los
+    prompts definidos en línea, como el del reporte estándar en app.py, y cualquier
+    cambio de formato o de lógica que altere el reporte.
+    """
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+        digest.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def compute_fingerprint(messages: list, config: dict) -> str:
+    """
+    Huella de una ejecución.
+
+    Cada mensaje aporta su id, un hash del texto (ediciones), adjunto, si tiene
+    embedding y, si vienen en la consulta, sus marcas de edición/eliminación.
+    Se agregan la versión de los prompts, la del código, los modelos por etapa y la configuración.
+
+    Args:
+        messages: Mensajes de la ventana
+        config: Parámetros que cambian el resultado (ventana, modo, límites, formato del contexto)
+
+    Returns:
+        Hash hexadecimal de 32 caracteres
+    """
+    rows = sorted(
+        (
+            msg.get('id'),
+            _text_hash(msg.get('contenido_texto')),
+            msg.get('url_storage') or "",
+            bool(msg.get('es_imagen')),
+            msg.get('embedding') is not None,
+            str(msg.get('updated_at') or ""),
+            str(msg.get('deleted_at') or "")
+        )
+        for msg in messages
+    )
+    payload = json.dumps({
+        "mensajes": rows,
+        "prompts": prompt_version(),
+        "codigo": code_version(),
+        "modelos": MODEL_ROUTES,
+        "config": config
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def find_previous_run(bucket, fingerprint: str) -> dict:
+    """
+    Registro de una ejecución exitosa anterior con la misma huella.
+
+    Args:
+        bucket: Cliente del bucket de reportes (supabase.storage.from_("reportes"))
+
+    Returns:
+        Dict {fingerprint, run_id, generado, local_path, urls} o None. local_path es
+        el archivo del contenedor que grabó; usar restore_markdown para la copia local.
+    """
+    try:
+        return json.loads(bucket.download(f"{FINGERPRINT_FOLDER}/{fingerprint}.json"))
+    except Exception:
+        return None
+
+def record_run(bucket, fingerprint: str, run_id: str, local_path: str, urls: dict):
+    """Registra la ejecución exitosa para que un reintento con la misma huella la reutilice."""
+    record = {
+        "fingerprint": fingerprint,
+        "run_id": run_id,
+        "generado": datetime.now().isoformat(timespec="seconds"),
+        "local_path": local_path,
+        "urls": urls
+    }
+    try:
+        bucket.upload(
+            path=f"{FINGERPRINT_FOLDER}/{fingerprint}.json",
+            file=json.dumps(record, ensure_ascii=False).encode("utf-8"),
+            file_options={"content-type": "application/json", "upsert": "true"}
+        )
+    except Exception as e:
+        print(f"   ⚠️ No se pudo registrar la huella de la ejecución: {e}")
+
+def _object_path(url: str, bucket_name: str) -> str:
+    """Ruta del objeto dentro del bucket a partir de su URL pública."""
+    marker = f"/object/public/{bucket_name}/"
+    if not url or marker not in url:
+        return None
+    return url.split(marker, 1)[1].split("?", 1)[0]
+
+def restore_markdown(bucket, previous: dict, output_dir: str = "/tmp", bucket_name: str = "reportes") -> str:
+    """
+    Copia local del Markdown de la ejecución reutilizada, descargado del bucket
+    (el local_path registrado pertenece al contenedor que la generó).
+
+    Returns:
+        Path local del Markdown, la URL pública si no se pudo descargar, o None
+    """
+    url = (previous.get("urls") or {}).get("md")
+    object_path = _object_path(url, bucket_name)
+    if not object_path:
+        return url
+    try:
+        content = bucket.download(object_path)
+        filename = os.path.basename(object_path)
+        if filename.endswith(".gz"):
+            content, filename = gzip.decompress(content), filename[:-3]
+        local_path = os.path.join(output_dir, filename)
+        with open(local_path, "wb") as f:
+            f.write(content)
+        return local_path
+    except Exception as e:
+        print(f"   ⚠️ No se pudo descargar el Markdown reutilizado: {e}")
+        return url
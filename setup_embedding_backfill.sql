@@ -0,0 +1,32 @@
+-- ----------------------------------------------------
+-- Actualización masiva de embeddings pendientes
+-- Minera Centinela - GSdSO
+--
+-- Ejecutar en Supabase → SQL Editor. Usada por embedding_backfill.py para
+-- escribir un lote completo de vectores en un solo round-trip. Solo completa
+-- filas que siguen sin embedding (no pisa vectores generados por la ingesta).
+-- ----------------------------------------------------
+
+CREATE OR REPLACE FUNCTION update_embeddings(updates JSONB)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH datos AS (
+        SELECT (item->>'id')::BIGINT AS id, (item->>'embedding')::vector AS embedding
+        FROM jsonb_array_elements(updates) AS item
+    ),
+    actualizados AS (
+        UPDATE mensajes_analisis m
+        SET embedding = datos.embedding
+        FROM datos
+        WHERE m.id = datos.id
+          AND m.embedding IS NULL
+        RETURNING m.id
+    )
+    SELECT COUNT(*)::INTEGER FROM actualizados;
+$$;
+
+-- Índice parcial para encontrar rápido las filas pendientes
+CREATE INDEX IF NOT EXISTS idx_mensajes_analisis_sin_embedding
+    ON mensajes_analisis (fecha_hora, id)
+    WHERE embedding IS NULL AND deleted_at IS NULL;
@@ -0,0 +1,136 @@
+-- ----------------------------------------------------
+-- Tablas de resultados de extracción (pasadas del análisis avanzado)
+-- Minera Centinela - GSdSO
+--
+-- Ejecutar en Supabase → SQL Editor. Cada fila guarda:
+--   row_key      clave de upsert (hash de las columnas de identidad y TAGs de la fila; ordinal si se repite en la ejecución)
+--   run_id       ejecución del reporte que la generó (tracing.get_run_id)
+--   mensaje_ids  mensajes de origen (reconstruidos por TAG)
+--   grupo_ids    grupos de WhatsApp de origen; grupo_id = grupo principal
+--   datos        fila completa devuelta por el modelo
+-- ----------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS extraccion_quiebres_plan (
+    id BIGSERIAL PRIMARY KEY,
+    row_key TEXT NOT NULL UNIQUE,
+    run_id TEXT NOT NULL,
+    periodo TEXT,
+    categoria TEXT,
+    mensaje_ids BIGINT[] DEFAULT '{}',
+    grupo_ids INTEGER[] DEFAULT '{}',
+    grupo_id INTEGER,
+    qp_numero TEXT,
+    fecha TEXT,
+    area TEXT,
+    equipo TEXT,
+    demora_horas NUMERIC,
+    razon TEXT,
+    datos JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS extraccion_demoras (
+    id BIGSERIAL PRIMARY KEY,
+    row_key TEXT NOT NULL UNIQUE,
+    run_id TEXT NOT NULL,
+    periodo TEXT,
+    categoria TEXT,
+    mensaje_ids BIGINT[] DEFAULT '{}',
+    grupo_ids INTEGER[] DEFAULT '{}',
+    grupo_id INTEGER,
+    actividad TEXT,
+    fecha TEXT,
+    demora_horas NUMERIC,
+    causa TEXT,
+    responsable TEXT,
+    datos JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS extraccion_actividades (
+    id BIGSERIAL PRIMARY KEY,
+    row_key TEXT NOT NULL UNIQUE,
+    run_id TEXT NOT NULL,
+    periodo TEXT,
+    categoria TEXT,
+    mensaje_ids BIGINT[] DEFAULT '{}',
+    grupo_ids INTEGER[] DEFAULT '{}',
+    grupo_id INTEGER,
+    tipo TEXT,
+    descripcion TEXT,
+    equipo TEXT,
+    area TEXT,
+    empresa TEXT,
+    demora_horas NUMERIC,
+    estado TEXT,
+    datos JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS extraccion_incidentes (
+    id BIGSERIAL PRIMARY KEY,
+    row_key TEXT NOT NULL UNIQUE,
+    run_id TEXT NOT NULL,
+    periodo TEXT,
+    categoria TEXT,
+    mensaje_ids BIGINT[] DEFAULT '{}',
+    grupo_ids INTEGER[] DEFAULT '{}',
+    grupo_id INTEGER,
+    fecha TEXT,
+    tipo TEXT,
+    descripcion TEXT,
+    empresa TEXT,
+    dias_perdidos NUMERIC,
+    datos JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS extraccion_hallazgos (
+    id BIGSERIAL PRIMARY KEY,
+    row_key TEXT NOT NULL UNIQUE,
+    run_id TEXT NOT NULL,
+    periodo TEXT,
+    categoria TEXT,
+    mensaje_ids BIGINT[] DEFAULT '{}',
+    grupo_ids INTEGER[] DEFAULT '{}',
+    grupo_id INTEGER,
+    fecha TEXT,
+    tipo TEXT,
+    descripcion TEXT,
+    ubicacion TEXT,
+    severidad TEXT,
+    estado TEXT,
+    datos JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- produccion, parametros_proceso, disponibilidad y consumos (columna categoria)
+CREATE TABLE IF NOT EXISTS extraccion_kpis (
+    id BIGSERIAL PRIMARY KEY,
+    row_key TEXT NOT NULL UNIQUE,
+    run_id TEXT NOT NULL,
+    periodo TEXT,
+    categoria TEXT,
+    mensaje_ids BIGINT[] DEFAULT '{}',
+    grupo_ids INTEGER[] DEFAULT '{}',
+    grupo_id INTEGER,
+    equipo TEXT,
+    parametro TEXT,
+    valor TEXT,
+    unidad TEXT,
+    fecha TEXT,
+    datos JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Índices para dashboards (por ejecución, equipo y grupo)
+CREATE INDEX IF NOT EXISTS idx_extraccion_quiebres_plan_run ON extraccion_quiebres_plan (run_id);
+CREATE INDEX IF NOT EXISTS idx_extraccion_quiebres_plan_equipo ON extraccion_quiebres_plan (equipo);
+CREATE INDEX IF NOT EXISTS idx_extraccion_demoras_run ON extraccion_demoras (run_id);
+CREATE INDEX IF NOT EXISTS idx_extraccion_actividades_run ON extraccion_actividades (run_id);
+CREATE INDEX IF NOT EXISTS idx_extraccion_actividades_equipo ON extraccion_actividades (equipo);
+CREATE INDEX IF NOT EXISTS idx_extraccion_actividades_grupo ON extraccion_actividades (grupo_id);
+CREATE INDEX IF NOT EXISTS idx_extraccion_incidentes_run ON extraccion_incidentes (run_id);
+CREATE INDEX IF NOT EXISTS idx_extraccion_hallazgos_run ON extraccion_hallazgos (run_id);
+CREATE INDEX IF NOT EXISTS idx_extraccion_kpis_run ON extraccion_kpis (run_id);
+CREATE INDEX IF NOT EXISTS idx_extraccion_kpis_equipo ON extraccion_kpis (equipo, parametro);
@@ -0,0 +1,44 @@
+-- ----------------------------------------------------
+-- Estadísticas por grupo de una ventana (una sola consulta)
+-- Minera Centinela - GSdSO
+--
+-- Ejecutar en Supabase → SQL Editor. Usada por app.get_group_stats para el
+-- resumen de actividad y la distribución por superintendencia sin descargar
+-- el contenido de los mensajes. Mismos filtros que la consulta de mensajes
+-- del reporte (sin eliminados, con embedding).
+-- ----------------------------------------------------
+
+CREATE OR REPLACE FUNCTION get_group_stats(
+    window_start TIMESTAMPTZ,
+    window_end TIMESTAMPTZ DEFAULT NULL
+)
+RETURNS TABLE (
+    grupo_id INTEGER,
+    mensajes BIGINT,
+    primer_mensaje TIMESTAMPTZ,
+    ultimo_mensaje TIMESTAMPTZ,
+    remitentes BIGINT,
+    adjuntos BIGINT,
+    imagenes BIGINT
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT
+        m.grupo_id::INTEGER,
+        COUNT(*) AS mensajes,
+        MIN(m.fecha_hora) AS primer_mensaje,
+        MAX(m.fecha_hora) AS ultimo_mensaje,
+        COUNT(DISTINCT m.remitente) AS remitentes,
+        COUNT(*) FILTER (WHERE COALESCE(m.url_storage, '') <> '') AS adjuntos,
+        COUNT(*) FILTER (WHERE m.es_imagen) AS imagenes
+    FROM mensajes_analisis m
+    WHERE m.fecha_hora >= window_start
+      AND (window_end IS NULL OR m.fecha_hora <= window_end)
+      AND m.deleted_at IS NULL
+      AND m.embedding IS NOT NULL
+    GROUP BY m.grupo_id
+    ORDER BY m.grupo_id;
+$$;
+
+-- Índice de apoyo para el filtro por ventana
+CREATE INDEX IF NOT EXISTS idx_mensajes_analisis_fecha_grupo ON mensajes_analisis (fecha_hora, grupo_id);
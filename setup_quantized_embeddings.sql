@@ -0,0 +1,53 @@
+-- ----------------------------------------------------
+-- Embeddings cuantizados (int8 con escala por vector)
+-- Minera Centinela - GSdSO
+--
+-- Ejecutar en Supabase → SQL Editor. Agrega la columna embedding_q junto a
+-- embedding (que se mantiene intacta para match_messages) con el formato
+-- "i8:<escala>:<base64>" que decodifica embedding_codec.py: ~2 KB por fila en
+-- vez de ~18 KB de JSON. Un trigger la mantiene al insertar o actualizar el
+-- embedding. Se usa con EMBEDDING_TRANSFER=quantized.
+-- ----------------------------------------------------
+
+ALTER TABLE mensajes_analisis ADD COLUMN IF NOT EXISTS embedding_q TEXT;
+
+CREATE OR REPLACE FUNCTION quantize_embedding(v vector)
+RETURNS TEXT
+LANGUAGE sql IMMUTABLE
+AS $$
+    WITH valores AS (
+        SELECT x, i FROM unnest(v::real[]) WITH ORDINALITY AS t(x, i)
+    ),
+    escala AS (
+        SELECT NULLIF(MAX(ABS(x)), 0)::FLOAT8 / 127 AS s FROM valores
+    )
+    SELECT 'i8:' || COALESCE(escala.s, 0)::TEXT || ':' || replace(encode(decode(
+        string_agg(lpad(to_hex(COALESCE(round(x / escala.s)::INTEGER, 0) & 255), 2, '0'), '' ORDER BY i),
+        'hex'), 'base64'), E'\n', '')
+    FROM valores, escala
+    GROUP BY escala.s;
+$$;
+
+CREATE OR REPLACE FUNCTION set_embedding_q()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.embedding_q := quantize_embedding(NEW.embedding);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_embedding_q ON mensajes_analisis;
+CREATE TRIGGER trg_embedding_q
+    BEFORE INSERT OR UPDATE OF embedding ON mensajes_analisis
+    FOR EACH ROW EXECUTE FUNCTION set_embedding_q();
+
+-- Filas existentes: repetir hasta que no actualice filas
+UPDATE mensajes_analisis
+SET embedding_q = quantize_embedding(embedding)
+WHERE id IN (
+    SELECT id FROM mensajes_analisis
+    WHERE embedding IS NOT NULL AND embedding_q IS NULL
+    LIMIT 5000
+);
@@ -0,0 +1,186 @@
+"""
+Perfil de CPU y Memoria por Etapa
+Minera Centinela - GSdSO
+Con PROFILE_STAGES=true cada etapa de primer nivel del reporte (span sin padre) se mide con
+cProfile y tracemalloc; al terminar se escribe un informe de texto junto a los artefactos
+"""
+
+import cProfile
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import tracing
+
+# Activar el perfil por etapa (agrega overhead: solo para diagnóstico)
+PROFILE_STAGES = os.environ.get("PROFILE_STAGES", "false").lower() == "true"
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "15"))                 # Funciones y líneas por etapa
+PROFILE_TRACE_FRAMES = int(os.environ.get("PROFILE_TRACE_FRAMES", "1"))    # Profundidad de tracemalloc
+
+MB = 1024 * 1024
+
+_state = {"owner": None, "busy": False, "started_at": None, "stages": []}
+
+# ----------------------------------------------------
+# MEDICIÓN
+# ----------------------------------------------------
+
+def start():
+    """
+    Activa el perfil de la ejecución si PROFILE_STAGES está habilitado.
+
+    Returns:
+        True si quedó activo
+    """
+    if not PROFILE_STAGES:
+        return False
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(PROFILE_TRACE_FRAMES)
+    _state.update(owner=threading.get_ident(), busy=False, started_at=datetime.now(), stages=[])
+    tracing.set_stage_hook(_stage_or_skip)
+    print(f"🔬 Perfil por etapa activo (cProfile + tracemalloc, top {PROFILE_TOP_N})")
+    return True
+
+def _stage_or_skip(name: str):
+    """
+    cProfile mide un solo hilo: se perfilan las etapas del hilo que inició la
+    ejecución y de a una (las etapas en hilos de trabajo solo se cronometran).
+    """
+    if _state["busy"] or threading.get_ident() != _state["owner"]:
+        return nullcontext()
+    return _profile_stage(name)
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+
+@contextmanager
+def _profile_stage(name: str):
+    _state["busy"] = True
+    before = _snapshot()
+    current_before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    start_time = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start_time
+        current_after, peak = tracemalloc.get_traced_memory()
+        allocations = _snapshot().compare_to(before, "lineno")[:PROFILE_TOP_N]
+        _state["stages"].append({
+            "name": name,
+            "seconds": elapsed,
+            "memory_before": current_before,
+            "memory_after": current_after,
+            "peak": peak,
+            "functions": _top_functions(profiler),
+            "allocations": allocations
+        })
+        _state["busy"] = False
+
+def _short_path(path: str) -> str:
+    parts = path.replace("\\", "/").split("/")
+    return "/".join(parts[-2:]) if len(parts) > 1 else path
+
+def _top_functions(profiler: cProfile.Profile) -> list:
+    """Funciones con mayor tiempo acumulado: (acumulado, propio, llamadas, función)."""
+    profiler.create_stats()
+    rows = [
+        (cumulative, own, calls, f"{_short_path(filename)}:{line}({function})")
+        for (filename, line, function), (_, calls, own, cumulative, _) in profiler.stats.items()
+    ]
+    return sorted(rows, reverse=True)[:PROFILE_TOP_N]
+
+# ----------------------------------------------------
+# INFORME
+# ----------------------------------------------------
+
+def _max_rss_mb() -> float:
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024   # KB en Linux
+    except (ImportError, AttributeError):
+        return None
+
+def _format_report(run_id: str) -> str:
+    stages = _state["stages"]
+    rss = _max_rss_mb()
+    lines = [
+        f"PERFIL POR ETAPA - run {run_id}",
+        f"Inicio: {_state['started_at']:%d/%m/%Y %H:%M:%S}",
+        f"RSS máximo del proceso: {rss:,.1f} MB" if rss is not None else "RSS máximo del proceso: no disponible",
+        "cProfile mide el hilo principal: el trabajo en hilos (pasadas paralelas, subidas) aparece como espera;",
+        "tracemalloc cubre todos los hilos.",
+        "",
+        f"{'Etapa':<28}{'Tiempo (s)':>12}{'Δ Memoria (MB)':>16}{'Pico (MB)':>12}",
+    ]
+    for stage in stages:
+        lines.append(
+            f"{stage['name']:<28}{stage['seconds']:>12.3f}"
+            f"{(stage['memory_after'] - stage['memory_before']) / MB:>+16.2f}{stage['peak'] / MB:>12.2f}"
+        )
+
+    for stage in stages:
+        lines += [
+            "",
+            "=" * 90,
+            f"{stage['name']}: {stage['seconds']:.3f} s, memoria {stage['memory_before'] / MB:.2f} → "
+            f"{stage['memory_after'] / MB:.2f} MB (pico {stage['peak'] / MB:.2f} MB)",
+            "=" * 90,
+            "Funciones por tiempo acumulado:",
+            f"  {'Acum. (s)':>10}{'Propio (s)':>12}{'Llamadas':>10}  Función",
+        ]
+        for cumulative, own, calls, function in stage["functions"]:
+            lines.append(f"  {cumulative:>10.3f}{own:>12.3f}{calls:>10,}  {function}")
+
+        lines += ["", "Asignaciones retenidas al cierre (por línea):"]
+        allocations = [diff for diff in stage["allocations"] if diff.size_diff]
+        if not allocations:
+            lines.append("  (sin cambios)")
+        for diff in allocations:
+            frame = diff.traceback[0]
+            lines.append(
+                f"  {diff.size_diff / 1024:>+12,.1f} KB {diff.count_diff:>+9,} bloques  "
+                f"{_short_path(frame.filename)}:{frame.lineno}"
+            )
+    return "\n".join(lines) + "\n"
+
+def write_report(output_dir: str = "/tmp", run_id: str = None) -> str:
+    """
+    Escribe el informe de la ejecución y desactiva el perfil.
+
+    Args:
+        output_dir: Carpeta de los artefactos del reporte
+        run_id: Identificador de la ejecución (tracing.get_run_id() por defecto)
+
+    Returns:
+        Ruta del informe o None si el perfil no estaba activo o no se pudo escribir
+    """
+    if _state["owner"] is None:
+        return None
+    tracing.set_stage_hook(None)
+    run_id = run_id or tracing.get_run_id() or datetime.now().strftime("%Y%m%d%H%M%S")
+    report = _format_report(run_id)
+    _state.update(owner=None, stages=[])
+    tracemalloc.stop()
+
+    path = os.path.join(output_dir, f"perfil_etapas_{run_id}.txt")
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(report)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar el perfil por etapa: {e}")
+        return None
+    print(f"🔬 Perfil por etapa guardado: {path}")
+    return path
@@ -0,0 +1,253 @@
+"""
+Índice Invertido de TAGs de Equipos
+Minera Centinela - GSdSO
+TAG → mensajes, grupos y rango de fechas, construido al ingerir mensajes en el espejo local
+"""
+
+import argparse
+import re
+
+# Versión del extractor: al cambiar las reglas se reconstruye el índice completo
+TAG_INDEX_VERSION = "2"
+
+# TAGs con segmentos separados por guión: 762-ER-001, P-101, AND-SPS-502, LAT-110-A, UF-A
+TAG_PATTERN = re.compile(r"(?<![\w-])([A-Za-z0-9]{1,6}(?:-[A-Za-z0-9]{1,6}){1,3})(?![\w-])")
+
+# Segmento alfabético del equipo (ER, P, SPS, UF): sin él, el token es un número con unidad o una fecha
+EQUIPMENT_SEGMENT = re.compile(r"^[A-Za-z]{1,4}$")
+
+# Formas que nunca son TAG: fechas/horas ISO (2025-12-09T08:30) y rangos con unidad (2-3hrs, 120-130m3/h)
+NON_TAG_PATTERNS = [
+    re.compile(r"^\d{1,4}-\d{1,2}-\d{1,4}(?:T\d{1,2})?$", re.IGNORECASE),
+    re.compile(r"^\d+-\d+[A-Za-z]+\d*$"),
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tag_mensajes (
+    tag TEXT NOT NULL,
+    mensaje_id INTEGER NOT NULL,
+    grupo_id INTEGER,
+    fecha_utc TEXT,
+    PRIMARY KEY (tag, mensaje_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_tag_mensajes_id ON tag_mensajes (mensaje_id);
+"""
+
+def extract_tags(text: str) -> list:
+    """
+    Extrae los TAGs de equipos de un texto, normalizados a mayúsculas y sin repetir.
+
+    Se acepta un token con guiones si tiene un segmento alfabético de equipo y
+    combina letras y dígitos (P-101, 762-ER-001) o está escrito completamente en
+    mayúsculas (UF-A). Fechas y horas (09-12-2025, 2025-12-09T08:30), rangos con
+    unidad (2-3hrs, 7-19h) y palabras como COVID-19 quedan fuera. Los sufijos
+    descriptivos ("UF-A Moly") no forman parte del TAG.
+    """
+    tags = []
+    for match in TAG_PATTERN.finditer(text or ""):
+        token = match.group(1)
+        if any(p.match(token) for p in NON_TAG_PATTERNS):
+            continue
+        if not any(EQUIPMENT_SEGMENT.match(segment) for segment in token.split("-")):
+            continue
+        has_digit = any(c.isdigit() for c in token)
+        if has_digit or token.isupper():
+            tag = token.upper()
+            if tag not in tags:
+                tags.append(tag)
+    return tags
+
+def normalize_tag(tag: str) -> str:
+    """TAG consultado en el mismo formato que el índice ("uf-a moly" → "UF-A")."""
+    found = extract_tags(tag) or extract_tags(tag.upper())
+    return found[0] if found else tag.strip().upper()
+
+# ----------------------------------------------------
+# CONSTRUCCIÓN INCREMENTAL
+# ----------------------------------------------------
+
+def ensure_schema(conn):
+    conn.executescript(_SCHEMA)
+
+def index_messages(conn, rows: list) -> int:
+    """
+    Indexa (o re-indexa) los mensajes recién ingeridos en el espejo.
+
+    Args:
+        conn: Conexión SQLite del espejo local
+        rows: Filas con id, grupo_id, fecha_utc y contenido_texto
+
+    Returns:
+        Cantidad de entradas TAG → mensaje escritas
+    """
+    if not rows:
+        return 0
+    ensure_schema(conn)
+    conn.executemany("DELETE FROM tag_mensajes WHERE mensaje_id = ?", [(row["id"],) for row in rows])
+    entries = [
+        (tag, row["id"], row.get("grupo_id"), row.get("fecha_utc"))
+        for row in rows
+        for tag in extract_tags(row.get("contenido_texto"))
+    ]
+    conn.executemany("INSERT OR REPLACE INTO tag_mensajes VALUES (?, ?, ?, ?)", entries)
+    return len(entries)
+
+def ensure_index(conn) -> bool:
+    """
+    Reconstruye el índice si no existe o fue creado con otra versión del extractor
+    (por ejemplo, un espejo poblado antes de existir el índice).
+
+    Returns:
+        True si se reconstruyó
+    """
+    ensure_schema(conn)
+    row = conn.execute("SELECT value FROM sync_state WHERE key = 'tag_index_version'").fetchone()
+    if row and row[0] == TAG_INDEX_VERSION:
+        return False
+
+    conn.execute("DELETE FROM tag_mensajes")
+    total = 0
+    cursor = conn.execute("SELECT id, grupo_id, fecha_utc, contenido_texto FROM mensajes")
+    while True:
+        batch = cursor.fetchmany(5000)
+        if not batch:
+            break
+        total += index_messages(conn, [dict(r) for r in batch])
+    conn.execute(
+        "INSERT INTO sync_state (key, value) VALUES ('tag_index_version', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (TAG_INDEX_VERSION,)
+    )
+    conn.commit()
+    if total:
+        print(f"   🏷️ Índice de TAGs reconstruido: {total:,} entradas")
+    return True
+
+# ----------------------------------------------------
+# CONSULTAS
+# ----------------------------------------------------
+
+def _connect(path: str = None):
+    import message_mirror
+    if not (path or message_mirror.is_enabled()):
+        raise RuntimeError("El índice de TAGs requiere el espejo local (LOCAL_MIRROR_PATH)")
+    conn = message_mirror._connect(path)
+    ensure_index(conn)
+    return conn
+
+def _window(start: str, end: str) -> tuple:
+    from message_mirror import normalize_timestamp
+    clauses, params = [], []
+    if start:
+        clauses.append("t.fecha_utc >= ?")
+        params.append(normalize_timestamp(start))
+    if end:
+        clauses.append("t.fecha_utc <= ?")
+        params.append(normalize_timestamp(end))
+    return "".join(f" AND {c}" for c in clauses), params
+
+def lookup(tag: str, start: str = None, end: str = None, path: str = None) -> dict:
+    """
+    Resumen de un TAG: mensajes, grupos y rango de fechas en que aparece.
+
+    Args:
+        tag: TAG del equipo (ej: "762-ER-001")
+        start: Inicio opcional (ISO)
+        end: Fin opcional (ISO)
+
+    Returns:
+        Dict {tag, total, mensaje_ids, grupos, desde, hasta}
+    """
+    tag = normalize_tag(tag)
+    where, params = _window(start, end)
+    conn = _connect(path)
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT t.mensaje_id, t.grupo_id, t.fecha_utc
+            FROM tag_mensajes t JOIN mensajes m ON m.id = t.mensaje_id
+            WHERE t.tag = ? AND m.deleted_at IS NULL{where}
+            ORDER BY t.fecha_utc, t.mensaje_id
+            """,
+            [tag, *params]
+        ).fetchall()
+    finally:
+        conn.close()
+
+    return {
+        "tag": tag,
+        "total": len(rows),
+        "mensaje_ids": [r["mensaje_id"] for r in rows],
+        "grupos": sorted({r["grupo_id"] for r in rows if r["grupo_id"] is not None}),
+        "desde": rows[0]["fecha_utc"] if rows else None,
+        "hasta": rows[-1]["fecha_utc"] if rows else None
+    }
+
+def get_tag_history(tag: str, start: str = None, end: str = None, path: str = None) -> list:
+    """
+    Historial completo de mensajes de un equipo, en orden cronológico.
+
+    Returns:
+        Lista de mensajes con el mismo formato que get_messages_by_date_range
+    """
+    from message_mirror import _row_to_message
+    tag = normalize_tag(tag)
+    where, params = _window(start, end)
+    conn = _connect(path)
+    try:
+        return [_row_to_message(row) for row in conn.execute(
+            f"""
+            SELECT m.* FROM tag_mensajes t JOIN mensajes m ON m.id = t.mensaje_id
+            WHERE t.tag = ? AND m.deleted_at IS NULL{where}
+            ORDER BY m.fecha_utc, m.id
+            """,
+            [tag, *params]
+        )]
+    finally:
+        conn.close()
+
+def top_tags(start: str = None, end: str = None, limit: int = 20, path: str = None) -> list:
+    """
+    TAGs más mencionados en una ventana.
+
+    Returns:
+        Lista de dicts {tag, mensajes, grupos}
+    """
+    where, params = _window(start, end)
+    conn = _connect(path)
+    try:
+        return [dict(row) for row in conn.execute(
+            f"""
+            SELECT t.tag, COUNT(*) AS mensajes, COUNT(DISTINCT t.grupo_id) AS grupos
+            FROM tag_mensajes t JOIN mensajes m ON m.id = t.mensaje_id
+            WHERE m.deleted_at IS NULL{where}
+            GROUP BY t.tag
+            ORDER BY mensajes DESC, t.tag
+            LIMIT ?
+            """,
+            [*params, limit]
+        )]
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Consulta del historial de un equipo por TAG")
+    parser.add_argument("tag", nargs="?", help="TAG del equipo (sin TAG: ranking de TAGs)")
+    parser.add_argument("--desde", help="Inicio de la ventana (ISO)")
+    parser.add_argument("--hasta", help="Fin de la ventana (ISO)")
+    parser.add_argument("--db", help="Base del espejo local (default LOCAL_MIRROR_PATH)")
+    args = parser.parse_args()
+
+    if not args.tag:
+        for row in top_tags(args.desde, args.hasta, path=args.db):
+            print(f"   🏷️ {row['tag']:<16} {row['mensajes']:>6} mensajes  {row['grupos']} grupos")
+        return
+
+    summary = lookup(args.tag, args.desde, args.hasta, path=args.db)
+    print(f"🏷️ {summary['tag']}: {summary['total']} mensajes en grupos {summary['grupos']} "
+          f"({summary['desde']} → {summary['hasta']})")
+    for msg in get_tag_history(args.tag, args.desde, args.hasta, path=args.db):
+        print(f"   [{msg['fecha_hora']}] G{msg['grupo_id']} {msg['remitente']}: {msg['contenido_texto']}")
+
+if __name__ == "__main__":
+    main()
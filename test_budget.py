@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+import budget
+
+MODEL = "claude-sonnet-4-20250514"
+
+
+def _response(input_tokens, output_tokens):
+    return SimpleNamespace(usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens))
+
+
+def test_concurrent_plans_share_the_remaining_budget():
+    run = budget.RunBudget(max_output_tokens=20000)
+
+    decisions = [run.plan(f"seccion.{i}", "x" * 350, 8000, MODEL, budget.PRIORITY_LOW) for i in range(7)]
+
+    planned = [d.max_tokens for d in decisions if not d.skip]
+    assert sum(planned) <= 20000
+    assert [d.skip for d in decisions].count(True) == 4
+
+
+def test_record_settles_reservation_against_actual_usage():
+    run = budget.RunBudget(max_output_tokens=20000)
+    decision = run.plan("sintesis", "x" * 350, 8000, MODEL)
+
+    run.record("sintesis", decision.model, _response(100, 3000), decision=decision)
+
+    assert (run.reserved_input_tokens, run.reserved_output_tokens) == (0, 0)
+    assert run.used_output_tokens == 3000
+    assert run.plan("otra", "x" * 350, 17000, MODEL).max_tokens == 17000
+
+
+def test_release_frees_a_failed_call():
+    run = budget.RunBudget(max_output_tokens=10000)
+    decision = run.plan("sintesis", "x" * 350, 8000, MODEL)
+
+    run.release(decision)
+    run.release(decision)
+
+    assert run.reserved_output_tokens == 0
@@ -0,0 +1,19 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from context_packing import render_compact
+
+
+def test_compact_format_uses_site_local_time(monkeypatch):
+    monkeypatch.setattr("context_packing.SITE_TIMEZONE", "America/Santiago")
+    messages = [
+        {"fecha_hora": "2025-12-09T02:30:00+00:00", "remitente": "Ana", "contenido_texto": "Inicio turno noche"},
+        {"fecha_hora": "2025-12-09T12:05:00Z", "remitente": "Luis", "contenido_texto": "P-101 detenida"},
+    ]
+
+    text = render_compact(messages)
+
+    assert "America/Santiago" in text
+    assert "## 2025-12-08\n23:30 R1: Inicio turno noche" in text
+    assert "## 2025-12-09\n09:05 R2: P-101 detenida" in text
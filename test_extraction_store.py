@@ -0,0 +1,41 @@
+from extraction_store import build_extraction_rows
+
+MESSAGES = [{"id": 1, "grupo_id": 3, "contenido_texto": "Demoras en P-101"}]
+
+
+def test_distinct_rows_in_one_run_are_kept():
+    analyses = {
+        "pass.demoras": {"demoras": [
+            {"actividad": "Cambio de correa", "fecha": "2025-12-08", "responsable": "Mantención"},
+            {"actividad": "Izaje de motor", "fecha": "2025-12-08", "responsable": "Mantención"},
+        ]},
+        "pass.seguridad": {
+            "incidentes": [
+                {"fecha": "2025-12-08", "tipo": "FTF", "empresa": "ACME", "descripcion": "Golpe en mano"},
+                {"fecha": "2025-12-08", "tipo": "FTF", "empresa": "ACME", "descripcion": "Caída a nivel"},
+            ],
+            "hallazgos": [
+                {"fecha": "2025-12-08", "tipo": "CI", "ubicacion": "Chancado", "descripcion": "Baranda suelta"},
+                {"fecha": "2025-12-08", "tipo": "CI", "ubicacion": "Chancado", "descripcion": "Baranda suelta",
+                 "estado": "abierto"},
+            ],
+        },
+    }
+
+    tables = build_extraction_rows(analyses, MESSAGES, "r1", "p")
+
+    for table in ("extraccion_demoras", "extraccion_incidentes", "extraccion_hallazgos"):
+        assert len({row["row_key"] for row in tables[table]}) == 2, table
+
+
+def test_repeated_identical_row_is_written_once():
+    demora = {"actividad": "Izaje de motor", "fecha": "2025-12-08", "responsable": "Mantención"}
+    tables = build_extraction_rows({"pass.demoras": {"demoras": [demora, dict(demora)]}}, MESSAGES, "r1", "p")
+    assert len(tables["extraccion_demoras"]) == 1
+
+
+def test_row_key_is_stable_across_runs():
+    analyses = {"pass.demoras": {"demoras": [{"actividad": "Izaje de motor", "fecha": "2025-12-08"}]}}
+    first = build_extraction_rows(analyses, MESSAGES, "r1", "p")["extraccion_demoras"][0]
+    second = build_extraction_rows(analyses, MESSAGES, "r2", "otro")["extraccion_demoras"][0]
+    assert first["row_key"] == second["row_key"]
@@ -0,0 +1,24 @@
+from report_tables import insert_tables
+
+ANALYSES = {"pass.demoras": {"quiebres_plan": [{"qp_numero": "QP-1", "equipo": "P-101"}]}}
+
+
+def test_missing_marker_replaces_synthesis_table():
+    report = (
+        "### 2.1 Quiebres de Plan\n\n"
+        "| QP | Equipo |\n|---|---|\n| QP-9 | X |\n\n"
+        "Análisis narrativo.\n\n"
+        "### 2.2 Demoras\n"
+    )
+
+    result = insert_tables(report, ANALYSES, ["2"])
+
+    section = result.split("### 2.2")[0]
+    assert section.count("\n|---") == 1
+    assert "QP-9" not in section and "`P-101`" in section
+    assert "Análisis narrativo." in section
+
+
+def test_marker_is_replaced_in_place():
+    report = "### 2.1 Quiebres de Plan\n\n[[TABLA_QP]]\n"
+    assert "`P-101`" in insert_tables(report, ANALYSES, ["2"])
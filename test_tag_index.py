@@ -0,0 +1,20 @@
+import json
+
+from tag_index import extract_tags, normalize_tag
+
+
+def test_equipment_tags_are_extracted():
+    text = "Falla en P-101: sello, 762-ER-001; AND-SPS-502 detenido, LAT-110-A ok, UF-A Moly en servicio"
+    assert extract_tags(text) == ["P-101", "762-ER-001", "AND-SPS-502", "LAT-110-A", "UF-A"]
+    assert normalize_tag("uf-a moly") == "UF-A"
+
+
+def test_dates_times_and_ranges_are_not_tags():
+    for text in ["2025-12-09T08:30", "09-12-2025", "2025-12-09", "2-3hrs", "7-19h", "turno 7-19",
+                 "120-130m3/h", "COVID-19", "bien-estar", "08:30-09:15"]:
+        assert extract_tags(text) == [], text
+
+
+def test_serialized_rows_only_yield_equipment_tags():
+    row = {"fecha": "2025-12-09T08:30:00", "equipo": "P-101", "duracion": "2-3hrs", "flujo": "120-130m3/h"}
+    assert extract_tags(json.dumps(row, ensure_ascii=False)) == ["P-101"]
@@ -0,0 +1,76 @@
+import sqlite3
+from datetime import datetime
+
+from trend_engine import build_trends, extract_events, insert_trends, TRENDS_UNAVAILABLE
+
+NOW = datetime(2025, 12, 9, 8, 0)
+
+
+def test_malformed_pass_output_is_skipped():
+    analyses = {
+        "pass.demoras": {
+            "quiebres_plan": ["QP 123 detención por permiso", None,
+                              {"equipo": "P-101", "razon": "Falta de permiso", "fecha": "2025-12-08"}],
+            "demoras": "No reportado",
+        },
+        "pass.actividades": {"actividades": "No reportado"},
+        "pass.seguridad": ["incidente sin estructura"],
+        "pass.produccion": {"disponibilidad": [{"equipo": "GR-110", "tiempo_detenido_h": 2,
+                                                "causas_detencion": ["falla", 3]}, 42]},
+    }
+
+    events = extract_events(analyses, NOW)
+
+    assert [(e["tipo"], e["equipo"]) for e in events] == [("quiebre_plan", "P-101"), ("detencion", "GR-110")]
+
+
+def test_build_trends_accepts_any_shape():
+    assert build_trends("r1", "p", {"pass.demoras": {"quiebres_plan": ["QP 123 ..."]}}, NOW)
+    assert build_trends("r2", "p", {"pass.actividades": {"actividades": "No reportado"}}, NOW)
+    assert build_trends("r3", "p", None, NOW)
+
+
+def test_insert_trends_without_tables():
+    report = "## 6. ANÁLISIS DE TENDENCIAS\n\n[[TABLAS_TENDENCIAS]]\n"
+    assert TRENDS_UNAVAILABLE.strip() in insert_trends(report, None)
+
+
+def test_event_identity_ignores_prose_and_run_date(tmp_path):
+    db = str(tmp_path / "trends.db")
+    messages = [{"id": 7, "fecha_hora": "2025-12-08T14:05:00", "contenido_texto": "Falla en P-101, se detiene"}]
+    first = {"pass.demoras": {"quiebres_plan": [{"equipo": "P-101", "razon": "Falla de sello"}]}}
+    second = {"pass.demoras": {"quiebres_plan": [{"equipo": "P-101", "razon": "Sello dañado en bomba P-101"}]}}
+
+    build_trends("r1", "p", first, NOW, path=db, messages=messages)
+    build_trends("r2", "p", second, datetime(2025, 12, 10, 8, 0), path=db, messages=messages)
+
+    rows = sqlite3.connect(db).execute("SELECT fecha, equipo FROM eventos").fetchall()
+    assert rows == [("2025-12-08", "P-101")]
+
+
+def test_same_day_rows_are_separate_events(tmp_path):
+    db = str(tmp_path / "trends.db")
+    analyses = {
+        "pass.demoras": {
+            "quiebres_plan": [{"qp_numero": "QP 12", "fecha": "2025-12-08", "area": "Chancado", "equipo": "P-101"}],
+            "demoras": [
+                {"actividad": "Cambio de correa CV-002 en Chancado", "fecha": "2025-12-08", "demora_horas": 2},
+                {"actividad": "Espera de grúa", "fecha": "2025-12-08", "demora_horas": 1},
+                {"actividad": "Espera de permiso", "fecha": "2025-12-08", "demora_horas": 1.5},
+            ],
+        },
+        "pass.seguridad": {"incidentes": [
+            {"fecha": "2025-12-08", "tipo": "FTF", "empresa": "ACME", "descripcion": "Golpe en mano"},
+            {"fecha": "2025-12-08", "tipo": "FTF", "empresa": "ACME", "descripcion": "Caída a nivel"},
+        ]},
+    }
+
+    build_trends("r1", "p", analyses, NOW, path=db)
+    report = build_trends("r2", "p", analyses, NOW, path=db)
+
+    conn = sqlite3.connect(db)
+    assert conn.execute("SELECT COUNT(*) FROM eventos").fetchone()[0] == 6
+    assert conn.execute(
+        "SELECT equipo, area FROM eventos WHERE tipo = 'demora' AND equipo IS NOT NULL"
+    ).fetchall() == [("CV-002", "Chancado")]
+    assert "| 1 | ACME | 2 | 2 | 2 | 2 | 0 |" in report
@@ -0,0 +1,202 @@
+"""
+Trazas y Métricas Estructuradas por Etapa
+Minera Centinela - GSdSO
+Cada etapa del pipeline se registra como un span en formato JSON lines
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+# Configuración de salida
+TRACE_STDOUT = os.environ.get("TRACE_STDOUT", "true").lower() == "true"  # Imprimir spans en logs
+METRICS_FILE = os.environ.get("METRICS_FILE")          # Archivo JSONL local (opcional)
+METRICS_ENDPOINT = os.environ.get("METRICS_ENDPOINT")  # URL que recibe los spans por POST (opcional)
+
+# Contadores que todo span reporta (0 si la etapa no los usa)
+SPAN_COUNTERS = ("rows", "prompt_tokens", "completion_tokens", "cache_hits", "retries", "errors")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_run = {"run_id": None, "started_at": None, "spans": []}
+# Envoltura opcional de las etapas de primer nivel (stage_profiler.py)
+_stage_hook = None
+
+class Span:
+    """
+    Etapa medida del pipeline. Se crea con span() y se emite al cerrarse.
+    """
+
+    def __init__(self, name: str, parent_id: str = None, **attrs):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = dict(attrs)
+        self.counters = {key: 0 for key in SPAN_COUNTERS}
+        self.status = "ok"
+        self.error = None
+        self._start = time.perf_counter()
+        self.started_at = datetime.now().isoformat()
+        self.duration_ms = None
+
+    def set(self, **attrs):
+        """Asigna atributos descriptivos (modelo, bytes, grupo, etc.)."""
+        self.attrs.update(attrs)
+
+    def add(self, **counters):
+        """Incrementa contadores numéricos (rows, tokens, cache_hits, retries, errors)."""
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + (value or 0)
+
+    def record_usage(self, response):
+        """Suma los tokens reportados por una respuesta de Claude (response.usage)."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        self.add(
+            prompt_tokens=getattr(usage, "input_tokens", 0),
+            completion_tokens=getattr(usage, "output_tokens", 0)
+        )
+
+    def fail(self, error):
+        """Marca el span como fallido sin interrumpir el flujo del pipeline."""
+        self.status = "error"
+        self.error = f"{error.__class__.__name__}: {error}" if isinstance(error, Exception) else str(error)
+        self.add(errors=1)
+
+    def to_dict(self) -> dict:
+        return {
+            "run_id": _run["run_id"],
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            **self.counters,
+            "attrs": self.attrs
+        }
+
+def start_run(run_id: str = None, **attrs) -> str:
+    """
+    Inicia una ejecución del reporte. Todos los spans posteriores llevan su run_id.
+
+    Returns:
+        run_id de la ejecución
+    """
+    with _lock:
+        _run["run_id"] = run_id or datetime.now().strftime("%Y%m%d%H%M%S-") + uuid.uuid4().hex[:6]
+        _run["started_at"] = time.perf_counter()
+        _run["spans"] = []
+    _emit({"run_id": _run["run_id"], "name": "run.start", "started_at": datetime.now().isoformat(), "attrs": attrs})
+    return _run["run_id"]
+
+def get_run_id() -> str:
+    return _run["run_id"]
+
+def set_stage_hook(hook):
+    """
+    Registra una función hook(nombre) -> context manager que envuelve cada
+    span sin padre (etapa de primer nivel). None la desactiva.
+    """
+    global _stage_hook
+    _stage_hook = hook
+
+def current_span() -> Span:
+    """Span activo en el contexto actual (o None)."""
+    return _current_span.get()
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Mide una etapa del pipeline.
+
+    Uso:
+        with span("fetch", window_hours=24) as s:
+            messages = ...
+            s.add(rows=len(messages))
+
+    Las excepciones se registran en el span y se vuelven a lanzar.
+    """
+    parent = _current_span.get()
+    s = Span(name, parent_id=parent.span_id if parent else None, **attrs)
+    token = _current_span.set(s)
+    hook = _stage_hook if parent is None else None
+    try:
+        with hook(name) if hook else nullcontext():
+            yield s
+    except Exception as e:
+        s.fail(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        s.duration_ms = round((time.perf_counter() - s._start) * 1000, 2)
+        record = s.to_dict()
+        with _lock:
+            _run["spans"].append(record)
+        _emit(record)
+
+def end_run(**attrs) -> dict:
+    """
+    Cierra la ejecución: emite un resumen por etapa y envía los spans al endpoint.
+
+    Returns:
+        Resumen {total_ms, stages: {nombre: {duration_ms, tokens...}}}
+    """
+    with _lock:
+        spans = list(_run["spans"])
+        started = _run["started_at"]
+
+    stages = {}
+    for record in spans:
+        stage = stages.setdefault(record["name"], {"count": 0, "duration_ms": 0.0,
+                                                   **{key: 0 for key in SPAN_COUNTERS}})
+        stage["count"] += 1
+        stage["duration_ms"] = round(stage["duration_ms"] + (record["duration_ms"] or 0), 2)
+        for key in SPAN_COUNTERS:
+            stage[key] += record.get(key, 0) or 0
+
+    summary = {
+        "run_id": _run["run_id"],
+        "name": "run.summary",
+        "total_ms": round((time.perf_counter() - started) * 1000, 2) if started else None,
+        "stages": stages,
+        "attrs": attrs
+    }
+    _emit(summary)
+    _push_to_endpoint(spans + [summary])
+    return summary
+
+def _emit(record: dict):
+    line = json.dumps(record, ensure_ascii=False, default=str)
+
+    if TRACE_STDOUT:
+        print(line)
+
+    if METRICS_FILE:
+        try:
+            with _lock, open(METRICS_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"⚠️ No se pudo escribir métricas en {METRICS_FILE}: {e}")
+
+def _push_to_endpoint(records: list):
+    if not METRICS_ENDPOINT or not records:
+        return
+    try:
+        import requests
+        payload = "\n".join(json.dumps(r, ensure_ascii=False, default=str) for r in records)
+        requests.post(
+            METRICS_ENDPOINT,
+            data=payload.encode("utf-8"),
+            headers={"Content-Type": "application/x-ndjson"},
+            timeout=10
+        )
+    except Exception as e:
+        print(f"⚠️ No se pudieron enviar métricas a {METRICS_ENDPOINT}: {e}")
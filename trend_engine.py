@@ -0,0 +1,450 @@
+"""
+Motor de Tendencias entre Ejecuciones
+Minera Centinela - GSdSO
+Persiste los resultados de extracción de cada ejecución y calcula recurrencia,
+horas de demora acumuladas y rankings por TAG, área y empresa (sección 6 del reporte)
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from collections import Counter
+from datetime import datetime, timedelta
+
+from tag_index import extract_tags
+
+# Base SQLite de tendencias. Sin ruta, las tendencias se calculan solo con la ejecución actual.
+TRENDS_DB_PATH = os.environ.get("TRENDS_DB_PATH")
+TRENDS_HORIZONS_DAYS = [int(d) for d in os.environ.get("TRENDS_HORIZONS_DAYS", "7,30,90").split(",") if d.strip()]
+TRENDS_TOP_N = int(os.environ.get("TRENDS_TOP_N", "10"))
+
+# Marcador que la síntesis deja en la sección 6 y que se reemplaza por las tablas precalculadas
+TRENDS_PLACEHOLDER = "[[TABLAS_TENDENCIAS]]"
+# Texto de la sección 6 cuando las tendencias no se pudieron calcular
+TRENDS_UNAVAILABLE = "*Tendencias no disponibles en esta ejecución.*\n"
+
+# Tipos de evento que cuentan como falla o pérdida de tiempo de equipo
+FAILURE_EVENT_TYPES = ("quiebre_plan", "demora", "correctivo", "detencion", "incidente")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ejecuciones (
+    run_id TEXT PRIMARY KEY,
+    generado TEXT NOT NULL,
+    periodo TEXT,
+    extraccion TEXT
+);
+CREATE TABLE IF NOT EXISTS eventos (
+    event_id TEXT PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    equipo TEXT,
+    area TEXT,
+    empresa TEXT,
+    demora_horas REAL,
+    descripcion TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_eventos_fecha ON eventos (fecha);
+"""
+
+_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y", "%Y/%m/%d")
+
+def _connect(path: str = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or TRENDS_DB_PATH or ":memory:", timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    return conn
+
+def _clean(value) -> str:
+    """Texto normalizado; None para vacíos y "No reportado"."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text or text.lower() in ("no reportado", "null", "none", "n/a", "-"):
+        return None
+    return text
+
+def _normalize_tag(value) -> str:
+    text = _clean(value)
+    return re.sub(r"\s+", " ", text.strip("`")).upper() if text else None
+
+def _parse_date(value, default: datetime) -> str:
+    """Fecha del evento en ISO (YYYY-MM-DD). Si no se puede interpretar, usa la fecha de la ejecución."""
+    text = _clean(value)
+    if text:
+        candidate = text[:10]
+        for fmt in _DATE_FORMATS:
+            try:
+                return datetime.strptime(candidate, fmt).strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+    return default.strftime("%Y-%m-%d")
+
+def _to_hours(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"\d+(?:[.,]\d+)?", str(value or ""))
+    return float(match.group().replace(",", ".")) if match else 0.0
+
+def _rows(section, key: str) -> list:
+    """Objetos de un arreglo de la pasada; se ignoran contenedores e ítems que no tengan la forma esperada."""
+    items = section.get(key) if isinstance(section, dict) else None
+    if not isinstance(items, list):
+        return []
+    return [item for item in items if isinstance(item, dict)]
+
+def _source_index(messages: list) -> dict:
+    """Índice TAG → [(fecha, id)] de los mensajes de la ventana, ordenado por fecha."""
+    index = {}
+    for msg in messages or []:
+        for tag in extract_tags(msg.get("contenido_texto")):
+            index.setdefault(tag, []).append((str(msg.get("fecha_hora") or ""), msg.get("id")))
+    for sources in index.values():
+        sources.sort(key=lambda source: (source[0], str(source[1])))
+    return index
+
+def _first_source(item: dict, index: dict) -> tuple:
+    """
+    Primer mensaje de la ventana que menciona alguno de los TAGs de la fila: (fecha, id)
+    o None. Las pasadas no devuelven ids de mensajes; el origen se reconstruye por TAG.
+    """
+    sources = [
+        source
+        for tag in extract_tags(json.dumps(item, ensure_ascii=False, default=str))
+        for source in index.get(tag, [])
+    ]
+    return min(sources, key=lambda source: (source[0], str(source[1]))) if sources else None
+
+def _known_areas(analyses: dict) -> list:
+    """Áreas informadas en forma estructurada en la ejecución (QP, actividades, hallazgos), más largas primero."""
+    areas = {_clean(qp.get("area")) for qp in _rows(analyses.get("pass.demoras"), "quiebres_plan")}
+    for act in _rows(analyses.get("pass.actividades"), "actividades"):
+        ubicacion = act.get("ubicacion")
+        areas.add(_clean(ubicacion.get("area") if isinstance(ubicacion, dict) else ubicacion))
+    areas.update(_clean(h.get("ubicacion")) for h in _rows(analyses.get("pass.seguridad"), "hallazgos"))
+    return sorted((a for a in areas if a), key=len, reverse=True)
+
+def _area_in(text, areas: list) -> str:
+    """Primera área conocida mencionada en el texto (ej. la ubicación dentro de la actividad de una demora)."""
+    lowered = str(text or "").lower()
+    return next((area for area in areas if re.search(rf"(?<!\w){re.escape(area.lower())}(?!\w)", lowered)), None)
+
+# ----------------------------------------------------
+# EXTRACCIÓN DE EVENTOS
+# ----------------------------------------------------
+
+def extract_events(analyses: dict, generated_at: datetime, messages: list = None) -> list:
+    """
+    Normaliza la salida de las cuatro pasadas en eventos comparables entre ejecuciones.
+
+    Args:
+        analyses: Dict {"pass.demoras": {...}, "pass.actividades": {...}, ...}
+        generated_at: Hora de la ejecución (fecha por defecto de los eventos)
+        messages: Mensajes analizados; sin fecha explícita, el evento toma la fecha
+                  del primer mensaje que menciona su TAG
+
+    Returns:
+        Lista de eventos {fecha, tipo, equipo, area, empresa, demora_horas, descripcion,
+        referencia, mensaje_id}
+    """
+    events = []
+    analyses = analyses if isinstance(analyses, dict) else {}
+    index = _source_index(messages)
+    areas = _known_areas(analyses)
+
+    def add(item, tipo, fecha, equipo=None, area=None, empresa=None, demora_horas=None,
+            descripcion=None, referencia=None):
+        source = _first_source(item, index)
+        if source and not _clean(fecha):
+            fecha = source[0][:10] or None
+        events.append({
+            "fecha": _parse_date(fecha, generated_at),
+            "tipo": tipo,
+            "equipo": _normalize_tag(equipo),
+            "area": _clean(area),
+            "empresa": _clean(empresa),
+            "demora_horas": _to_hours(demora_horas),
+            "descripcion": _clean(descripcion),
+            "referencia": _clean(referencia),
+            "mensaje_id": source[1] if source else None
+        })
+
+    demoras = analyses.get("pass.demoras")
+    for qp in _rows(demoras, "quiebres_plan"):
+        add(qp, "quiebre_plan", qp.get("fecha"), qp.get("equipo"), qp.get("area"),
+            demora_horas=qp.get("demora_horas"), descripcion=qp.get("razon"),
+            referencia=qp.get("qp_numero"))
+    for demora in _rows(demoras, "demoras"):
+        # La pasada no tiene columnas de equipo ni área: se toman de la actividad
+        # ("Cambio motor 762-ER-001 en sala eléctrica SSEE")
+        tags = extract_tags(demora.get("actividad"))
+        add(demora, "demora", demora.get("fecha"), tags[0] if tags else None,
+            _area_in(demora.get("actividad"), areas), demora_horas=demora.get("demora_horas"),
+            descripcion=demora.get("actividad"))
+
+    for act in _rows(analyses.get("pass.actividades"), "actividades"):
+        equipo = act.get("equipo") or {}
+        ubicacion = act.get("ubicacion") or {}
+        ejecutor = act.get("ejecutor") or {}
+        tiempos = act.get("tiempos") or {}
+        if not isinstance(equipo, dict):
+            equipo = {"tag": equipo}
+        if not isinstance(ubicacion, dict):
+            ubicacion = {"area": ubicacion}
+        if not isinstance(ejecutor, dict):
+            ejecutor = {"empresa": ejecutor}
+        tipo = "correctivo" if "correctiv" in str(act.get("tipo") or "").lower() else "actividad"
+        add(act, tipo, tiempos.get("inicio_real") if isinstance(tiempos, dict) else None,
+            equipo.get("tag") or equipo.get("nombre"), ubicacion.get("area") or ubicacion.get("planta"),
+            ejecutor.get("empresa"), tiempos.get("demora_horas") if isinstance(tiempos, dict) else None,
+            act.get("descripcion"))
+
+    seguridad = analyses.get("pass.seguridad")
+    for inc in _rows(seguridad, "incidentes"):
+        add(inc, "incidente", inc.get("fecha"), empresa=inc.get("empresa"), descripcion=inc.get("descripcion"))
+    for hallazgo in _rows(seguridad, "hallazgos"):
+        add(hallazgo, "hallazgo", hallazgo.get("fecha"), area=hallazgo.get("ubicacion"),
+            descripcion=hallazgo.get("descripcion"))
+
+    for disp in _rows(analyses.get("pass.produccion"), "disponibilidad"):
+        if _to_hours(disp.get("tiempo_detenido_h")) > 0:
+            causas = disp.get("causas_detencion")
+            add(disp, "detencion", None, disp.get("equipo"), demora_horas=disp.get("tiempo_detenido_h"),
+                descripcion=", ".join(map(str, causas)) if isinstance(causas, list) else causas)
+
+    return events
+
+def _event_id(event: dict, ordinal: int = 1) -> str:
+    """
+    Identidad del evento: el mismo evento visto por ejecuciones con ventanas
+    superpuestas se cuenta una sola vez.
+
+    Se usan los campos estructurados (tipo, TAG, área, empresa, N° de QP y
+    fecha, tomada del mensaje de origen cuando la pasada no la informa) y el
+    mensaje de origen, nunca el texto libre: el modelo redacta distinto la misma
+    descripción en cada ejecución. Los eventos de una ejecución que coinciden en
+    todo eso se distinguen por su ordinal (ver _event_ids).
+    """
+    fields = ["tipo", "equipo", "area", "empresa", "referencia", "fecha", "mensaje_id"]
+    key = "|".join(str(event.get(k) or "").lower() for k in fields)
+    if ordinal > 1:
+        key += f"#{ordinal}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+def _event_ids(events: list) -> list:
+    """Ids de los eventos de una ejecución: dentro de la misma ejecución nunca se fusionan dos filas."""
+    seen = Counter()
+    ids = []
+    for event in events:
+        base = _event_id(event)
+        seen[base] += 1
+        ids.append(_event_id(event, seen[base]))
+    return ids
+
+def record_run(conn, run_id: str, periodo_texto: str, analyses: dict, generated_at: datetime,
+               messages: list = None) -> int:
+    """
+    Persiste la extracción de una ejecución y sus eventos. Una ejecución que se
+    registra de nuevo (actualización incremental) reemplaza sus eventos anteriores.
+
+    Returns:
+        Cantidad de eventos nuevos
+    """
+    events = extract_events(analyses, generated_at, messages)
+    conn.execute(
+        "INSERT OR REPLACE INTO ejecuciones (run_id, generado, periodo, extraccion) VALUES (?, ?, ?, ?)",
+        (run_id, generated_at.isoformat(), periodo_texto, json.dumps(analyses, ensure_ascii=False, default=str))
+    )
+    previous = conn.execute("DELETE FROM eventos WHERE run_id = ?", (run_id,)).rowcount
+    before = conn.total_changes
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO eventos (event_id, run_id, fecha, tipo, equipo, area, empresa, demora_horas, descripcion)
+        VALUES (:event_id, :run_id, :fecha, :tipo, :equipo, :area, :empresa, :demora_horas, :descripcion)
+        """,
+        [{**event, "event_id": event_id, "run_id": run_id} for event, event_id in zip(events, _event_ids(events))]
+    )
+    conn.commit()
+    return max(0, conn.total_changes - before - previous)
+
+# ----------------------------------------------------
+# CÁLCULO DE TENDENCIAS
+# ----------------------------------------------------
+
+def compute_trends(conn, now: datetime, horizons: list = None, top_n: int = None) -> dict:
+    """
+    Rankings por equipo (fallas recurrentes), área y empresa en cada horizonte.
+
+    Args:
+        conn: Conexión a la base de tendencias
+        now: Fin de los horizontes (hora de la ejecución)
+        horizons: Horizontes en días (por defecto TRENDS_HORIZONS_DAYS)
+        top_n: Filas máximas por ranking
+
+    Returns:
+        Dict {horizons, equipos, areas, empresas, ejecuciones}
+    """
+    horizons = sorted(horizons or TRENDS_HORIZONS_DAYS)
+    top_n = top_n or TRENDS_TOP_N
+    longest = horizons[-1]
+    since = {h: (now - timedelta(days=h)).strftime("%Y-%m-%d") for h in horizons}
+    failure_types = ",".join("?" * len(FAILURE_EVENT_TYPES))
+
+    counts_by_horizon = ", ".join(
+        f"SUM(CASE WHEN fecha >= '{since[h]}' THEN 1 ELSE 0 END) AS eventos_{h}d" for h in horizons
+    )
+
+    equipos = [dict(row) for row in conn.execute(
+        f"""
+        SELECT equipo, {counts_by_horizon},
+               COUNT(DISTINCT fecha) AS dias_con_falla,
+               ROUND(SUM(demora_horas), 1) AS demora_horas,
+               MAX(fecha) AS ultimo_evento,
+               GROUP_CONCAT(DISTINCT tipo) AS tipos
+        FROM eventos
+        WHERE equipo IS NOT NULL AND tipo IN ({failure_types}) AND fecha >= ?
+        GROUP BY equipo
+        HAVING COUNT(*) >= 2
+        ORDER BY dias_con_falla DESC, COUNT(*) DESC, demora_horas DESC, equipo
+        LIMIT ?
+        """,
+        (*FAILURE_EVENT_TYPES, since[longest], top_n)
+    )]
+
+    areas = [dict(row) for row in conn.execute(
+        f"""
+        SELECT area, {counts_by_horizon},
+               ROUND(SUM(demora_horas), 1) AS demora_horas,
+               GROUP_CONCAT(DISTINCT empresa) AS empresas
+        FROM eventos
+        WHERE area IS NOT NULL AND tipo IN ('actividad', 'correctivo', 'demora') AND fecha >= ?
+        GROUP BY area
+        ORDER BY eventos_{horizons[0]}d DESC, COUNT(*) DESC, area
+        LIMIT ?
+        """,
+        (since[longest], top_n)
+    )]
+
+    empresas = [dict(row) for row in conn.execute(
+        f"""
+        SELECT empresa, {counts_by_horizon},
+               SUM(CASE WHEN tipo = 'incidente' THEN 1 ELSE 0 END) AS incidentes,
+               ROUND(SUM(demora_horas), 1) AS demora_horas
+        FROM eventos
+        WHERE empresa IS NOT NULL AND fecha >= ?
+        GROUP BY empresa
+        ORDER BY eventos_{horizons[0]}d DESC, COUNT(*) DESC, empresa
+        LIMIT ?
+        """,
+        (since[longest], top_n)
+    )]
+
+    ejecuciones = conn.execute(
+        "SELECT COUNT(*) FROM ejecuciones WHERE generado >= ?",
+        ((now - timedelta(days=longest)).isoformat(),)
+    ).fetchone()[0]
+
+    return {"horizons": horizons, "equipos": equipos, "areas": areas,
+            "empresas": empresas, "ejecuciones": ejecuciones}
+
+def render_trends_markdown(trends: dict) -> str:
+    """
+    Tablas Markdown de la sección 6 a partir de compute_trends().
+    """
+    horizons = trends["horizons"]
+    longest = horizons[-1]
+    eventos_cols = " | ".join(f"Eventos {h}d" for h in horizons)
+    sep_cols = "|".join("---:" for _ in horizons)
+
+    lines = [
+        f"*Calculado sobre {trends['ejecuciones']} ejecuciones de los últimos {longest} días "
+        f"(eventos deduplicados entre ventanas superpuestas).*",
+        "",
+        "### 6.1 Equipos con Fallas Recurrentes",
+        ""
+    ]
+    if trends["equipos"]:
+        lines += [
+            f"| # | Equipo/TAG | {eventos_cols} | Días con Falla | Horas Demora Acum. | Último Evento | Tipos |",
+            f"|---:|---|{sep_cols}|---:|---:|---|---|"
+        ]
+        for i, row in enumerate(trends["equipos"], 1):
+            counts = " | ".join(str(row[f"eventos_{h}d"]) for h in horizons)
+            lines.append(f"| {i} | `{row['equipo']}` | {counts} | {row['dias_con_falla']} | "
+                         f"{row['demora_horas'] or 0} | {row['ultimo_evento']} | {row['tipos']} |")
+    else:
+        lines.append(f"No se identificaron equipos con fallas repetidas en los últimos {longest} días.")
+
+    lines += ["", "### 6.2 Áreas con Mayor Actividad", ""]
+    if trends["areas"]:
+        lines += [
+            f"| # | Área | {eventos_cols} | Horas Demora Acum. | Empresas |",
+            f"|---:|---|{sep_cols}|---:|---|"
+        ]
+        for i, row in enumerate(trends["areas"], 1):
+            counts = " | ".join(str(row[f"eventos_{h}d"]) for h in horizons)
+            lines.append(f"| {i} | {row['area']} | {counts} | {row['demora_horas'] or 0} | "
+                         f"{row['empresas'] or 'No reportado'} |")
+    else:
+        lines.append("No se registraron actividades con área identificada.")
+
+    lines += ["", "### 6.3 Actividad por Empresa", ""]
+    if trends["empresas"]:
+        lines += [
+            f"| # | Empresa | {eventos_cols} | Incidentes | Horas Demora Acum. |",
+            f"|---:|---|{sep_cols}|---:|---:|"
+        ]
+        for i, row in enumerate(trends["empresas"], 1):
+            counts = " | ".join(str(row[f"eventos_{h}d"]) for h in horizons)
+            lines.append(f"| {i} | {row['empresa']} | {counts} | {row['incidentes']} | {row['demora_horas'] or 0} |")
+    else:
+        lines.append("No se registraron eventos con empresa identificada.")
+
+    return "\n".join(lines) + "\n"
+
+def build_trends(run_id: str, periodo_texto: str, analyses: dict, generated_at: datetime,
+                 path: str = None, messages: list = None) -> str:
+    """
+    Registra la ejecución actual y retorna las tablas de tendencias en Markdown.
+
+    Args:
+        run_id: Identificador de la ejecución (tracing.get_run_id())
+        periodo_texto: Descripción del período
+        analyses: Salida de las pasadas de extracción
+        generated_at: Hora de la ejecución
+        path: Base SQLite (por defecto TRENDS_DB_PATH)
+        messages: Mensajes analizados (origen y fecha de los eventos sin fecha explícita)
+    """
+    run_id = run_id or generated_at.strftime("%Y%m%d%H%M%S")
+    conn = _connect(path)
+    try:
+        nuevos = record_run(conn, run_id, periodo_texto, analyses, generated_at, messages)
+        trends = compute_trends(conn, generated_at)
+    finally:
+        conn.close()
+
+    print(f"   📉 Tendencias: {nuevos} eventos nuevos, {len(trends['equipos'])} equipos recurrentes, "
+          f"{trends['ejecuciones']} ejecuciones en el horizonte")
+    return render_trends_markdown(trends)
+
+def insert_trends(report: str, trends_markdown: str) -> str:
+    """
+    Reemplaza el marcador de la sección 6 por las tablas precalculadas. Si la síntesis
+    omitió el marcador, se reemplaza el cuerpo de la sección 6 (o se inserta antes de la 7).
+    Sin tablas (trends_markdown None) se deja TRENDS_UNAVAILABLE.
+    """
+    if not report:
+        return report
+    trends_markdown = trends_markdown or TRENDS_UNAVAILABLE
+    if TRENDS_PLACEHOLDER in report:
+        return report.replace(TRENDS_PLACEHOLDER, trends_markdown.rstrip())
+
+    section = f"## 6. ANÁLISIS DE TENDENCIAS\n\n{trends_markdown}\n---\n\n"
+    start = re.search(r"^## 6\.", report, flags=re.MULTILINE)
+    end = re.search(r"^## 7\.", report, flags=re.MULTILINE)
+    if end:
+        begin = start.start() if start and start.start() < end.start() else end.start()
+        return report[:begin] + section + report[end.start():]
+    return report + "\n\n" + section